@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2018-2022 fjord-technologies
+# SPDX-License-Identifier: GPL-3.0-or-later
+"""auton.classes.blobstore"""
+
+import errno
+import hashlib
+import logging
+import os
+import re
+import shutil
+import tempfile
+import threading
+
+from collections import OrderedDict
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from auton.classes.metrics import METRICS
+
+LOG              = logging.getLogger('auton.blobstore')
+
+DEFAULT_MAX_SIZE = 1073741824
+READ_SIZE        = 65536
+
+DIGEST_REGEX     = re.compile(r'^[a-f0-9]{64}$')
+
+# linux ioctl sharing the blocks of a file with another one (reflink)
+FICLONE          = 0x40049409
+
+BLOBS_BYTES      = METRICS.gauge('auton_blobs_bytes',
+                                 "Bytes of argument files kept in the blob store")
+BLOBS_EVENTS     = METRICS.counter('auton_blobs_events_total',
+                                   "Blob store events",
+                                   ('event',))
+
+
+class AutonBlobMismatch(ValueError):
+    pass
+
+
+class AutonBlobStore(object): # pylint: disable=useless-object-inheritance
+    """
+    Argument files indexed by their sha256 digest, the least recently
+    used ones are removed past max_size bytes. Blobs are cloned into the
+    jobs directories, a job, even privileged, cannot alter a blob.
+    """
+    def __init__(self, path, max_size = DEFAULT_MAX_SIZE):
+        self.path     = path
+        self.max_size = max_size
+        self.size     = 0
+        self._lock    = threading.Lock()
+        self._blobs   = OrderedDict()
+
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+
+        self._load()
+
+    def _load(self):
+        blobs = []
+
+        for name in os.listdir(self.path):
+            path = os.path.join(self.path, name)
+
+            if not DIGEST_REGEX.match(name):
+                if name.startswith('.auton.'):
+                    os.unlink(path)
+                continue
+
+            st = os.stat(path)
+            blobs.append((st.st_atime, name, st.st_size))
+
+        for atime, name, size in sorted(blobs): # pylint: disable=unused-variable
+            self._blobs[name] = size
+            self.size        += size
+
+        BLOBS_BYTES.set(self.size)
+        LOG.info("blob store %r: %d blobs, %d bytes", self.path, len(self._blobs), self.size)
+
+    def _blob_path(self, digest):
+        return os.path.join(self.path, digest)
+
+    def _touch(self, digest):
+        if hasattr(self._blobs, 'move_to_end'):
+            self._blobs.move_to_end(digest)
+        else:
+            self._blobs[digest] = self._blobs.pop(digest)
+
+    def _evict(self):
+        while self.size > self.max_size and len(self._blobs) > 1:
+            digest, size = self._blobs.popitem(last = False)
+            self.size   -= size
+
+            try:
+                os.unlink(self._blob_path(digest))
+            except OSError as e:
+                LOG.warning("unable to remove blob %r: %r", digest, e)
+
+            BLOBS_EVENTS.inc(event = 'evictions')
+            LOG.debug("blob evicted: %r", digest)
+
+        BLOBS_BYTES.set(self.size)
+
+    def missing(self, digests):
+        r = []
+
+        with self._lock:
+            for digest in digests:
+                if digest in self._blobs:
+                    self._touch(digest)
+                    BLOBS_EVENTS.inc(event = 'hits')
+                else:
+                    r.append(digest)
+                    BLOBS_EVENTS.inc(event = 'misses')
+
+        return r
+
+    def put(self, digest, stream):
+        h = hashlib.sha256()
+        f = tempfile.NamedTemporaryFile(prefix = '.auton.',
+                                        dir    = self.path,
+                                        delete = False)
+        size = 0
+
+        try:
+            with f:
+                while True:
+                    data = stream.read(READ_SIZE)
+                    if not data:
+                        break
+                    h.update(data)
+                    f.write(data)
+                    size += len(data)
+
+            if h.hexdigest() != digest:
+                raise AutonBlobMismatch("digest mismatch, expected: %r, got: %r"
+                                        % (digest, h.hexdigest()))
+
+            os.chmod(f.name, 0o444)
+
+            with self._lock:
+                os.rename(f.name, self._blob_path(digest))
+
+                if digest in self._blobs:
+                    self.size -= self._blobs[digest]
+
+                self._blobs[digest] = size
+                self.size          += size
+                self._touch(digest)
+                self._evict()
+        finally:
+            if os.path.exists(f.name):
+                os.unlink(f.name)
+
+        return size
+
+    def clone(self, digest, dest):
+        """
+        Copy the blob to dest, sharing its blocks where the filesystem
+        supports it. Return False if the blob is unknown.
+        """
+        with self._lock:
+            if digest not in self._blobs:
+                return False
+
+            self._touch(digest)
+
+            # the open file survives the eviction of the blob
+            try:
+                src = open(self._blob_path(digest), 'rb')
+            except IOError as e:
+                if e.errno != errno.ENOENT:
+                    raise
+                self.size -= self._blobs.pop(digest)
+                BLOBS_BYTES.set(self.size)
+                return False
+
+        with src:
+            with open(dest, 'wb') as dst:
+                if fcntl is not None:
+                    try:
+                        fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+                        return True
+                    except (IOError, OSError):
+                        pass
+
+                shutil.copyfileobj(src, dst, READ_SIZE)
+
+        return True
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2018-2022 fjord-technologies
+# SPDX-License-Identifier: GPL-3.0-or-later
+"""auton.classes.buffer"""
+
+import array
+import logging
+import tempfile
+import threading
+
+import six
+
+from auton.classes.metrics import METRICS
+
+LOG                = logging.getLogger('auton.buffer')
+
+DEFAULT_MAX_MEMORY = 1048576
+
+BUFFERED_BYTES     = METRICS.gauge('auton_output_buffered_bytes',
+                                   "Bytes of job output buffered",
+                                   ('storage',))
+
+
+class AutonOutputBuffer(object): # pylint: disable=useless-object-inheritance
+    """
+    Compact storage of output items: the bytes are kept in a single
+    bytearray and the item boundaries in an array of offsets. Past
+    max_memory bytes, the content is spilled to a temporary file.
+    """
+    def __init__(self, max_memory = DEFAULT_MAX_MEMORY, tmpdir = None):
+        self.max_memory = max_memory
+        self.tmpdir     = tmpdir
+        self._lock      = threading.Lock()
+        self._data      = bytearray()
+        self._offsets   = array.array('L')
+        self._spilled   = 0
+        self._file      = None
+
+    def __len__(self):
+        return len(self._offsets)
+
+    @property
+    def size(self):
+        return self._spilled + len(self._data)
+
+    @property
+    def memory_size(self):
+        return len(self._data)
+
+    def _spill(self):
+        if self._file is None:
+            self._file = tempfile.TemporaryFile(prefix = '.auton.',
+                                                dir    = self.tmpdir)
+
+        self._file.seek(0, 2)
+        self._file.write(self._data)
+        self._spilled += len(self._data)
+        BUFFERED_BYTES.dec(len(self._data), storage = 'memory')
+        BUFFERED_BYTES.inc(len(self._data), storage = 'file')
+        del self._data[:]
+
+    def append(self, item):
+        if isinstance(item, six.text_type):
+            item = item.encode('utf-8')
+
+        with self._lock:
+            self._data.extend(item)
+            BUFFERED_BYTES.inc(len(item), storage = 'memory')
+            self._offsets.append(self._spilled + len(self._data))
+
+            if self.max_memory and len(self._data) > self.max_memory:
+                self._spill()
+
+        return self
+
+    def get(self, start = 0, end = None):
+        with self._lock:
+            if end is None or end > len(self._offsets):
+                end = len(self._offsets)
+
+            if start >= end:
+                return []
+
+            bstart = start and self._offsets[start - 1]
+            bend   = self._offsets[end - 1]
+            data   = b''
+
+            if bstart < self._spilled:
+                self._file.seek(bstart)
+                data = self._file.read(min(bend, self._spilled) - bstart)
+
+            if bend > self._spilled:
+                data += bytes(self._data[max(bstart, self._spilled) - self._spilled:bend - self._spilled])
+
+            r   = []
+            pos = bstart
+            for offset in self._offsets[start:end]:
+                r.append(data[pos - bstart:offset - bstart])
+                pos = offset
+
+            return r
+
+    def tolist(self):
+        return self.get(0)
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                try:
+                    self._file.close()
+                except (IOError, OSError) as e:
+                    LOG.warning("unable to close output buffer file: %r", e)
+                self._file = None
+
+            BUFFERED_BYTES.dec(len(self._data), storage = 'memory')
+            BUFFERED_BYTES.dec(self._spilled, storage = 'file')
+
+            self._data    = bytearray()
+            self._offsets = array.array('L')
+            self._spilled = 0
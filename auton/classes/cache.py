@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2018-2022 fjord-technologies
+# SPDX-License-Identifier: GPL-3.0-or-later
+"""auton.classes.cache"""
+
+import hashlib
+import json
+import logging
+import threading
+import time
+
+from collections import OrderedDict
+
+from six import ensure_binary
+
+from auton.classes.metrics import METRICS
+
+LOG                 = logging.getLogger('auton.cache')
+
+DEFAULT_MAX_ENTRIES = 1024
+DEFAULT_MAX_SIZE    = 1048576
+READ_SIZE           = 65536
+
+CACHE_HITS          = METRICS.counter('auton_cache_hits_total',
+                                      "Jobs answered from the endpoint result cache",
+                                      ('endpoint',))
+CACHE_MISSES        = METRICS.counter('auton_cache_misses_total',
+                                      "Jobs not found in the endpoint result cache",
+                                      ('endpoint',))
+
+
+def _file_digest(path):
+    h = hashlib.sha256()
+
+    with open(path, 'rb') as f:
+        for data in iter(lambda: f.read(READ_SIZE), b''):
+            h.update(data)
+
+    return h.hexdigest()
+
+
+def submission_key(method, payload, user = None, uploads = None):
+    """
+    Digest of the normalized submission, the argument files
+    are identified by the digest of their content.
+    """
+    argfiles = []
+
+    for argfile in payload.get('argfiles') or ():
+        if argfile.get('digest') is not None:
+            digest = argfile['digest']
+        elif argfile.get('upload') is not None:
+            digest = _file_digest(uploads[argfile['upload']])
+        else:
+            digest = hashlib.sha256(ensure_binary(argfile.get('content') or '')).hexdigest()
+        argfiles.append([argfile['arg'], argfile.get('filename'), digest])
+
+    return hashlib.sha256(ensure_binary(json.dumps([method,
+                                                    user,
+                                                    payload.get('args') or [],
+                                                    payload.get('env') or {},
+                                                    payload.get('envfiles') or [],
+                                                    argfiles],
+                                                   sort_keys = True))).hexdigest()
+
+
+class AutonCacheEntry(object): # pylint: disable=useless-object-inheritance
+    def __init__(self, return_code, results, errors, expires_at):
+        self.return_code = return_code
+        self.results     = results
+        self.errors      = errors
+        self.expires_at  = expires_at
+
+
+class AutonResultCache(object): # pylint: disable=useless-object-inheritance
+    """
+    Outputs of the successful jobs of an endpoint, indexed by a digest
+    of what the client submitted, kept ttl seconds and evicted in least
+    recently used order past max_entries.
+    """
+    def __init__(self, name, ttl, max_entries = DEFAULT_MAX_ENTRIES, max_size = DEFAULT_MAX_SIZE):
+        self.name        = name
+        self.ttl         = ttl
+        self.max_entries = max_entries
+        self.max_size    = max_size
+        self._lock       = threading.Lock()
+        self._entries    = OrderedDict()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires_at <= time.time():
+                del self._entries[key]
+                entry = None
+
+            if entry is None:
+                CACHE_MISSES.inc(endpoint = self.name)
+                return None
+
+            self._entries[key] = self._entries.pop(key)
+
+        CACHE_HITS.inc(endpoint = self.name)
+
+        return entry
+
+    def put(self, key, return_code, results, errors):
+        size = sum(len(x) for x in results) + sum(len(x) for x in errors)
+        if self.max_size and size > self.max_size:
+            LOG.debug("output too large to be cached on endpoint %r: %d bytes", self.name, size)
+            return
+
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = AutonCacheEntry(return_code,
+                                                 results,
+                                                 errors,
+                                                 time.time() + self.ttl)
+
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(False)
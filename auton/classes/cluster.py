@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2018-2022 fjord-technologies
+# SPDX-License-Identifier: GPL-3.0-or-later
+"""auton.classes.cluster"""
+
+import hashlib
+import logging
+
+from six import ensure_binary
+
+from auton.classes.exceptions import AutonConfigurationError
+
+LOG = logging.getLogger('auton.cluster')
+
+
+def owner_hash(uri, xid):
+    return hashlib.sha256(ensure_binary("%s %s" % (uri.rstrip('/'), xid))).hexdigest()
+
+
+class AutonCluster(object): # pylint: disable=useless-object-inheritance
+    """
+    Static pool of autond nodes identified by their URI. A job belongs
+    to the node chosen by rendezvous hashing of its id, the same ranking
+    as `auton --balance hash`, so that every node knows the owner of a
+    job without asking the others.
+    """
+    def __init__(self, node, peers):
+        if not node:
+            raise AutonConfigurationError("missing option 'node' in cluster configuration")
+
+        self.node  = node.rstrip('/')
+        self.peers = []
+
+        for peer in peers or ():
+            peer = peer.rstrip('/')
+            if peer not in self.peers:
+                self.peers.append(peer)
+
+        if self.node not in self.peers:
+            self.peers.append(self.node)
+
+        LOG.info("cluster node %r, peers: %r", self.node, self.peers)
+
+    def owner(self, xid):
+        return max(self.peers, key = lambda x: owner_hash(x, xid))
+
+    def is_local(self, xid):
+        return self.owner(xid) == self.node
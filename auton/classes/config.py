@@ -3,9 +3,11 @@
 # SPDX-License-Identifier: GPL-3.0-or-later
 """auton.classes.config"""
 
+import copy
 import logging
 import os
 import signal
+import threading
 
 import six
 try:
@@ -21,10 +23,12 @@ from mako.template import Template
 from sonicprobe.helpers import load_yaml
 
 from auton.classes.exceptions import AutonConfigurationError
-from auton.classes.plugins import ENDPOINTS, PLUGINS
+from auton.classes.plugins import ENDPOINTS, EPTS_SYNC, PLUGINS
 
 _TPL_IMPORTS = ('from os import environ as ENV',
                 'from sonicprobe.helpers import to_yaml as my')
+_RELOAD      = {'xfile': None, 'envvar': None}
+_RELOAD_LOCK = threading.Lock()
 LOG          = logging.getLogger('auton.config')
 
 
@@ -39,10 +43,7 @@ def import_file(filepath, config_dir = None, xvars = None):
         return load_yaml(Template(f.read(),
                                   imports = _TPL_IMPORTS).render(**xvars))
 
-def load_conf(xfile, options = None, envvar = None):
-    signal.signal(signal.SIGTERM, stop)
-    signal.signal(signal.SIGINT, stop)
-
+def _read_conf(xfile, envvar = None):
     conf = {'_config_directory': None}
 
     if os.path.exists(xfile):
@@ -56,18 +57,14 @@ def load_conf(xfile, options = None, envvar = None):
         c.close()
         conf['_config_directory'] = None
 
-    conf = import_conf_files('modules', conf)
-
-    init_modules(conf)
-
-    for x in ('module', 'plugin'):
-        path = conf['general'].get('%ss_path' % x)
-        if path and os.path.isdir(path):
-            DwhoLibLoader.load_dir(x, path)
+    return conf
 
+def _endpoints_conf(conf):
     if not conf.get('endpoints'):
         raise AutonConfigurationError("Missing 'endpoints' section in configuration")
 
+    r = {}
+
     for name, ept_cfg in six.iteritems(conf['endpoints']):
         cfg     = {'general':  dict(conf['general']),
                    'auton':    {'endpoint_name': name,
@@ -96,13 +93,56 @@ def load_conf(xfile, options = None, envvar = None):
         if ept_cfg.get('credentials'):
             cfg['credentials'] = ept_cfg['credentials']
 
-        endpoint = PLUGINS[ept_cfg['plugin']](name)
-        ENDPOINTS.register(endpoint)
-        LOG.info("endpoint init: %r", name)
-        endpoint.init(cfg)
-        LOG.info("endpoint safe_init: %r", name)
-        endpoint.safe_init()
-        DWHO_THREADS.append(endpoint.at_stop)
+        for x in ('workers', 'output', 'max_queue', 'aging', 'cache', 'single_flight', 'phase_metrics'):
+            if ept_cfg.get(x) is not None:
+                cfg['auton'][x] = ept_cfg[x]
+
+        r[name] = cfg
+
+    return r
+
+def _init_endpoint(name, cfg):
+    endpoint = PLUGINS[cfg['auton']['plugin_name']](name)
+    endpoint.source_conf = copy.deepcopy(cfg)
+    LOG.info("endpoint init: %r", name)
+    endpoint.init(cfg)
+    LOG.info("endpoint safe_init: %r", name)
+    endpoint.safe_init()
+
+    return endpoint
+
+def _register_endpoint(endpoint, previous = None):
+    endpoint.activate(previous)
+    ENDPOINTS.register(endpoint)
+    DWHO_THREADS.append(endpoint.at_stop)
+
+def _retire_endpoint(endpoint):
+    endpoint.retire()
+
+    # hooks of the endpoints replaced by reloads would pile up
+    try:
+        DWHO_THREADS.remove(endpoint.at_stop)
+    except ValueError:
+        pass
+
+def load_conf(xfile, options = None, envvar = None):
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGHUP, _sighup)
+
+    _RELOAD.update({'xfile': xfile, 'envvar': envvar})
+
+    conf = import_conf_files('modules', _read_conf(xfile, envvar))
+
+    init_modules(conf)
+
+    for x in ('module', 'plugin'):
+        path = conf['general'].get('%ss_path' % x)
+        if path and os.path.isdir(path):
+            DwhoLibLoader.load_dir(x, path)
+
+    for name, cfg in six.iteritems(_endpoints_conf(conf)):
+        _register_endpoint(_init_endpoint(name, cfg))
 
     if not options or not isinstance(options, object):
         return conf
@@ -116,6 +156,63 @@ def load_conf(xfile, options = None, envvar = None):
 
     return options
 
+def _sighup(signum, stack_frame): # pylint: disable=unused-argument
+    t = threading.Thread(target = reload_conf, name = 'auton-reload')
+    t.daemon = True
+    t.start()
+
+def reload_conf():
+    """
+    Re-read the configuration and only replace the endpoints added or
+    changed, the running jobs of a replaced endpoint finish with its
+    previous definition. Modules and general options are not reloaded.
+    """
+    if not _RELOAD_LOCK.acquire(False):
+        LOG.warning("configuration reload already in progress")
+        return
+
+    try:
+        LOG.info("reloading configuration: %r", _RELOAD['xfile'])
+
+        cfgs = _endpoints_conf(_read_conf(_RELOAD['xfile'], _RELOAD['envvar']))
+        news = {}
+
+        # initialize everything first, a configuration error
+        # must leave the current endpoints untouched
+        for name, cfg in six.iteritems(cfgs):
+            if name in ENDPOINTS and ENDPOINTS[name].source_conf == cfg:
+                continue
+            news[name] = _init_endpoint(name, cfg)
+
+        for name, endpoint in six.iteritems(news):
+            previous = ENDPOINTS.get(name)
+            _register_endpoint(endpoint, previous)
+
+            if previous is not None:
+                _retire_endpoint(previous)
+
+            if endpoint.enabled and endpoint.autostart:
+                endpoint.at_start()
+
+            LOG.info("endpoint %s: %r", 'reloaded' if previous else 'added', name)
+
+        for name in [x for x in ENDPOINTS if x not in cfgs]:
+            endpoint = ENDPOINTS.pop(name)
+            EPTS_SYNC.pop(name, None)
+            _retire_endpoint(endpoint)
+            LOG.info("endpoint removed: %r", name)
+    except Exception as e:
+        LOG.exception("unable to reload configuration: %r", e)
+    finally:
+        _RELOAD_LOCK.release()
+
+
+def start_modules():
+    for name, module in six.iteritems(MODULES):
+        if module.initialized and hasattr(module, 'start'):
+            LOG.info("module start: %r", name)
+            module.start()
+
 
 def start_endpoints():
     for name, endpoint in six.iteritems(ENDPOINTS):
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2018-2022 fjord-technologies
+# SPDX-License-Identifier: GPL-3.0-or-later
+"""auton.classes.envfiles"""
+
+import logging
+import os
+import threading
+
+from dotenv.main import dotenv_values
+
+LOG = logging.getLogger('auton.envfiles')
+
+
+class AutonEnvFiles(object): # pylint: disable=useless-object-inheritance
+    """
+    Parsed environment files, reloaded when their mtime or size changes.
+    Only the files named in the configuration are kept, those sent
+    by the clients are parsed on each job.
+    """
+    def __init__(self):
+        self._lock  = threading.Lock()
+        self._files = {}
+
+    def load(self, path, cache = True):
+        if not cache:
+            return dotenv_values(path)
+
+        st  = os.stat(path)
+        key = (st.st_mtime, st.st_size, st.st_ino)
+
+        with self._lock:
+            entry = self._files.get(path)
+            if entry is not None and entry[0] == key:
+                return entry[1].copy()
+
+        values = dotenv_values(path)
+        LOG.debug("envfile loaded: %r", path)
+
+        with self._lock:
+            self._files[path] = (key, values)
+
+        return values.copy()
+
+
+ENVFILES = AutonEnvFiles()
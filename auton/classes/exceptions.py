@@ -11,6 +11,9 @@ LOG = logging.getLogger('auton.exceptions')
 class AutonConfigurationError(Exception):
     pass
 
+class AutonEndpointClosed(Exception):
+    pass
+
 class AutonTargetFailed(Exception):
     def __init__(self, message = None, args = None, code = None):
         if isinstance(message, Exception):
@@ -23,5 +26,8 @@ class AutonTargetFailed(Exception):
 class AutonTargetTimeout(AutonTargetFailed):
     pass
 
+class AutonTargetExpired(AutonTargetFailed):
+    pass
+
 class AutonTargetUnauthorized(AutonTargetFailed):
     pass
@@ -0,0 +1,382 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2018-2022 fjord-technologies
+# SPDX-License-Identifier: GPL-3.0-or-later
+"""auton.classes.handler"""
+
+import logging
+import zlib
+
+from io import BytesIO
+
+from six import ensure_binary
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from httpdis.ext import httpdis_json
+from httpdis.httpdis import DEFAULT_CHARSET, HttpResponse
+
+LOG                          = logging.getLogger('auton.handler')
+
+UPLOAD_CONTENT_TYPE          = 'application/octet-stream'
+
+DEFAULT_COMPRESSION_LEVEL    = 6
+DEFAULT_COMPRESSION_MIN_SIZE = 1024
+
+# preferred first
+if zstandard:
+    ENCODINGS                = ('zstd', 'gzip')
+else:
+    ENCODINGS                = ('gzip',)
+
+
+class AutonCompressor(object): # pylint: disable=useless-object-inheritance
+    """
+    Incremental encoder of a response body, flush() ends a block
+    so that the client can decode everything sent so far.
+    """
+    def __init__(self, encoding, level):
+        if encoding == 'zstd':
+            self._obj   = zstandard.ZstdCompressor(level = level).compressobj()
+            self._flush = zstandard.COMPRESSOBJ_FLUSH_BLOCK
+        else:
+            self._obj   = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+            self._flush = zlib.Z_SYNC_FLUSH
+
+    def compress(self, data):
+        return self._obj.compress(data) + self._obj.flush(self._flush)
+
+    def finish(self):
+        return self._obj.flush()
+
+
+def compress(data, encoding, level):
+    obj = AutonCompressor(encoding, level)
+    return obj.compress(data) + obj.finish()
+
+
+def decompress(data, encoding, max_size):
+    """
+    Decode a request body, returns None past max_size bytes.
+    """
+    if encoding == 'zstd':
+        r = zstandard.ZstdDecompressor().stream_reader(BytesIO(data)).read(max_size + 1)
+    else:
+        obj = zlib.decompressobj(32 + zlib.MAX_WBITS)
+        r   = obj.decompress(data, max_size + 1)
+        if len(r) <= max_size and not obj.eof:
+            raise zlib.error("truncated data")
+
+    if len(r) > max_size:
+        return None
+
+    return r
+
+
+class AutonHttpResponseStream(HttpResponse):
+    """
+    Response whose body is produced by an iterator and sent
+    with chunked transfer encoding.
+    """
+    def __init__(self, iterator, code = 200, headers = None, message = None):
+        HttpResponse.__init__(self, code, "", headers, message)
+        self.iterator = iterator
+
+
+class AutonUploadStream(object): # pylint: disable=useless-object-inheritance
+    """
+    Request body left unread by the handler, read on demand
+    up to Content-Length.
+    """
+    def __init__(self, rfile, length):
+        self.rfile     = rfile
+        self.length    = length
+        self.remaining = length
+
+    def read(self, size = -1):
+        if self.remaining <= 0:
+            return b''
+
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+
+        data = self.rfile.read(size)
+        if not data:
+            raise IOError("incomplete request body")
+
+        self.remaining -= len(data)
+
+        return data
+
+    def drain(self, size = 65536):
+        while self.read(size):
+            pass
+
+
+class AutonHttpReqHandler(httpdis_json.HttpReqHandler):
+    keepalive_timeout    = 0
+    compression          = True
+    compression_level    = DEFAULT_COMPRESSION_LEVEL
+    compression_min_size = DEFAULT_COMPRESSION_MIN_SIZE
+    _upload              = None
+    _body_unread         = False
+
+    @classmethod
+    def configure(cls, general):
+        cls.keepalive_timeout    = float(general.get('keepalive_timeout') or 0)
+        cls.compression          = bool(general.get('compression', True))
+        cls.compression_level    = int(general.get('compression_level') or DEFAULT_COMPRESSION_LEVEL)
+        cls.compression_min_size = int(general.get('compression_min_size') or DEFAULT_COMPRESSION_MIN_SIZE)
+
+        if cls.keepalive_timeout > 0:
+            cls.protocol_version = 'HTTP/1.1'
+            cls.timeout          = cls.keepalive_timeout
+
+    def upload_stream(self):
+        return self._upload
+
+    def _find_command(self, cmd):
+        context = self.get_context()
+        ckey    = "%s /%s" % (self.command, cmd)
+
+        if ckey in context.named_commands:
+            return context.named_commands[ckey]
+
+        for key in sorted(context.regex_commands, key=len, reverse=True):
+            if not key.startswith("%s " % self.command):
+                continue
+
+            m = context.regex_commands[key].name.match(cmd)
+            if m:
+                self._query_params.update(m.groupdict())
+                return context.regex_commands[key]
+
+        return None
+
+    def _content_encoding(self):
+        encoding = (self.headers.get('Content-Encoding') or '').strip().lower()
+        if encoding in ('', 'identity'):
+            return None
+
+        if not self.compression or encoding not in ENCODINGS:
+            self.close_connection = True
+            self._body_unread     = True
+            raise self.req_error(415,
+                                 "unsupported Content-Encoding: %r" % encoding,
+                                 headers = {'Accept-Encoding': self.compression and ', '.join(ENCODINGS) or 'identity'})
+
+        return encoding
+
+    def _accept_encoding(self):
+        if not self.compression:
+            return None
+
+        accepted = {}
+
+        for item in (self.headers.get('Accept-Encoding') or '').lower().split(','):
+            params = item.split(';')
+            qvalue = 1.0
+            for param in params[1:]:
+                param = param.strip()
+                if param.startswith('q='):
+                    try:
+                        qvalue = float(param[2:])
+                    except ValueError:
+                        qvalue = 0
+            accepted[params[0].strip()] = qvalue
+
+        for encoding in ENCODINGS:
+            if accepted.get(encoding, 0) > 0:
+                return encoding
+
+        return None
+
+    def parse_payload(self, data, charset): # pylint: disable=arguments-differ
+        """
+        The compressed body was read by httpdis within max_body_size,
+        its decoded content is limited the same way.
+        """
+        encoding = self._content_encoding()
+        if encoding:
+            max_size = self.get_cmd().max_body_size
+            if max_size is None:
+                max_size = int(self.get_context().options['max_body_size'])
+
+            try:
+                data = decompress(data, encoding, max_size)
+            except Exception as e:
+                raise self.req_error(400, "invalid %s request body: %s" % (encoding, e))
+
+            if data is None:
+                raise self.req_error(413)
+
+        return httpdis_json.HttpReqHandler.parse_payload(data, charset)
+
+    def data_from_payload(self, cmd):
+        """
+        Bodies of type application/octet-stream are not read here
+        but handed to the route handler as a stream, see upload_stream(),
+        the route is looked up as in httpdis (pinned in requirements).
+        Other bodies may be compressed, see ENCODINGS.
+        """
+        ctype = (self.headers.get('Content-Type') or '').lower().split(';', 1)[0].strip()
+        if ctype != UPLOAD_CONTENT_TYPE:
+            # refused before the body is read, decoded by parse_payload()
+            if self._content_encoding() and ctype != httpdis_json.CONTENT_TYPE:
+                self.close_connection = True
+                self._body_unread     = True
+                raise self.req_error(415, "only %s bodies may be compressed" % httpdis_json.CONTENT_TYPE)
+
+            return httpdis_json.HttpReqHandler.data_from_payload(self, cmd)
+
+        if self.headers.get('Content-Encoding'):
+            self.close_connection = True
+            self._body_unread     = True
+            raise self.req_error(415, "uploads must not be compressed")
+
+        if not isinstance(self._query_params, dict):
+            self._query_params = {}
+
+        try:
+            self._cmd = self._find_command(cmd)
+            if not self._cmd:
+                raise self._missing_command(cmd)
+
+            charset      = self._cmd.charset or DEFAULT_CHARSET
+            clen         = self._validate_request_framing()
+
+            if self._cmd.to_auth:
+                self.authenticate(self._cmd.auth_users)
+
+            self._upload = AutonUploadStream(self.rfile, clen)
+
+            try:
+                res      = self._cmd.handler(self)
+            except Exception:
+                # the body may not have been read
+                self.close_connection = True
+                self._body_unread     = True
+                raise
+
+            self._upload.drain()
+
+            if not isinstance(res, HttpResponse):
+                return self.response_dumps(res, charset)
+
+            return res
+        finally:
+            self._upload       = None
+            self._query_params = {}
+
+    def _keep_alive(self, response):
+        """
+        Not after an error or a redirect, nor when the request body
+        may not have been read entirely.
+        """
+        if self.keepalive_timeout <= 0 \
+           or self._body_unread \
+           or response.get_code() >= 300:
+            return False
+
+        conn = (self.headers.get('Connection') or '').lower()
+        if 'close' in conn:
+            return False
+
+        return self.request_version == 'HTTP/1.1' or 'keep-alive' in conn
+
+    def _write_chunk(self, data, chunked):
+        if chunked:
+            self.wfile.write(ensure_binary("%x\r\n" % len(data)))
+            self.wfile.write(data)
+            self.wfile.write(b"\r\n")
+        else:
+            self.wfile.write(data)
+
+        self.wfile.flush()
+
+    def _compress_response(self, response):
+        code = response.get_code()
+        if code < 200 or code in (204, 304) \
+           or response.get_header('Content-encoding'):
+            return None
+
+        encoding = self._accept_encoding()
+        if not encoding:
+            return None
+
+        if isinstance(response, AutonHttpResponseStream):
+            compressor = AutonCompressor(encoding, self.compression_level)
+        else:
+            data = ensure_binary(response.data or "")
+            if len(data) < self.compression_min_size:
+                return None
+            response.data = compress(data, encoding, self.compression_level)
+            compressor    = None
+
+        response.add_header('Content-Encoding', encoding)
+        response.add_header('Vary', 'Accept-Encoding')
+
+        return compressor
+
+    def end_response(self, response):
+        compressor = self._compress_response(response)
+
+        if not isinstance(response, AutonHttpResponseStream):
+            if self._keep_alive(response):
+                response.add_header('Connection', 'keep-alive')
+            return httpdis_json.HttpReqHandler.end_response(self, response)
+
+        chunked = self.request_version == 'HTTP/1.1' \
+                  and self.protocol_version == 'HTTP/1.1'
+
+        self.send_response(code    = response.get_code(),
+                           message = response.get_message())
+
+        if response.get_header('Content-type'):
+            content_type = response.get_header('Content-type')
+        elif self._cmd and self._cmd.content_type:
+            content_type = self._cmd.content_type
+        else:
+            content_type = self._DEFAULT_CONTENT_TYPE
+
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Pragma', 'no-cache')
+        self.send_header('Connection', 'close')
+        self.send_header('Content-Type', content_type)
+
+        if chunked:
+            self.send_header('Transfer-Encoding', 'chunked')
+
+        for header, value in response.header_items():
+            if header.lower() not in ('cache-control', 'connection', 'content-type', 'pragma'):
+                self.send_header(header, value)
+
+        self.end_headers()
+
+        if self.command == 'HEAD':
+            return None
+
+        try:
+            for data in response.iterator:
+                if not data:
+                    continue
+                data = ensure_binary(data)
+                if compressor:
+                    data = compressor.compress(data)
+                if data:
+                    self._write_chunk(data, chunked)
+
+            data = compressor and compressor.finish()
+            if data:
+                self._write_chunk(data, chunked)
+
+            if chunked:
+                self.wfile.write(b"0\r\n\r\n")
+        finally:
+            close = getattr(response.iterator, 'close', None)
+            if close:
+                close()
+
+        return None
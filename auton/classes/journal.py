@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2018-2022 fjord-technologies
+# SPDX-License-Identifier: GPL-3.0-or-later
+"""auton.classes.journal"""
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from six import ensure_binary, ensure_text
+from six.moves import queue as _queue
+
+from auton.classes.metrics import METRICS
+
+LOG               = logging.getLogger('auton.journal')
+
+DEFAULT_MAX_BATCH = 512
+STOP_POLL         = 0.5
+STOP_TIMEOUT      = 5
+
+OUTPUT_RESULT     = 0
+OUTPUT_ERROR      = 1
+
+JOURNAL_RECORDS   = METRICS.counter('auton_journal_records_total',
+                                    "Records written to the job journal")
+JOURNAL_COMMIT    = METRICS.histogram('auton_journal_commit_seconds',
+                                      "Duration of the job journal group commits")
+
+_SCHEMA           = ("CREATE TABLE IF NOT EXISTS jobs ("
+                     " uid TEXT PRIMARY KEY,"
+                     " endpoint TEXT NOT NULL,"
+                     " method TEXT NOT NULL,"
+                     " request TEXT NOT NULL,"
+                     " status TEXT NOT NULL,"
+                     " return_code INTEGER,"
+                     " queued_at REAL,"
+                     " started_at REAL,"
+                     " ended_at REAL)",
+                     "CREATE TABLE IF NOT EXISTS outputs ("
+                     " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+                     " uid TEXT NOT NULL,"
+                     " kind INTEGER NOT NULL,"
+                     " data BLOB NOT NULL)",
+                     "CREATE INDEX IF NOT EXISTS outputs_uid ON outputs (uid, id)")
+
+
+class AutonJournal(object): # pylint: disable=useless-object-inheritance
+    """
+    Append-only record of the jobs in a SQLite database. The records
+    are written by a single thread: all the records queued while a
+    commit is in progress go into the next transaction, so a single
+    fsync covers a whole batch.
+    """
+    def __init__(self, path, max_batch = DEFAULT_MAX_BATCH):
+        self.path      = path
+        self.max_batch = max_batch
+        self._queue    = _queue.Queue()
+        self._stopped  = threading.Event()
+        self._thread   = None
+        self._conn     = None
+
+    def open(self):
+        """
+        Must be called in the daemon process,
+        the connection does not survive a fork.
+        """
+        xdir = os.path.dirname(os.path.abspath(self.path))
+        if not os.path.isdir(xdir):
+            os.makedirs(xdir)
+
+        self._conn     = sqlite3.connect(self.path,
+                                         isolation_level   = None,
+                                         check_same_thread = False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=FULL")
+
+        for x in _SCHEMA:
+            self._conn.execute(x)
+
+    def start(self):
+        self._thread        = threading.Thread(target = self._writer,
+                                               name   = 'auton-journal')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """
+        Called by the signal handler, possibly while the main thread
+        holds the lock of the queue, so it must not touch the queue.
+        """
+        if self._thread is None:
+            return
+
+        self._stopped.set()
+        self._thread.join(STOP_TIMEOUT)
+        self._thread = None
+
+    def replay(self):
+        """
+        Return the journaled jobs in submission order,
+        must be called before start().
+        """
+        r    = []
+        jobs = {}
+
+        for row in self._conn.execute("SELECT uid, endpoint, method, request, status, return_code,"
+                                      " queued_at, started_at, ended_at"
+                                      " FROM jobs ORDER BY rowid"):
+            job = {'uid':         row[0],
+                   'endpoint':    row[1],
+                   'method':      row[2],
+                   'request':     json.loads(row[3]),
+                   'status':      row[4],
+                   'return_code': row[5],
+                   'queued_at':   row[6],
+                   'started_at':  row[7],
+                   'ended_at':    row[8],
+                   'results':     [],
+                   'errors':      []}
+            jobs[job['uid']] = job
+            r.append(job)
+
+        for uid, kind, data in self._conn.execute("SELECT uid, kind, data FROM outputs ORDER BY id"):
+            if uid in jobs:
+                jobs[uid]['errors' if kind == OUTPUT_ERROR else 'results'].append(bytes(data))
+
+        LOG.info("job journal %r: %d jobs to replay", self.path, len(r))
+
+        return r
+
+    def _put(self, sql, args, event = None):
+        self._queue.put((sql, args, event))
+        return event
+
+    @staticmethod
+    def _dump_request(obj):
+        user = obj.get_request().get_server_vars().get('HTTP_AUTH_USER')
+
+        return json.dumps({'payload':  obj.get_request().payload_params(),
+                           'user':     user and ensure_text(user),
+                           'priority': obj.get_priority(),
+                           'deadline': obj.get_deadline(),
+                           'uploads':  obj.uploads,
+                           'blobs':    [[k[0], k[1], v] for k, v in obj.blobs.items()],
+                           'tmpdirs':  obj.tmpdirs})
+
+    def submit(self, obj):
+        """
+        Record a new job, the returned event is set once
+        the record is on disk.
+        """
+        return self._put("INSERT OR REPLACE INTO jobs"
+                         " (uid, endpoint, method, request, status, queued_at)"
+                         " VALUES (?, ?, ?, ?, ?, ?)",
+                         (obj.get_uid(),
+                          obj.get_endpoint(),
+                          obj.get_method(),
+                          self._dump_request(obj),
+                          obj.get_status(),
+                          time.time()),
+                         threading.Event())
+
+    def update(self, obj):
+        self._put("UPDATE jobs SET status = ?, return_code = ?, started_at = ?, ended_at = ?"
+                  " WHERE uid = ?",
+                  (obj.get_status(),
+                   obj.get_return_code(),
+                   obj.get_started_at(),
+                   obj.get_ended_at(),
+                   obj.get_uid()))
+
+    def output(self, uid, kind, data):
+        self._put("INSERT INTO outputs (uid, kind, data) VALUES (?, ?, ?)",
+                  (uid, kind, sqlite3.Binary(ensure_binary(data))))
+
+    def remove(self, uid):
+        self._put("DELETE FROM outputs WHERE uid = ?", (uid,))
+        self._put("DELETE FROM jobs WHERE uid = ?", (uid,))
+
+    def _get_batch(self):
+        r = []
+
+        while len(r) < self.max_batch:
+            try:
+                r.append(self._queue.get(not r, STOP_POLL))
+            except _queue.Empty:
+                break
+
+        return r
+
+    def _writer(self):
+        while True:
+            batch = self._get_batch()
+            if not batch:
+                if self._stopped.is_set():
+                    return
+                continue
+
+            start = time.time()
+
+            try:
+                self._conn.execute("BEGIN")
+                for sql, args, event in batch: # pylint: disable=unused-variable
+                    self._conn.execute(sql, args)
+                self._conn.execute("COMMIT")
+            except sqlite3.Error as e:
+                LOG.error("unable to write %d records to the job journal: %r", len(batch), e)
+                try:
+                    self._conn.execute("ROLLBACK")
+                except sqlite3.Error:
+                    pass
+            else:
+                JOURNAL_RECORDS.inc(len(batch))
+                JOURNAL_COMMIT.observe(time.time() - start)
+
+            for sql, args, event in batch: # pylint: disable=unused-variable
+                if event is not None:
+                    event.set()
+
@@ -0,0 +1,537 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2018-2022 fjord-technologies
+# SPDX-License-Identifier: GPL-3.0-or-later
+"""auton.classes.launcher"""
+
+import array
+import errno
+import itertools
+import json
+import logging
+import os
+import select
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+from functools import partial
+
+from six import ensure_binary, iteritems
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+try:
+    from shutil import which
+except ImportError:
+    which = None
+
+from auton.classes.exceptions import AutonConfigurationError
+from auton.classes.metrics import METRICS
+from auton.classes.supervisor import SUPERVISOR
+
+LOG                  = logging.getLogger('auton.launcher')
+
+LAUNCHER_POPEN       = 'popen'
+LAUNCHER_POSIX_SPAWN = 'posix_spawn'
+LAUNCHER_FORKSERVER  = 'forkserver'
+LAUNCHERS            = (LAUNCHER_POPEN, LAUNCHER_POSIX_SPAWN, LAUNCHER_FORKSERVER)
+DEFAULT_LAUNCHER     = LAUNCHER_POPEN
+
+MAX_MESSAGE          = 1048576
+READ_SIZE            = 512
+RESET_SIGNALS        = tuple(getattr(signal, x) for x in ('SIGPIPE', 'SIGXFSZ') if hasattr(signal, x))
+
+# resource limits of the child processes, by configuration name
+RLIMITS              = dict((name, getattr(resource, const))
+                            for name, const in (('cpu', 'RLIMIT_CPU'),
+                                                ('as', 'RLIMIT_AS'),
+                                                ('nofile', 'RLIMIT_NOFILE'))
+                            if resource and hasattr(resource, const))
+
+SPAWN_BUCKETS        = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25)
+
+SPAWN_LATENCY        = METRICS.histogram('auton_spawn_seconds',
+                                         "Duration of the child processes creation",
+                                         ('launcher',),
+                                         buckets = SPAWN_BUCKETS)
+SPAWNS_TOTAL         = METRICS.counter('auton_spawns_total',
+                                       "Child processes created",
+                                       ('launcher',))
+
+
+def _send(sock, data, fds = ()):
+    ancdata = []
+    if fds:
+        ancdata.append((socket.SOL_SOCKET, socket.SCM_RIGHTS, array.array('i', fds)))
+
+    sock.sendmsg([ensure_binary(json.dumps(data))], ancdata)
+
+def _recv(sock):
+    fds = array.array('i')
+    (msg, ancdata, flags, addr) = sock.recvmsg(MAX_MESSAGE, socket.CMSG_SPACE(2 * fds.itemsize)) # pylint: disable=unused-variable
+
+    for level, kind, data in ancdata:
+        if level == socket.SOL_SOCKET and kind == socket.SCM_RIGHTS:
+            fds.frombytes(data[:len(data) - (len(data) % fds.itemsize)])
+
+    return (msg and json.loads(msg.decode('utf-8')), list(fds))
+
+def _returncode(status):
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+
+    return os.WEXITSTATUS(status)
+
+def _rusage(ru):
+    # ru_maxrss is in kilobytes, except on macOS
+    return {'utime':   ru.ru_utime,
+            'stime':   ru.ru_stime,
+            'maxrss':  ru.ru_maxrss if sys.platform == 'darwin' else ru.ru_maxrss * 1024,
+            'inblock': ru.ru_inblock,
+            'oublock': ru.ru_oublock}
+
+def _poll(proc):
+    """
+    Reap proc with wait4() to get its resource usage.
+    """
+    if proc.returncode is None:
+        try:
+            (pid, status, ru) = os.wait4(proc.pid, os.WNOHANG)
+        except OSError as e:
+            if e.errno != errno.ECHILD:
+                raise
+            return proc.returncode
+
+        if pid:
+            proc.rusage     = _rusage(ru)
+            proc.returncode = _returncode(status)
+
+    return proc.returncode
+
+def set_rlimits(rlimits):
+    """
+    Apply rlimits to the current process, without raising
+    the hard limits.
+    """
+    for name, value in iteritems(rlimits):
+        hard = resource.getrlimit(RLIMITS[name])[1]
+        if hard != resource.RLIM_INFINITY and value > hard:
+            value = hard
+        resource.setrlimit(RLIMITS[name], (value, value))
+
+
+class AutonPopen(subprocess.Popen):
+    """
+    subprocess.Popen keeping the resource usage of the child process.
+    """
+    rusage = None
+
+    def poll(self):
+        return _poll(self)
+
+
+class AutonProcess(object): # pylint: disable=useless-object-inheritance
+    """
+    Child process created without subprocess, with the part of the
+    subprocess.Popen interface used by the supervisor and the plugins.
+    """
+    def __init__(self, pid, stdout, stderr):
+        self.pid        = pid
+        self.stdout     = os.fdopen(stdout, 'rb', 0)
+        self.stderr     = os.fdopen(stderr, 'rb', 0)
+        self.returncode = None
+        self.rusage     = None
+
+    def poll(self):
+        return _poll(self)
+
+    def send_signal(self, sig):
+        if self.returncode is None:
+            os.kill(self.pid, sig)
+
+    def terminate(self):
+        self.send_signal(signal.SIGTERM)
+
+    def kill(self):
+        self.send_signal(signal.SIGKILL)
+
+
+class AutonRemoteProcess(AutonProcess):
+    """
+    Child process of the fork server, its exit status
+    is reported by the fork server.
+    """
+    EXIT_NOTIFIED = True
+
+    def __init__(self, stdout, stderr): # pylint: disable=super-init-not-called
+        self.pid        = None
+        self.stdout     = stdout
+        self.stderr     = stderr
+        self.returncode = None
+        self.rusage     = None
+        self.error      = None
+        self.spawned    = threading.Event()
+
+    def poll(self):
+        return self.returncode
+
+
+class AutonForkServer(object): # pylint: disable=useless-object-inheritance
+    """
+    Small process forked at startup, while the memory of autond is
+    still small, which forks and executes the programs on request.
+    The pipes of the child are passed over a unix socket.
+    """
+    def __init__(self):
+        self.pid        = None
+        self._sock      = None
+        self._seq       = itertools.count()
+        self._lock      = threading.Lock()
+        self._send_lock = threading.Lock()
+        self._spawns    = {}
+        self._procs     = {}
+
+    @staticmethod
+    def is_supported():
+        return hasattr(socket, 'AF_UNIX') \
+               and hasattr(socket, 'SOCK_SEQPACKET') \
+               and hasattr(socket.socket, 'sendmsg')
+
+    def start(self, uid = None, gid = None):
+        (sock, xsock) = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+
+        for x in (sock, xsock):
+            x.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, MAX_MESSAGE)
+
+        pid = os.fork()
+        if pid == 0:
+            rc = 0
+            try:
+                sock.close()
+                self._serve(xsock, uid, gid)
+            except BaseException: # pylint: disable=broad-except
+                rc = 1
+            finally:
+                os._exit(rc) # pylint: disable=protected-access
+
+        xsock.close()
+
+        self.pid     = pid
+        self._sock   = sock
+
+        reader        = threading.Thread(target = self._reader,
+                                         name   = 'auton-forkserver')
+        reader.daemon = True
+        reader.start()
+
+        LOG.info("fork server started, pid: %r", pid)
+
+    @staticmethod
+    def _exec(req, fds, devnull):
+        (rfd, wfd) = os.pipe()
+
+        pid = os.fork()
+        if pid == 0:
+            try:
+                os.dup2(devnull, 0)
+                os.dup2(fds[0], 1)
+                os.dup2(fds[1], 2)
+                signal.set_wakeup_fd(-1)
+                for sig in RESET_SIGNALS + (signal.SIGCHLD,):
+                    signal.signal(sig, signal.SIG_DFL)
+                os.chdir(req['cwd'])
+                if req.get('rlimits'):
+                    set_rlimits(req['rlimits'])
+                os.execvpe(req['args'][0], req['args'], req['env'])
+            except Exception as e: # pylint: disable=broad-except
+                os.write(wfd, ensure_binary("%d" % (getattr(e, 'errno', None) or errno.EINVAL)))
+            finally:
+                os._exit(127) # pylint: disable=protected-access
+
+        os.close(wfd)
+
+        # the pipe is closed on exec, or gets the errno of the failure
+        data = b''
+        try:
+            while True:
+                buf = os.read(rfd, READ_SIZE)
+                if not buf:
+                    break
+                data += buf
+        finally:
+            os.close(rfd)
+
+        if data:
+            os.waitpid(pid, 0)
+            code = int(data)
+            raise OSError(code, os.strerror(code), req['args'][0])
+
+        return pid
+
+    def _serve(self, sock, uid, gid):
+        os.setsid()
+
+        if gid is not None and os.getgid() != gid:
+            os.setgid(gid)
+
+        if uid is not None and os.getuid() != uid:
+            os.setuid(uid)
+
+        os.umask(0o22)
+
+        (wakeup, xwakeup) = os.pipe()
+        os.set_blocking(xwakeup, False)
+        signal.set_wakeup_fd(xwakeup)
+        signal.signal(signal.SIGCHLD, lambda signum, frame: None)
+
+        devnull  = os.open(os.devnull, os.O_RDWR)
+        children = set()
+
+        while True:
+            try:
+                ready = select.select([sock, wakeup], [], [])[0]
+            except (IOError, OSError) as e:
+                if e.errno == errno.EINTR:
+                    continue
+                raise
+
+            if wakeup in ready:
+                os.read(wakeup, READ_SIZE)
+
+            while children:
+                try:
+                    (pid, status, ru) = os.wait4(-1, os.WNOHANG)
+                except OSError as e:
+                    if e.errno != errno.ECHILD:
+                        raise
+                    children.clear()
+                    break
+                if not pid:
+                    break
+                children.discard(pid)
+                _send(sock, ['exit', pid, status, _rusage(ru)])
+
+            if sock not in ready:
+                continue
+
+            (req, fds) = _recv(sock)
+            if not req:
+                return
+
+            try:
+                pid = self._exec(req, fds, devnull)
+                children.add(pid)
+                _send(sock, ['pid', req['id'], pid])
+            except OSError as e:
+                _send(sock, ['error', req['id'], e.errno, e.strerror])
+            finally:
+                for fd in fds:
+                    os.close(fd)
+
+    def _reader(self):
+        while True:
+            try:
+                (msg, fds) = _recv(self._sock) # pylint: disable=unused-variable
+            except (IOError, OSError) as e:
+                LOG.error("unable to read from fork server: %r", e)
+                msg = None
+
+            if not msg:
+                break
+
+            with self._lock:
+                if msg[0] == 'pid':
+                    proc     = self._spawns.pop(msg[1])
+                    proc.pid = msg[2]
+                    self._procs[proc.pid] = proc
+                    proc.spawned.set()
+                elif msg[0] == 'error':
+                    proc       = self._spawns.pop(msg[1])
+                    proc.error = OSError(msg[2], msg[3])
+                    proc.spawned.set()
+                elif msg[0] == 'exit':
+                    proc = self._procs.pop(msg[1], None)
+                    if proc is not None:
+                        proc.rusage     = msg[3]
+                        proc.returncode = _returncode(msg[2])
+                        SUPERVISOR.notify()
+
+        LOG.error("fork server exited")
+
+        with self._lock:
+            for proc in self._spawns.values():
+                proc.error = OSError(errno.ECHILD, "fork server exited")
+                proc.spawned.set()
+            self._spawns = {}
+
+            for proc in self._procs.values():
+                proc.returncode = -signal.SIGKILL
+            self._procs  = {}
+            self._sock   = None
+
+        SUPERVISOR.notify()
+
+    def spawn(self, args, env, cwd = None, rlimits = None):
+        (rout, wout) = os.pipe()
+        (rerr, werr) = os.pipe()
+        proc         = AutonRemoteProcess(os.fdopen(rout, 'rb', 0),
+                                          os.fdopen(rerr, 'rb', 0))
+
+        try:
+            with self._lock:
+                sock = self._sock
+                if sock is None:
+                    raise OSError(errno.ECHILD, "fork server exited")
+
+                xid = next(self._seq)
+                self._spawns[xid] = proc
+
+            # the reader must not wait for the lock of the sends,
+            # or the fork server could block on its own sends
+            try:
+                with self._send_lock:
+                    _send(sock,
+                          {'id':      xid,
+                           'args':    list(args),
+                           'env':     env,
+                           'cwd':     cwd or os.getcwd(),
+                           'rlimits': rlimits},
+                          (wout, werr))
+            except Exception:
+                with self._lock:
+                    self._spawns.pop(xid, None)
+                raise
+        except Exception:
+            proc.stdout.close()
+            proc.stderr.close()
+            raise
+        finally:
+            os.close(wout)
+            os.close(werr)
+
+        proc.spawned.wait()
+
+        if proc.error is not None:
+            proc.stdout.close()
+            proc.stderr.close()
+            raise proc.error
+
+        return proc
+
+
+class AutonLauncher(object): # pylint: disable=useless-object-inheritance
+    """
+    Creation of the child processes of the endpoints: with subprocess,
+    with posix_spawn when there is no working directory to change to,
+    or by the fork server. The fork server also sets the resource limits,
+    it is started for them whatever the mode.
+    """
+    def __init__(self):
+        self.mode       = DEFAULT_LAUNCHER
+        self.uid        = None
+        self.gid        = None
+        self.rlimits    = False
+        self.started    = False
+        self.forkserver = None
+
+    def configure(self, mode, uid = None, gid = None):
+        if mode not in LAUNCHERS:
+            raise AutonConfigurationError("invalid launcher: %r" % mode)
+
+        self.mode = mode
+        self.uid  = uid
+        self.gid  = gid
+
+    def use_rlimits(self):
+        """
+        Called by the endpoints with resource limits.
+        """
+        if self.started and self.forkserver is None and not self.rlimits:
+            LOG.warning("no fork server, the resource limits are set in the child of subprocess")
+
+        self.rlimits = True
+
+    def start(self):
+        """
+        Must be called in the daemon process, the fork server
+        and its reader thread would not survive daemonize(),
+        and before any thread is started.
+        """
+        self.started = True
+
+        if self.mode == LAUNCHER_POPEN and not self.rlimits:
+            return
+
+        if self.mode == LAUNCHER_POSIX_SPAWN and not hasattr(os, 'posix_spawn'):
+            LOG.warning("posix_spawn unavailable, using the fork server")
+
+        if not AutonForkServer.is_supported():
+            LOG.warning("fork server unsupported, using subprocess")
+            return
+
+        self.forkserver = AutonForkServer()
+        self.forkserver.start(self.uid, self.gid)
+
+    @staticmethod
+    def _posix_spawn(args, env):
+        path = args[0]
+        if os.sep not in path:
+            path = which(path, path = env.get('PATH', os.defpath))
+            if not path:
+                raise OSError(errno.ENOENT, os.strerror(errno.ENOENT), args[0])
+
+        (rout, wout) = os.pipe()
+        (rerr, werr) = os.pipe()
+
+        try:
+            pid = os.posix_spawn(path, # pylint: disable=no-member
+                                 args,
+                                 env,
+                                 file_actions = [(os.POSIX_SPAWN_DUP2, wout, 1), # pylint: disable=no-member
+                                                 (os.POSIX_SPAWN_DUP2, werr, 2)], # pylint: disable=no-member
+                                 setsigdef    = RESET_SIGNALS)
+        except Exception:
+            os.close(rout)
+            os.close(rerr)
+            raise
+        finally:
+            os.close(wout)
+            os.close(werr)
+
+        return AutonProcess(pid, rout, rerr)
+
+    def spawn(self, args, env, cwd = None, rlimits = None):
+        start = time.time()
+
+        if self.forkserver is not None \
+           and (rlimits
+                or (self.mode != LAUNCHER_POPEN
+                    and (cwd or self.mode == LAUNCHER_FORKSERVER or not hasattr(os, 'posix_spawn')))):
+            launcher = LAUNCHER_FORKSERVER
+            proc     = self.forkserver.spawn(args, env, cwd, rlimits)
+        elif self.mode == LAUNCHER_POSIX_SPAWN and not cwd and not rlimits and hasattr(os, 'posix_spawn'):
+            launcher = LAUNCHER_POSIX_SPAWN
+            proc     = self._posix_spawn(args, env)
+        else:
+            # preexec_fn is not safe with threads, only without fork server
+            launcher = LAUNCHER_POPEN
+            proc     = AutonPopen(args,
+                                  stdout     = subprocess.PIPE,
+                                  stderr     = subprocess.PIPE,
+                                  env        = env,
+                                  cwd        = cwd,
+                                  preexec_fn = rlimits and partial(set_rlimits, rlimits) or None)
+
+        SPAWN_LATENCY.observe(time.time() - start, launcher = launcher)
+        SPAWNS_TOTAL.inc(launcher = launcher)
+
+        return proc
+
+
+LAUNCHER = AutonLauncher()
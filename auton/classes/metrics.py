@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2018-2022 fjord-technologies
+# SPDX-License-Identifier: GPL-3.0-or-later
+"""auton.classes.metrics"""
+
+import bisect
+import logging
+import threading
+
+LOG             = logging.getLogger('auton.metrics')
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1, 2.5, 5, 10, 30, 60, 300, 900, 3600)
+
+CONTENT_TYPE    = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _escape(value):
+    return ("%s" % value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+
+    return repr(float(value)) if isinstance(value, float) else "%s" % value
+
+def _format_labels(labelnames, labelvalues, extra = None):
+    labels = list(zip(labelnames, labelvalues))
+    if extra:
+        labels.append(extra)
+
+    if not labels:
+        return ''
+
+    return "{%s}" % ','.join('%s="%s"' % (k, _escape(v)) for k, v in labels)
+
+
+class AutonMetric(object): # pylint: disable=useless-object-inheritance
+    kind = None
+
+    def __init__(self, name, doc, labelnames = ()):
+        self.name       = name
+        self.doc        = doc
+        self.labelnames = tuple(labelnames)
+        self._lock      = threading.Lock()
+        self._values    = {}
+
+    def _key(self, labels):
+        return tuple("%s" % labels.get(x, '') for x in self.labelnames)
+
+    def _samples(self):
+        with self._lock:
+            return [(key, value) for key, value in sorted(self._values.items())]
+
+    def render(self):
+        r = ["# HELP %s %s" % (self.name, _escape(self.doc)),
+             "# TYPE %s %s" % (self.name, self.kind)]
+
+        for key, value in self._samples():
+            r.append("%s%s %s" % (self.name,
+                                  _format_labels(self.labelnames, key),
+                                  _format_value(value)))
+
+        return r
+
+
+class AutonCounter(AutonMetric):
+    kind = 'counter'
+
+    def __init__(self, name, doc, labelnames = ()):
+        AutonMetric.__init__(self, name, doc, labelnames)
+        if not self.labelnames:
+            self._values[()] = 0
+
+    def inc(self, value = 1, **labels):
+        key = self._key(labels)
+
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+
+class AutonGauge(AutonMetric):
+    kind = 'gauge'
+
+    def __init__(self, name, doc, labelnames = ()):
+        AutonMetric.__init__(self, name, doc, labelnames)
+        if not self.labelnames:
+            self._values[()] = 0
+
+    def inc(self, value = 1, **labels):
+        key = self._key(labels)
+
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def dec(self, value = 1, **labels):
+        return self.inc(-value, **labels)
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+
+        with self._lock:
+            self._values[key] = value
+
+
+class AutonHistogram(AutonMetric):
+    kind = 'histogram'
+
+    def __init__(self, name, doc, labelnames = (), buckets = DEFAULT_BUCKETS):
+        AutonMetric.__init__(self, name, doc, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        idx = bisect.bisect_left(self.buckets, value)
+
+        with self._lock:
+            if key not in self._values:
+                self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+
+            r = self._values[key]
+            r[0][idx] += 1
+            r[1]      += value
+            r[2]      += 1
+
+    def _samples(self):
+        with self._lock:
+            return [(key, (list(value[0]), value[1], value[2]))
+                    for key, value in sorted(self._values.items())]
+
+    def render(self):
+        r = ["# HELP %s %s" % (self.name, _escape(self.doc)),
+             "# TYPE %s %s" % (self.name, self.kind)]
+
+        for key, (counts, xsum, xcount) in self._samples():
+            cumul = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumul += count
+                r.append("%s_bucket%s %d" % (self.name,
+                                             _format_labels(self.labelnames, key, ('le', _format_value(float(bound)))),
+                                             cumul))
+
+            labels = _format_labels(self.labelnames, key)
+            r.append("%s_sum%s %s" % (self.name, labels, _format_value(xsum)))
+            r.append("%s_count%s %d" % (self.name, labels, xcount))
+
+        return r
+
+
+class AutonMetrics(object): # pylint: disable=useless-object-inheritance
+    """
+    Metrics updated in place by the code paths they describe,
+    so that a scrape only formats current values.
+    """
+    def __init__(self):
+        self._lock    = threading.Lock()
+        self._metrics = {}
+
+    def _register(self, cls, name, doc, labelnames, **kwargs):
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = cls(name, doc, labelnames, **kwargs)
+            elif not isinstance(self._metrics[name], cls):
+                raise TypeError("metric %r already registered as %s"
+                                % (name, self._metrics[name].kind))
+
+            return self._metrics[name]
+
+    def counter(self, name, doc, labelnames = ()):
+        return self._register(AutonCounter, name, doc, labelnames)
+
+    def gauge(self, name, doc, labelnames = ()):
+        return self._register(AutonGauge, name, doc, labelnames)
+
+    def histogram(self, name, doc, labelnames = (), buckets = DEFAULT_BUCKETS):
+        return self._register(AutonHistogram, name, doc, labelnames, buckets = buckets)
+
+    def render(self):
+        with self._lock:
+            metrics = [self._metrics[x] for x in sorted(self._metrics)]
+
+        r = []
+        for metric in metrics:
+            r.extend(metric.render())
+
+        return "\n".join(r) + "\n"
+
+
+METRICS = AutonMetrics()
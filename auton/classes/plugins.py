@@ -4,7 +4,11 @@
 """auton.classes.plugins"""
 
 import abc
+import heapq
+import itertools
+import json
 import logging
+import math
 import os
 import threading
 import time
@@ -17,15 +21,87 @@ from six.moves import queue as _queue
 from dwho.classes.plugins import DWhoPluginBase
 from dwho.config import load_credentials
 
+from auton.classes.buffer import AutonOutputBuffer, DEFAULT_MAX_MEMORY
+from auton.classes.cache import (AutonResultCache,
+                                 DEFAULT_MAX_ENTRIES as DEFAULT_CACHE_MAX_ENTRIES,
+                                 DEFAULT_MAX_SIZE as DEFAULT_CACHE_MAX_SIZE)
+from auton.classes.journal import OUTPUT_ERROR, OUTPUT_RESULT
+from auton.classes.metrics import METRICS
 from auton.classes.target import AutonTarget
-from auton.classes.exceptions import AutonTargetUnauthorized
+from auton.classes.exceptions import (AutonConfigurationError,
+                                      AutonEndpointClosed,
+                                      AutonTargetExpired,
+                                      AutonTargetUnauthorized)
 
 LOG                   = logging.getLogger('auton.plugins')
+PHASES_LOG            = logging.getLogger('auton.phases')
 
 DEFAULT_BECOME_METHOD = 'sudo'
 DEFAULT_BECOME_USER   = 'root'
 DEFAULT_BECOME_OPTS   = {'sudo': ['-H', '-E']}
 
+DEFAULT_WORKERS       = 1
+DEFAULT_DURATION      = 1.0
+DURATION_SMOOTHING    = 0.2
+DEFAULT_AGING         = 60
+
+PHASE_QUEUED          = 'queued'
+PHASE_DEQUEUED        = 'dequeued'
+PHASE_PREPARED        = 'prepared'
+PHASE_SPAWNED         = 'spawned'
+PHASE_FIRST_BYTE      = 'first_byte'
+PHASE_EXITED          = 'exited'
+PHASE_DRAINED         = 'drained'
+PHASE_COLLECTED       = 'collected'
+PHASES                = (PHASE_QUEUED,
+                         PHASE_DEQUEUED,
+                         PHASE_PREPARED,
+                         PHASE_SPAWNED,
+                         PHASE_FIRST_BYTE,
+                         PHASE_EXITED,
+                         PHASE_DRAINED,
+                         PHASE_COLLECTED)
+PHASE_BUCKETS         = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05,
+                         0.1, 0.5, 1, 5, 30, 120, 600)
+
+monotonic             = getattr(time, 'monotonic', time.time)
+
+QUEUE_DEPTH           = METRICS.gauge('auton_queue_depth',
+                                      "Jobs waiting in the endpoint queue",
+                                      ('endpoint',))
+QUEUE_WAIT            = METRICS.histogram('auton_queue_wait_seconds',
+                                          "Time spent by jobs in the endpoint queue",
+                                          ('endpoint',))
+RUN_DURATION          = METRICS.histogram('auton_run_duration_seconds',
+                                          "Duration of the jobs run by the endpoint",
+                                          ('endpoint',))
+WORKERS_TOTAL         = METRICS.gauge('auton_workers',
+                                      "Workers of the endpoint",
+                                      ('endpoint',))
+WORKERS_BUSY          = METRICS.gauge('auton_workers_busy',
+                                      "Workers of the endpoint running a job",
+                                      ('endpoint',))
+JOBS_TOTAL            = METRICS.counter('auton_jobs_total',
+                                        "Jobs completed by the endpoint",
+                                        ('endpoint', 'result'))
+JOBS_COALESCED        = METRICS.counter('auton_jobs_coalesced_total',
+                                        "Jobs attached to an identical job in flight",
+                                        ('endpoint',))
+JOB_CPU               = METRICS.counter('auton_job_cpu_seconds_total',
+                                        "CPU time used by the processes of the endpoint jobs",
+                                        ('endpoint', 'mode'))
+JOB_MAX_RSS           = METRICS.histogram('auton_job_max_rss_bytes',
+                                          "Peak resident set size of the processes of the endpoint jobs",
+                                          ('endpoint',),
+                                          buckets = tuple(2 ** x for x in range(20, 36, 2)))
+JOB_BLOCK_IO          = METRICS.counter('auton_job_block_io_total',
+                                        "Block I/O operations of the processes of the endpoint jobs",
+                                        ('endpoint', 'direction'))
+JOB_PHASE             = METRICS.histogram('auton_job_phase_seconds',
+                                          "Time taken by the endpoint jobs to reach a phase from the phase reached before",
+                                          ('endpoint', 'phase'),
+                                          buckets = PHASE_BUCKETS)
+
 STATUS_NEW            = 'new'
 STATUS_PROCESSING     = 'processing'
 STATUS_COMPLETE       = 'complete'
@@ -58,22 +134,58 @@ class AutonEPTsSync(dict):
 EPTS_SYNC = AutonEPTsSync()
 
 
+class AutonJobRequest(object): # pylint: disable=useless-object-inheritance
+    """
+    Stand-in for the HTTP request of a job not submitted alone,
+    i.e. restored from the journal or part of a batch.
+    """
+    def __init__(self, payload, server_vars = None):
+        self.payload     = payload
+        self.server_vars = server_vars or {}
+
+    def payload_params(self):
+        return self.payload
+
+    def get_server_vars(self):
+        return self.server_vars
+
+
 class AutonEPTObject(object): # pylint: disable=useless-object-inheritance
-    def __init__(self, name, uid, endpoint, method, request, callback = None):
+    def __init__(self, name, uid, endpoint, method, request, callback = None, output = None,
+                 priority = 0, deadline = None):
+        if not output:
+            output = {}
+
         self.name        = name
         self.uid         = uid
         self.endpoint    = endpoint
         self.method      = method
         self.request     = request
-        self.result      = []
+        self.result      = AutonOutputBuffer(output.get('max_memory', DEFAULT_MAX_MEMORY),
+                                             output.get('tmpdir'))
         self.callback    = callback
         self.status      = STATUS_NEW
         self.return_code = None
+        self.rusage      = None
         self.prv_pos     = 0
         self.cur_pos     = 0
-        self.errors      = []
+        self.errors      = AutonOutputBuffer(output.get('max_memory', DEFAULT_MAX_MEMORY),
+                                             output.get('tmpdir'))
+        self.queued_at   = None
+        self.phases      = {}
         self.started_at  = None
         self.ended_at    = None
+        self.priority    = priority
+        self.deadline    = deadline
+        self.tmpdirs     = []
+        self.uploads     = {}
+        self.blobs       = {}
+        self.journal     = None
+        self.cache_key   = None
+        self.flight_key  = None
+        self.outcome     = None
+        self.followers   = []
+        self._cond       = threading.Condition()
         self.vars        = {'_env_':    os.environ.copy(),
                             '_time_':   datetime.now(),
                             '_gmtime_': datetime.utcnow(),
@@ -84,35 +196,77 @@ class AutonEPTObject(object): # pylint: disable=useless-object-inheritance
         return self.uid
 
     def add_error(self, error):
-        self.errors.append(error)
+        with self._cond:
+            self.errors.append(error)
+            if self.journal:
+                self.journal.output(self.uid, OUTPUT_ERROR, error)
+            for x in self.followers:
+                x.add_error(error)
+
         return self
 
     def has_error(self):
         return len(self.errors) != 0
 
     def get_errors(self):
-        return self.errors
+        return self.errors.tolist()
 
     def set_return_code(self, rc):
-        self.return_code = rc
+        with self._cond:
+            self.return_code = rc
+            for x in self.followers:
+                x.set_return_code(rc)
+
         return self
 
     def get_return_code(self):
         return self.return_code
 
+    def set_rusage(self, rusage):
+        with self._cond:
+            self.rusage = rusage
+            for x in self.followers:
+                x.set_rusage(rusage)
+
+        return self
+
+    def get_rusage(self):
+        return self.rusage
+
+    def wait_changes(self, timeout):
+        deadline = time.time() + timeout
+
+        with self._cond:
+            status = self.status
+            while self.status == status \
+                  and self.status != STATUS_COMPLETE \
+                  and len(self.result) <= self.cur_pos:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+
+        return self
+
     def add_result(self, result):
-        self.result.append(result)
+        with self._cond:
+            self.result.append(result)
+            if self.journal:
+                self.journal.output(self.uid, OUTPUT_RESULT, result)
+            for x in self.followers:
+                x.add_result(result)
+            self._cond.notify_all()
 
         return self
 
     def get_result(self):
-        return self.result
+        return self.result.tolist()
 
     def get_last_result(self):
         self.prv_pos = self.cur_pos
         self.cur_pos = len(self.result)
 
-        return self.result[self.prv_pos:self.cur_pos]
+        return self.result.get(self.prv_pos, self.cur_pos)
 
     def get_endpoint(self):
         return self.endpoint
@@ -124,21 +278,97 @@ class AutonEPTObject(object): # pylint: disable=useless-object-inheritance
         return self.request
 
     def set_status(self, status):
-        self.status = status
+        with self._cond:
+            self.status = status
+            if self.journal:
+                self.journal.update(self)
+            for x in self.followers:
+                x.set_status(status)
+            self._cond.notify_all()
 
         return self
 
     def get_status(self):
         return self.status
 
+    def is_complete(self):
+        return self.status == STATUS_COMPLETE
+
+    def set_queued_at(self):
+        self.queued_at = time.time()
+        self.mark(PHASE_QUEUED)
+
+    def get_queued_at(self):
+        return self.queued_at
+
     def set_started_at(self):
-        self.started_at = time.time()
+        with self._cond:
+            self.started_at = time.time()
+            for x in self.followers:
+                x.set_started_at()
 
     def get_started_at(self):
         return self.started_at
 
+    def mark(self, phase):
+        """
+        Record on the monotonic clock when the job first reaches phase,
+        the phases reached once the job is collected are ignored.
+        """
+        with self._cond:
+            if phase not in self.phases and PHASE_COLLECTED not in self.phases:
+                self.phases[phase] = monotonic()
+            for x in self.followers:
+                x.mark(phase)
+
+        return self
+
+    def collect(self):
+        """
+        Mark the job collected once its complete result is returned,
+        return False if it was already.
+        """
+        with self._cond:
+            if PHASE_COLLECTED in self.phases:
+                return False
+            self.phases[PHASE_COLLECTED] = monotonic()
+
+        return True
+
+    def get_phases(self):
+        """
+        Seconds elapsed from the first phase to each phase reached.
+        """
+        with self._cond:
+            if not self.phases:
+                return {}
+
+            origin = min(self.phases.values())
+
+            return dict((phase, round(value - origin, 6))
+                        for phase, value in self.phases.items())
+
+    def get_phase_durations(self):
+        """
+        Seconds taken to reach each phase from the phase reached before,
+        e.g. a program may exit before writing anything.
+        """
+        r   = []
+        prv = None
+
+        with self._cond:
+            for phase in sorted(self.phases, key = lambda x: (self.phases[x], PHASES.index(x))):
+                if prv is not None:
+                    r.append((phase, self.phases[phase] - prv))
+                prv = self.phases[phase]
+
+        return r
+
     def set_ended_at(self):
-        self.ended_at = time.time()
+        with self._cond:
+            self.ended_at = time.time()
+            for x in self.followers:
+                x.set_ended_at()
 
     def get_ended_at(self):
         return self.ended_at
@@ -146,24 +376,257 @@ class AutonEPTObject(object): # pylint: disable=useless-object-inheritance
     def get_vars(self):
         return self.vars
 
+    def get_priority(self):
+        return self.priority
+
+    def get_deadline(self):
+        return self.deadline
+
+    def is_expired(self):
+        return self.deadline is not None and self.deadline < time.time()
+
+    def set_uploads(self, uploads):
+        self.uploads = uploads
+        return self
+
+    def get_upload(self, name):
+        return self.uploads.get(name)
+
+    def set_blobs(self, blobs):
+        self.blobs = blobs
+        return self
+
+    def get_blob(self, digest, filename = None):
+        return self.blobs.get((digest, filename))
+
+    def add_tmpdir(self, tmpdir):
+        self.tmpdirs.append(tmpdir)
+        return self
+
+    def pop_tmpdirs(self):
+        r = self.tmpdirs
+        self.tmpdirs = []
+
+        return r
+
+    def restore(self, status, return_code, started_at, ended_at, results, errors):
+        """
+        Set the state of a job restored from the journal.
+        """
+        for x in results:
+            self.result.append(x)
+
+        for x in errors:
+            self.errors.append(x)
+
+        self.status      = status
+        self.return_code = return_code
+        self.started_at  = started_at
+        self.ended_at    = ended_at
+
+        return self
+
+    def attach(self, follower):
+        """
+        Make follower share the execution of this job: it gets the output
+        so far and then every change, until this job is complete.
+        Return False if this job is already complete.
+        """
+        with self._cond:
+            if self.status == STATUS_COMPLETE:
+                return False
+
+            for x in self.result.tolist():
+                follower.add_result(x)
+
+            for x in self.errors.tolist():
+                follower.add_error(x)
+
+            if self.started_at is not None:
+                follower.set_started_at()
+                follower.set_status(self.status)
+
+            self.followers.append(follower)
+
+        return True
+
+    def set_journal(self, journal):
+        self.journal = journal
+        return self
+
+    def close(self):
+        if self.journal:
+            self.journal.remove(self.uid)
+            self.journal = None
+
+        self.result.close()
+        self.errors.close()
+
     def __call__(self):
         if self.callback:
             self.callback(self)
 
 
 class AutonEPTSync(object): # pylint: disable=useless-object-inheritance
+    """
+    Endpoint queue ordered by priority with aging: a job of priority p
+    is queued as if it had been submitted p * aging seconds earlier.
+    """
     __metaclass__ = abc.ABCMeta
 
-    def __init__(self, name):
-        self.name       = name
-        self.queue      = _queue.Queue()
-        self.results    = {}
-
-    def qput(self, item):
-        return self.queue.put(item)
+    def __init__(self, name, output = None, max_queue = 0, workers = DEFAULT_WORKERS, aging = DEFAULT_AGING,
+                 cache = None, single_flight = False, phase_metrics = False):
+        self.name          = name
+        self.output        = output or {}
+        self.max_queue     = max_queue
+        self.workers       = workers
+        self.aging         = aging
+        self.cache         = cache
+        self.single_flight = single_flight
+        self.phase_metrics = phase_metrics
+        self.flights       = {}
+        self.results       = {}
+        self.duration      = None
+        self.busy          = 0
+        self.closed        = False
+        self._heap         = []
+        self._seq          = itertools.count()
+        self._cond         = threading.Condition()
+
+    def report_phases(self, obj):
+        """
+        Log the phases of a job run by a worker, once collected or expired.
+        """
+        if PHASES_LOG.isEnabledFor(logging.INFO):
+            PHASES_LOG.info(json.dumps({'uid':      obj.get_uid(),
+                                        'endpoint': self.name,
+                                        'result':   obj.outcome,
+                                        'phases':   obj.get_phases()},
+                                       sort_keys = True))
+
+        if self.phase_metrics:
+            for phase, duration in obj.get_phase_durations():
+                JOB_PHASE.observe(duration, endpoint = self.name, phase = phase)
+
+    def qput(self, item, flight_key = None):
+        """
+        With flight_key, attach item to the job of the same key
+        still queued or running if any, instead of queuing it.
+        Return False if item was attached.
+        """
+        key = time.time() - (item.get_priority() * self.aging)
+
+        with self._cond:
+            if self.closed:
+                raise AutonEndpointClosed("endpoint closed: %r" % self.name)
+
+            if flight_key is not None:
+                leader = self.flights.get(flight_key)
+                if leader is not None and leader.attach(item):
+                    item.set_queued_at()
+                    JOBS_COALESCED.inc(endpoint = self.name)
+                    return False
+
+            if self.max_queue > 0 and len(self._heap) >= self.max_queue:
+                raise _queue.Full
+
+            if flight_key is not None:
+                self.flights[flight_key] = item
+                item.flight_key = flight_key
+
+            item.set_queued_at()
+            heapq.heappush(self._heap, (key, next(self._seq), item))
+            QUEUE_DEPTH.inc(endpoint = self.name)
+            self._cond.notify()
+
+        return True
+
+    def land(self, item):
+        """
+        Stop attaching new jobs to item.
+        """
+        with self._cond:
+            if item.flight_key is not None and self.flights.get(item.flight_key) is item:
+                del self.flights[item.flight_key]
 
     def qget(self, block = True, timeout = None):
-        return self.queue.get(block, timeout)
+        """
+        Once the queue is closed, raise AutonEndpointClosed
+        instead of waiting when it is empty.
+        """
+        with self._cond:
+            if block:
+                if timeout is None:
+                    while not self._heap:
+                        if self.closed:
+                            raise AutonEndpointClosed("endpoint closed: %r" % self.name)
+                        self._cond.wait()
+                else:
+                    endtime = time.time() + timeout
+                    while not self._heap:
+                        if self.closed:
+                            raise AutonEndpointClosed("endpoint closed: %r" % self.name)
+                        remaining = endtime - time.time()
+                        if remaining <= 0:
+                            raise _queue.Empty
+                        self._cond.wait(remaining)
+            elif not self._heap:
+                if self.closed:
+                    raise AutonEndpointClosed("endpoint closed: %r" % self.name)
+                raise _queue.Empty
+
+            QUEUE_DEPTH.dec(endpoint = self.name)
+            return heapq.heappop(self._heap)[2]
+
+    def qsize(self):
+        return len(self._heap)
+
+    def close(self):
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+
+    def take_pending(self):
+        with self._cond:
+            r, self._heap = [(key, item) for key, seq, item in sorted(self._heap)], [] # pylint: disable=unused-variable
+            QUEUE_DEPTH.dec(len(r), endpoint = self.name)
+
+        return r
+
+    def requeue(self, pending):
+        with self._cond:
+            for key, item in pending:
+                heapq.heappush(self._heap, (key, next(self._seq), item))
+            QUEUE_DEPTH.inc(len(pending), endpoint = self.name)
+            self._cond.notify_all()
+
+    def position(self, item):
+        with self._cond:
+            for key, seq, x in self._heap:
+                if x is item:
+                    return 1 + sum(1 for y in self._heap if y[:2] < (key, seq))
+
+        return None
+
+    def add_duration(self, duration):
+        if self.duration is None:
+            self.duration = duration
+        else:
+            self.duration += DURATION_SMOOTHING * (duration - self.duration)
+
+    def retry_after(self):
+        duration = self.duration
+        if duration is None:
+            duration = DEFAULT_DURATION
+
+        return max(1, int(math.ceil(duration * (self.qsize() + 1) / self.workers)))
+
+    def add_busy(self, value):
+        with self._cond:
+            self.busy += value
+
+    def load(self):
+        return float(self.qsize() + self.busy) / self.workers
 
 
 class AutonPlugBase(threading.Thread, DWhoPluginBase):
@@ -182,6 +645,10 @@ class AutonPlugBase(threading.Thread, DWhoPluginBase):
         self.credentials = None
         self.users       = None
         self.target      = None
+        self.workers     = DEFAULT_WORKERS
+        self.sync        = None
+        self.source_conf = None
+        self._threads    = []
 
     def safe_init(self):
         if self.config.get('users'):
@@ -191,15 +658,90 @@ class AutonPlugBase(threading.Thread, DWhoPluginBase):
             self.credentials = load_credentials(self.config['credentials'],
                                                 config_dir = self.config['auton']['config_dir'])
 
+        if self.config['auton'].get('workers') is not None:
+            workers = self.config['auton']['workers']
+            if not isinstance(workers, int) or workers < 1:
+                raise AutonConfigurationError("invalid workers %r for endpoint: %r"
+                                              % (workers, self.name))
+            self.workers = workers
+
         self.target = AutonTarget(**{'name':        self.name,
                                      'config':      self.config['config'],
                                      'credentials': self.credentials})
 
-        EPTS_SYNC.register(AutonEPTSync(self.name))
+        output = self.config['auton'].get('output')
+        if output is not None and not isinstance(output, dict):
+            raise AutonConfigurationError("invalid output section for endpoint: %r" % self.name)
+
+        max_queue = self.config['auton'].get('max_queue') or 0
+        if not isinstance(max_queue, int) or max_queue < 0:
+            raise AutonConfigurationError("invalid max_queue %r for endpoint: %r"
+                                          % (max_queue, self.name))
+
+        aging = self.config['auton'].get('aging')
+        if aging is None:
+            aging = DEFAULT_AGING
+        elif not isinstance(aging, (int, float)) or aging < 0:
+            raise AutonConfigurationError("invalid aging %r for endpoint: %r"
+                                          % (aging, self.name))
+
+        self.sync = AutonEPTSync(self.name, output, max_queue, self.workers, aging,
+                                 self._get_cache(self.config['auton'].get('cache')),
+                                 bool(self.config['auton'].get('single_flight')),
+                                 bool(self.config['auton'].get('phase_metrics')))
+
+    def _get_cache(self, cfg):
+        if not cfg:
+            return None
+
+        if not isinstance(cfg, dict):
+            raise AutonConfigurationError("invalid cache section for endpoint: %r" % self.name)
+
+        for key in ('ttl', 'max_entries', 'max_size'):
+            if cfg.get(key) is not None \
+               and (not isinstance(cfg[key], (int, float)) or cfg[key] <= 0):
+                raise AutonConfigurationError("invalid cache %s %r for endpoint: %r"
+                                              % (key, cfg[key], self.name))
+
+        if cfg.get('ttl') is None:
+            raise AutonConfigurationError("missing cache ttl for endpoint: %r" % self.name)
+
+        return AutonResultCache(self.name,
+                                cfg['ttl'],
+                                int(cfg.get('max_entries') or DEFAULT_CACHE_MAX_ENTRIES),
+                                int(cfg.get('max_size') or DEFAULT_CACHE_MAX_SIZE))
+
+    def activate(self, previous = None):
+        """
+        Make the endpoint receive the new jobs, the jobs still waiting
+        in the queue of the previous definition are moved to this one.
+        """
+        EPTS_SYNC.register(self.sync)
+        WORKERS_TOTAL.set(self.workers, endpoint = self.name)
+
+        if previous is not None and previous.sync is not None:
+            self.sync.requeue(previous.sync.take_pending())
+
+    def retire(self):
+        """
+        Stop the workers once they have finished their current job
+        and the jobs left in the queue.
+        """
+        if self.sync is not None:
+            self.sync.close()
 
     def at_start(self):
-        if self.name in EPTS_SYNC:
-            self.start()
+        if self.sync is None or EPTS_SYNC.get(self.name) is not self.sync:
+            return
+
+        self.start()
+
+        for i in range(1, self.workers):
+            t = threading.Thread(target = self.run,
+                                 name   = "%s:%d" % (self.name, i))
+            t.daemon = True
+            t.start()
+            self._threads.append(t)
 
     @staticmethod
     def _set_default_env(env, xvars):
@@ -230,7 +772,20 @@ class AutonPlugBase(threading.Thread, DWhoPluginBase):
     def run(self):
         while True:
             try:
-                obj  = EPTS_SYNC[self.name].qget(True)
+                obj  = self.sync.qget(True)
+            except AutonEndpointClosed:
+                LOG.info("worker %r of endpoint %r retired", threading.current_thread().name, self.name)
+                return
+
+            result = 'failure'
+            obj.mark(PHASE_DEQUEUED)
+
+            try:
+                QUEUE_WAIT.observe(time.time() - obj.get_queued_at(), endpoint = self.name)
+
+                if obj.is_expired():
+                    result = 'expired'
+                    raise AutonTargetExpired("deadline exceeded before execution on endpoint: %r" % self.name)
 
                 if self.users:
                     user = obj.get_request().get_server_vars().get('HTTP_AUTH_USER')
@@ -244,27 +799,55 @@ class AutonPlugBase(threading.Thread, DWhoPluginBase):
 
                 obj.set_started_at()
                 obj.set_status(STATUS_PROCESSING)
+                self.sync.add_busy(1)
+                WORKERS_BUSY.inc(endpoint = self.name)
                 getattr(self, func)(obj)
                 obj.set_return_code(0)
+                result = 'success'
+                if obj.cache_key is not None and self.sync.cache is not None:
+                    self.sync.cache.put(obj.cache_key,
+                                        obj.get_return_code(),
+                                        obj.get_result(),
+                                        obj.get_errors())
             except Exception as e:
                 obj.add_error("ERROR: %s\n" % e)
                 obj.set_return_code(getattr(e, 'code', None))
                 LOG.exception(e)
             finally:
-                obj.set_status(STATUS_COMPLETE)
+                self.sync.land(obj)
                 obj.set_ended_at()
+                obj.outcome = result
+                obj.set_status(STATUS_COMPLETE)
+                if obj.get_started_at():
+                    self.sync.add_busy(-1)
+                    WORKERS_BUSY.dec(endpoint = self.name)
+                    duration = obj.get_ended_at() - obj.get_started_at()
+                    RUN_DURATION.observe(duration, endpoint = self.name)
+                    self.sync.add_duration(duration)
+                self._observe_rusage(obj.get_rusage())
+                JOBS_TOTAL.inc(endpoint = self.name, result = result)
                 obj()
 
-            self.terminate()
+            self.terminate(obj)
+
+    def _observe_rusage(self, rusage):
+        if not rusage:
+            return
+
+        JOB_CPU.inc(rusage['utime'], endpoint = self.name, mode = 'user')
+        JOB_CPU.inc(rusage['stime'], endpoint = self.name, mode = 'system')
+        JOB_MAX_RSS.observe(rusage['maxrss'], endpoint = self.name)
+        JOB_BLOCK_IO.inc(rusage['inblock'], endpoint = self.name, direction = 'in')
+        JOB_BLOCK_IO.inc(rusage['oublock'], endpoint = self.name, direction = 'out')
 
-    def terminate(self):
+    def terminate(self, obj):
         func = 'do_terminate'
 
         if not hasattr(self, func):
             return
 
         try:
-            getattr(self, func)()
+            getattr(self, func)(obj)
         except Exception as e:
             LOG.debug(e)
 
@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2018-2022 fjord-technologies
+# SPDX-License-Identifier: GPL-3.0-or-later
+"""auton.classes.registry"""
+
+import logging
+import threading
+import time
+import zlib
+
+from collections import OrderedDict
+
+from six import ensure_binary
+from sonicprobe.libs.moresynchro import RWLock
+
+from auton.classes.metrics import METRICS
+
+LOG            = logging.getLogger('auton.registry')
+
+DEFAULT_SHARDS = 16
+
+JOBS           = METRICS.gauge('auton_registry_jobs',
+                               "Jobs kept in the job registry")
+EVENTS         = METRICS.counter('auton_registry_events_total',
+                                 "Job registry events",
+                                 ('event',))
+LOCK_WAIT      = METRICS.counter('auton_registry_lock_wait_seconds_total',
+                                 "Time spent waiting for job registry locks")
+
+_clock         = getattr(time, 'monotonic', time.time)
+
+
+class AutonJobShard(object): # pylint: disable=useless-object-inheritance
+    def __init__(self, registry, max_jobs = 0):
+        self.registry = registry
+        self.max_jobs = max_jobs
+        self.lock     = RWLock()
+        self.objs     = OrderedDict()
+
+    def release(self):
+        self.lock.release()
+
+    def __len__(self):
+        return len(self.objs)
+
+    def get(self, uid):
+        obj = self.objs.get(uid)
+        if obj is None:
+            return None
+
+        if hasattr(self.objs, 'move_to_end'):
+            self.objs.move_to_end(uid)
+        else:
+            self.objs[uid] = self.objs.pop(uid)
+
+        return obj
+
+    def remove(self, uid):
+        obj = self.objs.pop(uid, None)
+        if obj is not None:
+            obj.close()
+            JOBS.dec()
+
+        return obj
+
+    def evict(self):
+        for uid, obj in self.objs.items():
+            if obj.is_complete():
+                self.remove(uid)
+                self.registry.count('evictions')
+                LOG.info("job evicted: %r", uid)
+                return True
+
+        return False
+
+    def add(self, uid, obj):
+        if self.max_jobs > 0 \
+           and len(self.objs) >= self.max_jobs \
+           and not self.evict() \
+           and not self.registry.make_room(self):
+            return False
+
+        self.objs[uid] = obj
+        JOBS.inc()
+
+        return True
+
+    def expire(self, limit):
+        r = []
+
+        for uid, obj in list(self.objs.items()):
+            if obj.is_complete() and (obj.get_ended_at() or 0) <= limit:
+                self.remove(uid)
+                self.registry.count('expirations')
+                LOG.info("job expired: %r", uid)
+                r.append(obj)
+
+        return r
+
+
+class AutonJobRegistry(object): # pylint: disable=useless-object-inheritance
+    """
+    Jobs indexed by uid, spread over shards having their own lock,
+    so that requests on unrelated jobs do not wait for each other.
+    """
+    def __init__(self, shards = DEFAULT_SHARDS, max_jobs = 0, lock_timeout = None):
+        nb_jobs           = 0
+        if max_jobs > 0:
+            nb_jobs       = max(1, -(-max_jobs // shards))
+
+        self.max_jobs     = max_jobs
+        self.lock_timeout = lock_timeout
+        self.shards       = [AutonJobShard(self, nb_jobs) for x in range(shards)] # pylint: disable=unused-variable
+        self.counters     = {'contentions': 0,
+                             'evictions':   0,
+                             'expirations': 0,
+                             'lock_wait':   0.0}
+        self._lock        = threading.Lock()
+
+    def __len__(self):
+        return sum(len(shard) for shard in self.shards)
+
+    def count(self, name, value = 1):
+        with self._lock:
+            self.counters[name] += value
+
+        EVENTS.inc(value, event = name)
+
+    def get_shard(self, uid):
+        return self.shards[zlib.crc32(ensure_binary(uid)) % len(self.shards)]
+
+    def _acquire(self, shard, write):
+        func = shard.lock.acquire_write if write else shard.lock.acquire_read
+
+        if func(0):
+            return True
+
+        start = _clock()
+        r     = func(self.lock_timeout)
+        wait  = _clock() - start
+
+        with self._lock:
+            self.counters['contentions'] += 1
+            self.counters['lock_wait']   += wait
+
+        EVENTS.inc(event = 'contentions')
+        LOCK_WAIT.inc(wait)
+
+        return r
+
+    def acquire_read(self, uid):
+        shard = self.get_shard(uid)
+        if self._acquire(shard, False):
+            return shard
+
+        return None
+
+    def acquire_write(self, uid):
+        shard = self.get_shard(uid)
+        if self._acquire(shard, True):
+            return shard
+
+        return None
+
+    def make_room(self, full):
+        """
+        Called by the shard full, locked for writing, when it holds its
+        share of max_jobs and none of its jobs is complete. The job is accepted while
+        the registry holds less than max_jobs, otherwise a completed job of
+        another shard is evicted. The other shards are not waited for,
+        that could deadlock with a request doing the same from there.
+        """
+        if len(self) < self.max_jobs:
+            return True
+
+        for shard in self.shards:
+            if shard is full or not shard.lock.acquire_write(0):
+                continue
+
+            try:
+                if shard.evict():
+                    return True
+            finally:
+                shard.release()
+
+        LOG.warning("job registry full, %d jobs kept", len(self))
+
+        return False
+
+    def remove(self, uid, obj = None):
+        """
+        Removes the job uid if it is still obj. Not done if the shard lock
+        cannot be taken, the job then expires after its retention.
+        """
+        shard = self.get_shard(uid)
+        if not self._acquire(shard, True):
+            LOG.warning("unable to take shard lock for writing after %s seconds", self.lock_timeout)
+            return None
+
+        try:
+            if obj is None or shard.objs.get(uid) is obj:
+                return shard.remove(uid)
+        finally:
+            shard.release()
+
+        return None
+
+    def expire(self, limit):
+        """
+        Remove the complete jobs ended before limit, return them.
+        """
+        r = []
+
+        for shard in self.shards:
+            if not self._acquire(shard, True):
+                LOG.warning("unable to take shard lock for writing after %s seconds", self.lock_timeout)
+                continue
+
+            try:
+                r.extend(shard.expire(limit))
+            finally:
+                shard.release()
+
+        return r
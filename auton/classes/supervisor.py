@@ -0,0 +1,426 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2018-2022 fjord-technologies
+# SPDX-License-Identifier: GPL-3.0-or-later
+"""auton.classes.supervisor"""
+
+import errno
+import heapq
+import itertools
+import logging
+import os
+import threading
+import time
+
+try:
+    import selectors
+except ImportError:
+    import selectors2 as selectors
+
+from auton.classes.plugins import PHASE_DRAINED, PHASE_EXITED, PHASE_FIRST_BYTE
+
+LOG                   = logging.getLogger('auton.supervisor')
+
+DEFAULT_DRAIN_TIMEOUT = 5
+DEFAULT_POLL_INTERVAL = 0.1
+DEFAULT_MAX_LINE      = 65536
+READ_SIZE             = 65536
+
+STREAM_RESULT         = 'result'
+STREAM_ERROR          = 'error'
+
+# timers must not follow the steps of the wall clock
+_clock                = getattr(time, 'monotonic', time.time)
+
+
+def _utf8_cut(data):
+    """
+    Length of data without the UTF-8 sequence truncated at its end.
+    """
+    end = len(data)
+    pos = end - 1
+
+    while pos > 0 and end - pos < 4 and (data[pos] & 0xC0) == 0x80:
+        pos -= 1
+
+    if pos < 0 or data[pos] < 0xC0:
+        return end
+
+    if data[pos] >= 0xF0:
+        size = 4
+    elif data[pos] >= 0xE0:
+        size = 3
+    else:
+        size = 2
+
+    if pos + size > end and pos > 0:
+        return pos
+
+    return end
+
+
+class AutonWatch(object): # pylint: disable=useless-object-inheritance
+    """
+    Output of a child process stored as segments of complete lines,
+    one per read, a line longer than max_line is split. Past max_output
+    bytes the output is dropped and the process terminated.
+    """
+    def __init__(self, proc, obj, timeout = None, max_line = DEFAULT_MAX_LINE, max_output = None):
+        self.proc       = proc
+        self.obj        = obj
+        self.timeout    = timeout
+        self.max_line   = max_line
+        self.max_output = max_output
+        self.output     = 0
+        self.streams    = {}
+        self.pidfd      = None
+        self.exited     = False
+        self.closed     = False
+        self.timed_out  = False
+        self.overflowed = False
+        self.started    = False
+        self.done       = threading.Event()
+
+        for fileobj, kind in ((proc.stdout, STREAM_RESULT),
+                              (proc.stderr, STREAM_ERROR)):
+            if fileobj is not None:
+                self.streams[fileobj.fileno()] = [fileobj, kind, bytearray()]
+
+    def emit(self, kind, data):
+        if kind == STREAM_RESULT:
+            self.obj.add_result(data)
+        else:
+            self.obj.add_error(data)
+
+    def limit(self, size):
+        """
+        Return how many of size bytes read may be kept.
+        """
+        if not self.max_output:
+            return size
+
+        allowed      = max(0, self.max_output - self.output)
+        self.output += size
+
+        if size <= allowed:
+            return size
+
+        if not self.overflowed:
+            self.overflowed = True
+            try:
+                self.proc.terminate()
+            except OSError:
+                pass
+
+        return allowed
+
+    def _emit_lines(self, kind, data, end):
+        """
+        Emit the complete lines data[:end] as one segment, the lines
+        longer than max_line are split.
+        """
+        view = memoryview(data)
+
+        if end <= self.max_line:
+            self.emit(kind, view[:end].tobytes())
+            return
+
+        seg = pos = 0
+        while pos < end:
+            nl = data.find(b'\n', pos, end) + 1
+            if nl - pos > self.max_line:
+                if pos > seg:
+                    self.emit(kind, view[seg:pos].tobytes())
+                while nl - pos > self.max_line:
+                    cut  = _utf8_cut(bytearray(view[pos:pos + self.max_line]))
+                    self.emit(kind, view[pos:pos + cut].tobytes())
+                    pos += cut
+                seg = pos
+            pos = nl
+
+        if end > seg:
+            self.emit(kind, view[seg:end].tobytes())
+
+    def feed(self, fd, data, size = None):
+        if size is None:
+            size = len(data)
+
+        (kind, pending) = self.streams[fd][1:]
+        view            = memoryview(data)
+        end             = data.rfind(b'\n', 0, size) + 1
+
+        if end:
+            if pending:
+                pending.extend(view[:end])
+                self._emit_lines(kind, pending, len(pending))
+                del pending[:]
+            else:
+                self._emit_lines(kind, data, end)
+
+        if end == size:
+            return
+
+        pending.extend(view[end:size])
+
+        while len(pending) >= self.max_line:
+            cut = _utf8_cut(pending[:self.max_line])
+            self.emit(kind, bytes(pending[:cut]))
+            del pending[:cut]
+
+    def eof(self, fd):
+        stream  = self.streams.pop(fd)
+        if stream[2]:
+            self.emit(stream[1], bytes(stream[2]))
+
+        try:
+            stream[0].close()
+        except (IOError, OSError):
+            pass
+
+    def wait(self, timeout = None):
+        return self.done.wait(timeout)
+
+
+class AutonSupervisor(threading.Thread):
+    """
+    Single thread watching the pipes, the exit and the timeout
+    of every running child process.
+    """
+    def __init__(self):
+        threading.Thread.__init__(self, name = 'auton-supervisor')
+
+        self.daemon     = True
+        self._lock      = threading.Lock()
+        self._pending   = []
+        self._watches   = set()
+        self._timers    = []
+        self._seq       = itertools.count()
+        self._selector  = None
+        self._wakeup    = None
+        self._buf       = bytearray(READ_SIZE)
+
+    def _ensure_started(self):
+        if self._selector is not None:
+            return
+
+        self._selector  = selectors.DefaultSelector()
+        self._wakeup    = os.pipe()
+        self._selector.register(self._wakeup[0], selectors.EVENT_READ, None)
+        self.start()
+
+    def _wake(self):
+        try:
+            os.write(self._wakeup[1], b'\0')
+        except OSError as e:
+            if e.errno not in (errno.EAGAIN, errno.EINTR):
+                raise
+
+    def _add_timer(self, deadline, watch, action):
+        heapq.heappush(self._timers, (deadline, next(self._seq), watch, action))
+
+    def watch(self, proc, obj, timeout = None, max_line = DEFAULT_MAX_LINE, max_output = None):
+        watch = AutonWatch(proc, obj, timeout, max_line, max_output)
+
+        with self._lock:
+            self._ensure_started()
+            self._pending.append(watch)
+
+        self._wake()
+
+        return watch
+
+    def notify(self):
+        """
+        Make the supervisor check the exit of the processes
+        whose exit status is reported by a third party.
+        """
+        with self._lock:
+            if self._selector is None:
+                return
+
+        self._wake()
+
+    def _register(self, watch):
+        self._watches.add(watch)
+
+        for fd in watch.streams:
+            self._selector.register(fd, selectors.EVENT_READ, watch)
+
+        # the pidfd of a process whose exit status is not known yet
+        # when it exits would stay readable
+        if hasattr(os, 'pidfd_open') and not getattr(watch.proc, 'EXIT_NOTIFIED', False):
+            try:
+                watch.pidfd = os.pidfd_open(watch.proc.pid)
+                self._selector.register(watch.pidfd, selectors.EVENT_READ, watch)
+            except OSError as e:
+                LOG.debug("unable to open pidfd for pid %r: %r", watch.proc.pid, e)
+                watch.pidfd = None
+
+        if watch.timeout:
+            self._add_timer(_clock() + watch.timeout, watch, self._on_timeout)
+
+        self._check_exited(watch)
+
+    def _unregister(self, fd):
+        try:
+            self._selector.unregister(fd)
+        except (KeyError, ValueError):
+            pass
+
+    def _finish(self, watch):
+        if watch.closed:
+            return
+
+        watch.closed = True
+
+        for fd in list(watch.streams):
+            self._unregister(fd)
+            watch.eof(fd)
+
+        if watch.pidfd is not None:
+            self._unregister(watch.pidfd)
+            os.close(watch.pidfd)
+            watch.pidfd = None
+
+        self._watches.discard(watch)
+        watch.obj.mark(PHASE_DRAINED)
+        watch.done.set()
+
+    def _check_exited(self, watch):
+        if watch.exited or watch.proc.poll() is None:
+            return
+
+        watch.exited = True
+        watch.obj.mark(PHASE_EXITED)
+
+        if watch.pidfd is not None:
+            self._unregister(watch.pidfd)
+            os.close(watch.pidfd)
+            watch.pidfd = None
+
+        if not watch.streams:
+            self._finish(watch)
+        else:
+            self._add_timer(_clock() + DEFAULT_DRAIN_TIMEOUT, watch, self._finish)
+
+    def _on_timeout(self, watch):
+        """
+        The watch is finished by the exit of the process and the drain
+        of its pipes, the process is killed if it ignores SIGTERM.
+        """
+        if watch.exited:
+            return
+
+        watch.timed_out = True
+
+        try:
+            watch.proc.terminate()
+        except OSError:
+            pass
+
+        self._add_timer(_clock() + DEFAULT_DRAIN_TIMEOUT, watch, self._on_kill)
+
+    def _on_kill(self, watch):
+        if watch.exited:
+            return
+
+        try:
+            watch.proc.kill()
+        except OSError:
+            pass
+
+        # a process stuck in the kernel does not exit even killed
+        self._add_timer(_clock() + DEFAULT_DRAIN_TIMEOUT, watch, self._finish)
+
+    def _read(self, fd):
+        """
+        Read a chunk into the buffer reused for every read,
+        return the buffer and the size read.
+        """
+        if not hasattr(os, 'readv'):
+            data = os.read(fd, READ_SIZE)
+            return (data, len(data))
+
+        return (self._buf, os.readv(fd, [self._buf]))
+
+    def _on_read(self, fd, watch):
+        # events of the same select() batch may refer to a watch
+        # finished by a previous event, its fds are already closed
+        if watch.closed:
+            return
+
+        if fd == watch.pidfd:
+            self._check_exited(watch)
+            return
+
+        if fd not in watch.streams:
+            return
+
+        try:
+            (data, size) = self._read(fd)
+        except OSError as e:
+            if e.errno in (errno.EAGAIN, errno.EINTR):
+                return
+            LOG.exception(e)
+            size = 0
+
+        if size:
+            if not watch.started:
+                watch.started = True
+                watch.obj.mark(PHASE_FIRST_BYTE)
+            size = watch.limit(size)
+            if size:
+                watch.feed(fd, data, size)
+            return
+
+        self._unregister(fd)
+        watch.eof(fd)
+
+        if not watch.streams:
+            self._check_exited(watch)
+            if watch.exited:
+                self._finish(watch)
+
+    def _next_timeout(self):
+        timeout = None
+
+        if self._timers:
+            timeout = max(0, self._timers[0][0] - _clock())
+
+        # without pidfd, the exit can only be observed by polling
+        for watch in self._watches:
+            if not watch.exited and watch.pidfd is None:
+                if timeout is None or timeout > DEFAULT_POLL_INTERVAL:
+                    timeout = DEFAULT_POLL_INTERVAL
+                break
+
+        return timeout
+
+    def run(self):
+        while True:
+            try:
+                for key, events in self._selector.select(self._next_timeout()): # pylint: disable=unused-variable
+                    if key.data is None:
+                        os.read(key.fd, READ_SIZE)
+                        continue
+                    self._on_read(key.fd, key.data)
+
+                with self._lock:
+                    pending, self._pending = self._pending, []
+
+                for watch in pending:
+                    self._register(watch)
+
+                now = _clock()
+                while self._timers and self._timers[0][0] <= now:
+                    deadline, seq, watch, action = heapq.heappop(self._timers) # pylint: disable=unused-variable
+                    if not watch.closed:
+                        action(watch)
+
+                for watch in list(self._watches):
+                    if not watch.exited and watch.pidfd is None:
+                        self._check_exited(watch)
+            except Exception as e:
+                LOG.exception(e)
+
+
+SUPERVISOR = AutonSupervisor()
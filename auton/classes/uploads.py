@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2018-2022 fjord-technologies
+# SPDX-License-Identifier: GPL-3.0-or-later
+"""auton.classes.uploads"""
+
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from auton.classes.metrics import METRICS
+
+LOG               = logging.getLogger('auton.uploads')
+
+DEFAULT_MAX_FILES = 64
+READ_SIZE         = 65536
+
+UPLOADED_BYTES    = METRICS.counter('auton_uploaded_bytes_total',
+                                    "Bytes of argument files uploaded")
+
+
+class AutonUploadDir(object): # pylint: disable=useless-object-inheritance
+    def __init__(self, tmpdir):
+        self.tmpdir     = tmpdir
+        self.files      = {}
+        self.created_at = time.time()
+
+    def get_files(self):
+        return self.files.copy()
+
+
+class AutonUploads(object): # pylint: disable=useless-object-inheritance
+    """
+    Staging area of the argument files uploaded for a job before
+    the job is submitted, one temporary directory per job uid.
+    """
+    def __init__(self, tmpdir = None, max_files = DEFAULT_MAX_FILES):
+        self.tmpdir    = tmpdir
+        self.max_files = max_files
+        self._lock     = threading.Lock()
+        self._dirs     = {}
+
+    def _get_dir(self, uid):
+        with self._lock:
+            if uid not in self._dirs:
+                self._dirs[uid] = AutonUploadDir(tempfile.mkdtemp(prefix = '.auton.',
+                                                                  dir    = self.tmpdir))
+            return self._dirs[uid]
+
+    def store(self, uid, name, filename, stream):
+        updir = self._get_dir(uid)
+
+        if name not in updir.files and len(updir.files) >= self.max_files:
+            raise OverflowError("too many uploads for uid: %r" % uid)
+
+        xdir  = os.path.join(updir.tmpdir, name)
+        if not os.path.isdir(xdir):
+            os.mkdir(xdir)
+
+        path  = os.path.join(xdir, os.path.basename(filename or '') or name)
+        size  = 0
+
+        with open(path, 'wb') as f:
+            while True:
+                data = stream.read(READ_SIZE)
+                if not data:
+                    break
+                f.write(data)
+                size += len(data)
+
+        UPLOADED_BYTES.inc(size)
+
+        with self._lock:
+            updir.files[name] = path
+
+        return (path, size)
+
+    def get(self, uid):
+        with self._lock:
+            return self._dirs.get(uid)
+
+    def release(self, uid):
+        """
+        Forget the uploads of uid without removing the files,
+        they belong to the job from now on.
+        """
+        with self._lock:
+            return self._dirs.pop(uid, None)
+
+    def expire(self, limit):
+        with self._lock:
+            uids = [uid for uid, updir in self._dirs.items() if updir.created_at <= limit]
+            dirs = [self._dirs.pop(uid) for uid in uids]
+
+        for updir in dirs:
+            LOG.info("uploads expired: %r", updir.tmpdir)
+            shutil.rmtree(updir.tmpdir, True)
@@ -5,33 +5,206 @@
 
 import copy
 import logging
+import os
 import re
+import shutil
+import tempfile
+import threading
+import time
+
+from collections import OrderedDict
+
+from six import ensure_text
+from six.moves import queue as _queue
 
 from dwho.classes.modules import DWhoModuleBase, MODULES
-from httpdis.ext.httpdis_json import HttpReqErrJson
+from dwho.config import DWHO_THREADS
+from httpdis.ext.httpdis_json import HttpReqErrJson, HttpReqHandler
 from sonicprobe.libs import xys
-from sonicprobe.libs.moresynchro import RWLock
 
+from auton.classes.blobstore import (AutonBlobMismatch,
+                                     AutonBlobStore,
+                                     DEFAULT_MAX_SIZE as DEFAULT_BLOB_MAX_SIZE)
+from auton.classes.cache import submission_key
+from auton.classes.cluster import AutonCluster
+from auton.classes.exceptions import AutonConfigurationError, AutonEndpointClosed
+from auton.classes.handler import AutonHttpResponseStream
+from auton.classes.journal import AutonJournal, DEFAULT_MAX_BATCH as DEFAULT_JOURNAL_MAX_BATCH
+from auton.classes.metrics import METRICS
+from auton.classes.registry import AutonJobRegistry, DEFAULT_SHARDS
+from auton.classes.uploads import AutonUploads
 # pylint: disable=unused-import
 from auton.classes.plugins import (AutonEPTObject,
+                                   AutonJobRequest,
                                    EPTS_SYNC,
                                    STATUS_NEW,
                                    STATUS_PROCESSING,
                                    STATUS_COMPLETE)
 
-LOG = logging.getLogger('auton.modules.job')
+LOG                 = logging.getLogger('auton.modules.job')
+
+DEFAULT_MAX_WAIT    = 30
+DEFAULT_RETENTION   = 3600
+DEFAULT_MAX_JOBS    = 10000
+DEFAULT_REAP_DELAY  = 60
+DEFAULT_MAX_UPLOAD  = 1073741824
+DEFAULT_MAX_BATCH   = 1000
+DEFAULT_SYNC_WAIT   = 10
+STREAM_CONTENT_TYPE = 'application/x-ndjson'
+
+REQUEST_LATENCY     = METRICS.histogram('auton_job_request_seconds',
+                                        "Latency of the job requests",
+                                        ('route',))
+
+xys.add_regex('job.id', re.compile(r'^[a-z0-9][a-z0-9\-]{7,63}$').match)
 xys.add_regex('job.envname', re.compile(r'^[a-zA-Z_][a-zA-Z0-9_]{0,63}$').match)
+xys.add_regex('job.upload', re.compile(r'^[a-zA-Z0-9][a-zA-Z0-9_\-]{0,63}$').match)
+xys.add_regex('job.digest', re.compile(r'^[a-f0-9]{64}$').match)
 
 
 class JobModule(DWhoModuleBase):
     MODULE_NAME = 'job'
 
-    LOCK        = RWLock()
+    def __init__(self):
+        DWhoModuleBase.__init__(self)
+        self._started     = False
+        self._start_lock  = threading.Lock()
 
     # pylint: disable=attribute-defined-outside-init
     def safe_init(self, options):
-        self.objs         = {}
+        modconf           = self.modconf or {}
+
         self.lock_timeout = self.config['general']['lock_timeout']
+        self.max_wait     = float(modconf.get('max_wait', DEFAULT_MAX_WAIT))
+        self.retention    = float(modconf.get('retention', DEFAULT_RETENTION))
+        self.reap_delay   = float(modconf.get('reap_delay', DEFAULT_REAP_DELAY))
+        self.registry     = AutonJobRegistry(int(modconf.get('shards', DEFAULT_SHARDS)),
+                                             int(modconf.get('max_jobs', DEFAULT_MAX_JOBS)),
+                                             self.lock_timeout)
+        self.max_upload   = int(modconf.get('max_upload_size', DEFAULT_MAX_UPLOAD))
+        self.max_batch    = int(modconf.get('max_batch_jobs', DEFAULT_MAX_BATCH))
+        self.uploads      = AutonUploads(modconf.get('upload_dir'))
+        self.blobs        = None
+        self.cluster      = None
+
+        if modconf.get('cluster'):
+            self.cluster  = AutonCluster(modconf['cluster'].get('node'),
+                                         modconf['cluster'].get('peers'))
+
+        if modconf.get('blob_dir'):
+            self.blobs    = AutonBlobStore(modconf['blob_dir'],
+                                           int(modconf.get('blob_max_size', DEFAULT_BLOB_MAX_SIZE)))
+
+        self.journal      = None
+        self.journal_wait = float(modconf.get('journal_timeout', DEFAULT_SYNC_WAIT))
+
+        if modconf.get('journal'):
+            self.journal  = AutonJournal(modconf['journal'],
+                                         int(modconf.get('journal_max_batch', DEFAULT_JOURNAL_MAX_BATCH)))
+
+    def at_start(self, options):
+        DWhoModuleBase.at_start(self, options)
+        self.start()
+
+    def start(self):
+        """
+        Threads and database connections are created here,
+        in the daemon process, they would not survive daemonize().
+        Called by autond whatever the at_start flags of the routes.
+        """
+        if not hasattr(self, 'registry'):
+            raise AutonConfigurationError("job module not initialized, "
+                                          "missing safe_init on its routes")
+
+        with self._start_lock:
+            if self._started:
+                return
+
+            self._started = True
+
+        if self.journal:
+            self.journal.open()
+            self._replay_journal()
+            self.journal.start()
+            DWHO_THREADS.append(self.journal.stop)
+
+        reaper            = threading.Thread(target = self._reaper,
+                                             name   = 'auton-job-reaper')
+        reaper.daemon     = True
+        reaper.start()
+
+    def _reaper(self):
+        while True:
+            time.sleep(self.reap_delay)
+
+            try:
+                for obj in self.registry.expire(time.time() - self.retention):
+                    self._report_phases(obj)
+                self.uploads.expire(time.time() - self.retention)
+                LOG.debug("job registry: %d jobs, counters: %r",
+                          len(self.registry),
+                          self.registry.counters)
+            except Exception as e:
+                LOG.exception(e)
+
+    def _replay_journal(self):
+        for job in self.journal.replay():
+            req      = job['request']
+            ept_sync = EPTS_SYNC.get(job['endpoint'])
+            obj      = AutonEPTObject(job['endpoint'],
+                                      job['uid'],
+                                      job['endpoint'],
+                                      job['method'],
+                                      AutonJobRequest(req['payload'],
+                                                      {'HTTP_AUTH_USER': req.get('user')}),
+                                      output   = ept_sync and ept_sync.output,
+                                      priority = req.get('priority') or 0,
+                                      deadline = req.get('deadline'))
+
+            obj.set_uploads(req.get('uploads') or {})
+            obj.set_blobs(dict(((digest, filename), path) for digest, filename, path in req.get('blobs') or ()))
+            for tmpdir in req.get('tmpdirs') or ():
+                obj.add_tmpdir(tmpdir)
+
+            obj.restore(job['status'],
+                        job['return_code'],
+                        job['started_at'],
+                        job['ended_at'],
+                        job['results'],
+                        job['errors'])
+
+            if not self.registry.get_shard(job['uid']).add(job['uid'], obj):
+                LOG.warning("too many jobs, unable to restore job: %r", job['uid'])
+                self.journal.remove(job['uid'])
+                obj.close()
+                continue
+
+            obj.set_journal(self.journal)
+
+            if job['status'] == STATUS_COMPLETE:
+                continue
+
+            error = "interrupted by autond restart"
+
+            if job['status'] == STATUS_NEW:
+                if ept_sync is None:
+                    error = "unable to find endpoint: %r" % job['endpoint']
+                else:
+                    try:
+                        ept_sync.qput(obj)
+                        LOG.info("job requeued: %r", job['uid'])
+                        continue
+                    except (_queue.Full, AutonEndpointClosed):
+                        error = "unable to requeue job on endpoint: %r" % job['endpoint']
+
+            LOG.warning("job %r not restored: %s", job['uid'], error)
+
+            for tmpdir in obj.pop_tmpdirs():
+                shutil.rmtree(tmpdir, True)
+
+            obj.add_error("ERROR: %s\n" % error)
+            obj.set_ended_at()
+            obj.set_status(STATUS_COMPLETE)
 
     @staticmethod
     def _get_ept_sync(endpoint):
@@ -40,40 +213,203 @@ class JobModule(DWhoModuleBase):
 
         return EPTS_SYNC[endpoint]
 
+    def _check_owner(self, request, xid):
+        """
+        Redirect the requests of a job owned by another node.
+        """
+        if self.cluster is None or self.cluster.is_local(xid):
+            return
+
+        owner = self.cluster.owner(xid)
+        raise HttpReqErrJson(307,
+                             "job owned by: %s" % owner,
+                             headers = {'Location': owner + request.path})
+
     @staticmethod
     def _get_uid(endpoint, xid):
         return "%s:%s" % (endpoint, xid)
 
-    def _get_obj(self, endpoint, xid):
-        uid      = self._get_uid(endpoint, xid)
+    @staticmethod
+    def _get_deadline(payload):
+        """
+        start_timeout is relative to the submission, so that the deadline
+        does not depend on the clock of the client, deadline is absolute.
+        """
+        if payload.get('start_timeout') is not None:
+            return time.time() + float(payload['start_timeout'])
+
+        return payload.get('deadline') and float(payload['deadline'])
+
+    def _acquire_read(self, uid):
+        shard = self.registry.acquire_read(uid)
+        if shard is None:
+            raise HttpReqErrJson(503, "unable to take LOCK for reading after %s seconds" % self.lock_timeout)
+
+        return shard
+
+    def _acquire_write(self, uid):
+        shard = self.registry.acquire_write(uid)
+        if shard is None:
+            raise HttpReqErrJson(503, "unable to take LOCK for writing after %s seconds" % self.lock_timeout)
 
-        if uid not in self.objs:
+        return shard
+
+    @staticmethod
+    def _get_obj(shard, uid):
+        obj = shard.get(uid)
+        if obj is None:
             raise HttpReqErrJson(404, "unable to find object with uid: %r" % uid)
 
-        return self.objs[uid]
+        return obj
+
+    def _get_blobs_store(self):
+        if self.blobs is None:
+            raise HttpReqErrJson(404, "blob store disabled")
 
-    def _clear_obj(self, endpoint, xid):
-        uid = self._get_uid(endpoint, xid)
+        return self.blobs
 
-        if uid in self.objs:
-            del self.objs[uid]
+    def _clone_blobs(self, argfiles):
+        blobs   = self._get_blobs_store()
+        tmpdir  = tempfile.mkdtemp(prefix = '.auton.', dir = self.uploads.tmpdir)
+        r       = {}
+        missing = []
 
-    def _push_epts_sync(self, endpoint, xid, method, request):
+        try:
+            for i, argfile in enumerate(argfiles):
+                if argfile.get('digest') is None:
+                    continue
+
+                xdir = os.path.join(tmpdir, "%d" % i)
+                os.mkdir(xdir)
+                path = os.path.join(xdir, os.path.basename(argfile.get('filename') or '') or argfile['digest'])
+
+                if blobs.clone(argfile['digest'], path):
+                    r[(argfile['digest'], argfile.get('filename'))] = path
+                else:
+                    missing.append(argfile['digest'])
+        except Exception:
+            shutil.rmtree(tmpdir, True)
+            raise
+
+        if missing:
+            shutil.rmtree(tmpdir, True)
+            raise HttpReqErrJson(409, "missing blobs: %s" % ','.join(missing))
+
+        return (tmpdir, r)
+
+    def _push_epts_sync(self, shard, uid, endpoint, method, request, payload):
         ept_sync = self._get_ept_sync(endpoint)
-        uid      = self._get_uid(endpoint, xid)
 
-        if uid in self.objs:
+        if uid in shard.objs:
             raise HttpReqErrJson(415, "uid already exists: %r" % uid)
 
+        argfiles = payload.get('argfiles') or ()
+        updir    = None
+        if [x for x in argfiles if x.get('upload') is not None]:
+            updir = self.uploads.get(uid)
+            if updir is None:
+                raise HttpReqErrJson(415, "missing uploads for uid: %r" % uid)
+
+            for x in argfiles:
+                if x.get('upload') is not None and x['upload'] not in updir.files:
+                    raise HttpReqErrJson(415, "missing upload %r for uid: %r" % (x['upload'], uid))
+
+        (key, cached) = (None, None)
+        if ept_sync.cache is not None or ept_sync.single_flight:
+            user = request.get_server_vars().get('HTTP_AUTH_USER')
+            key  = submission_key(method,
+                                  payload,
+                                  user and ensure_text(user),
+                                  updir and updir.files)
+
+        if ept_sync.cache is not None:
+            cached = ept_sync.cache.get(key)
+
+        (blobdir, blobs) = (None, None)
+        if [x for x in argfiles if x.get('digest') is not None]:
+            (blobdir, blobs) = self._clone_blobs(argfiles)
+
         obj      = AutonEPTObject(ept_sync.name,
                                   uid,
                                   endpoint,
                                   method,
-                                  request)
-        self.objs[uid] = obj
-        ept_sync.qput(obj)
+                                  request,
+                                  output   = ept_sync.output,
+                                  priority = float(payload.get('priority') or 0),
+                                  deadline = self._get_deadline(payload))
+
+        if updir:
+            obj.set_uploads(updir.get_files())
+            obj.add_tmpdir(updir.tmpdir)
+
+        if blobdir:
+            obj.set_blobs(blobs)
+            obj.add_tmpdir(blobdir)
+
+        if cached is None and ept_sync.cache is not None:
+            obj.cache_key = key
+
+        if not shard.add(uid, obj):
+            obj.close()
+            if blobdir:
+                shutil.rmtree(blobdir, True)
+            raise HttpReqErrJson(503, "too many jobs in progress: %d" % len(self.registry))
+
+        synced = None
+        if self.journal:
+            obj.set_journal(self.journal)
+            synced = self.journal.submit(obj)
+
+        if cached is not None:
+            self._complete_cached(obj, cached)
+        else:
+            try:
+                if not ept_sync.qput(obj, key if ept_sync.single_flight else None):
+                    # attached to an identical job in flight
+                    for tmpdir in obj.pop_tmpdirs():
+                        shutil.rmtree(tmpdir, True)
+            except _queue.Full:
+                shard.remove(uid)
+                if blobdir:
+                    shutil.rmtree(blobdir, True)
+                raise HttpReqErrJson(429,
+                                     "too many jobs queued on endpoint: %r" % endpoint,
+                                     headers = {'Retry-After': "%d" % ept_sync.retry_after()})
+            except AutonEndpointClosed:
+                shard.remove(uid)
+                if blobdir:
+                    shutil.rmtree(blobdir, True)
+                raise HttpReqErrJson(429,
+                                     "endpoint is reloading: %r" % endpoint,
+                                     headers = {'Retry-After': "1"})
+
+        if updir:
+            self.uploads.release(uid)
+
+        return (obj, synced)
+
+    def _journal_timeout_error(self, uid):
+        return "job %r accepted but not written to the journal after %s seconds" % (uid, self.journal_wait)
 
-        return obj
+    @staticmethod
+    def _complete_cached(obj, cached):
+        """
+        Complete at once a job found in the result cache of the endpoint.
+        """
+        for tmpdir in obj.pop_tmpdirs():
+            shutil.rmtree(tmpdir, True)
+
+        obj.set_started_at()
+
+        for x in cached.results:
+            obj.add_result(x)
+
+        for x in cached.errors:
+            obj.add_error(x)
+
+        obj.set_return_code(cached.return_code)
+        obj.set_ended_at()
+        obj.set_status(STATUS_COMPLETE)
 
     @staticmethod
     def _build_result(obj):
@@ -83,7 +419,12 @@ class JobModule(DWhoModuleBase):
              'return_code': obj.get_return_code(),
              'started_at':  obj.get_started_at(),
              'stream':      obj.get_last_result(),
-             'ended_at':    obj.get_ended_at()}
+             'ended_at':    obj.get_ended_at(),
+             'phases':      obj.get_phases(),
+             'rusage':      obj.get_rusage()}
+
+        if r['status'] == STATUS_NEW and obj.name in EPTS_SYNC:
+            r['position'] = EPTS_SYNC[obj.name].position(obj)
 
         if obj.has_error():
             r['code']   = 400
@@ -91,6 +432,12 @@ class JobModule(DWhoModuleBase):
 
         return r
 
+    @staticmethod
+    def _report_phases(obj):
+        # only the jobs run by a worker, neither cached nor coalesced
+        if obj.outcome is not None and obj.name in EPTS_SYNC:
+            EPTS_SYNC[obj.name].report_phases(obj)
+
     RUN_QSCHEMA = xys.load("""
     endpoint: !!str
     id: !!str
@@ -103,11 +450,17 @@ class JobModule(DWhoModuleBase):
     args*: !~~seqlen(0,64) [ !!str ]
     argfiles*: !~~seqlen(0,64)
       - arg: !!str
-        content: !!str
-        filename: !!str
+        content*: !!str
+        filename*: !!str
+        upload*: !~~regex job.upload
+        digest*: !~~regex job.digest
+    priority*: !~~isFloat
+    start_timeout*: !~~isFloat
+    deadline*: !~~isFloat
     """)
 
     def job_run(self, request):
+        start   = time.time()
         params  = request.query_params() or {}
         payload = request.payload_params() or {}
 
@@ -123,31 +476,273 @@ class JobModule(DWhoModuleBase):
         if not xys.validate(payload, self.RUN_PSCHEMA):
             raise HttpReqErrJson(415, "invalid arguments for command")
 
-        if not self.LOCK.acquire_write(self.lock_timeout):
-            raise HttpReqErrJson(503, "unable to take LOCK for writing after %s seconds" % self.lock_timeout)
+        self._check_owner(request, params['id'])
 
-        try:
-            obj = self._push_epts_sync(params['endpoint'],
-                                       params['id'],
-                                       'run',
-                                       copy.copy(request))
+        uid    = self._get_uid(params['endpoint'], params['id'])
+        shard  = self._acquire_write(uid)
+        synced = None
 
-            return self._build_result(obj)
+        try:
+            (obj, synced) = self._push_epts_sync(shard,
+                                                 uid,
+                                                 params['endpoint'],
+                                                 'run',
+                                                 copy.copy(request),
+                                                 payload)
+
+            r = self._shard_result(shard, obj.get_uid())
         except HttpReqErrJson:
             raise
         except Exception as e:
             LOG.exception(e)
             raise HttpReqErrJson(503, repr(e))
         finally:
-            self.LOCK.release()
+            shard.release()
+            try:
+                if synced and not synced.wait(self.journal_wait):
+                    raise HttpReqErrJson(503, self._journal_timeout_error(uid))
+            finally:
+                REQUEST_LATENCY.observe(time.time() - start, route = 'run')
+
+        return r
+
+    BATCH_JOB_SCHEMA = xys.load("""
+    endpoint: !!str
+    id: !~~regex job.id
+    """)
+
+    @staticmethod
+    def _batch_error(uid, code, message):
+        return {'code':    code,
+                'uid':     uid,
+                'message': message}
+
+    def _get_batch_jobs(self, request, with_payload = False):
+        """
+        Return the list of (uid, job) of the batch request,
+        uid is None for an invalid job.
+        """
+        payload = request.payload_params() or {}
+
+        if not isinstance(payload, dict) or not isinstance(payload.get('jobs'), list):
+            raise HttpReqErrJson(400, "invalid arguments type")
+
+        if not payload['jobs'] or len(payload['jobs']) > self.max_batch:
+            raise HttpReqErrJson(415, "invalid number of jobs: %d" % len(payload['jobs']))
+
+        r = []
+        for job in payload['jobs']:
+            if not isinstance(job, dict):
+                r.append((None, job))
+                continue
+
+            params = dict((k, v) for k, v in job.items() if k != 'payload')
+            if with_payload and not isinstance(job.get('payload') or {}, dict):
+                r.append((None, job))
+            elif not xys.validate(params, self.BATCH_JOB_SCHEMA):
+                r.append((None, job))
+            elif with_payload and not xys.validate(job.get('payload') or {}, self.RUN_PSCHEMA):
+                r.append((None, job))
+            else:
+                r.append((self._get_uid(job['endpoint'], job['id']), job))
+
+        return r
+
+    def _batch_foreign(self, jobs, r):
+        """
+        Answer the jobs owned by other nodes with their owner URI.
+        """
+        if self.cluster is None:
+            return
+
+        for i, (uid, job) in enumerate(jobs):
+            if uid is None or self.cluster.is_local(job['id']):
+                continue
+
+            owner    = self.cluster.owner(job['id'])
+            r[i]     = {'code':     307,
+                        'uid':      uid,
+                        'message':  "job owned by: %s" % owner,
+                        'location': owner}
+            jobs[i]  = (None, job)
+
+    def _batch_by_shard(self, jobs):
+        """
+        Group the indexes of the valid jobs by shard,
+        so that each shard lock is taken once.
+        """
+        r = OrderedDict()
+
+        for i, (uid, job) in enumerate(jobs): # pylint: disable=unused-variable
+            if uid is not None:
+                r.setdefault(self.registry.get_shard(uid), []).append(i)
+
+        return r
+
+    def job_batch_run(self, request):
+        start   = time.time()
+        jobs    = self._get_batch_jobs(request, True)
+        svars   = dict(request.get_server_vars())
+        r       = [self._batch_error(None, 415, "invalid arguments for command")] * len(jobs)
+        syncs   = []
+
+        self._batch_foreign(jobs, r)
+
+        try:
+            for idxs in self._batch_by_shard(jobs).values():
+                try:
+                    shard = self._acquire_write(jobs[idxs[0]][0])
+                except HttpReqErrJson as e:
+                    for i in idxs:
+                        r[i] = self._batch_error(jobs[i][0], e.code, "%s" % e)
+                    continue
+
+                try:
+                    for i in idxs:
+                        (uid, job) = jobs[i]
+                        payload    = job.get('payload') or {}
+
+                        try:
+                            (obj, synced) = self._push_epts_sync(shard,
+                                                                 uid,
+                                                                 job['endpoint'],
+                                                                 'run',
+                                                                 AutonJobRequest(payload, svars),
+                                                                 payload)
+                            r[i] = self._shard_result(shard, obj.get_uid())
+                            if synced:
+                                syncs.append((i, uid, synced))
+                        except HttpReqErrJson as e:
+                            r[i] = self._batch_error(uid, e.code, "%s" % e)
+                        except Exception as e:
+                            LOG.exception(e)
+                            r[i] = self._batch_error(uid, 503, repr(e))
+                finally:
+                    shard.release()
+
+            deadline = time.time() + self.journal_wait
+            for i, uid, synced in syncs:
+                if not synced.wait(max(0, deadline - time.time())):
+                    r[i] = self._batch_error(uid, 503, self._journal_timeout_error(uid))
+        finally:
+            REQUEST_LATENCY.observe(time.time() - start, route = 'batch_run')
+
+        return {'code': 200,
+                'jobs': r}
 
 
     STATUS_QSCHEMA = xys.load("""
     endpoint: !!str
     id: !!str
+    wait*: !~~isFloat
     """)
 
-    def job_status(self, request):
+    UPLOAD_QSCHEMA = xys.load("""
+    endpoint: !!str
+    id: !!str
+    name: !~~regex job.upload
+    filename*: !!str
+    """)
+
+    def job_upload(self, request):
+        params = request.query_params()
+        stream = request.upload_stream()
+
+        if not isinstance(params, dict):
+            raise HttpReqErrJson(400, "invalid arguments type")
+
+        if not xys.validate(params, self.UPLOAD_QSCHEMA):
+            raise HttpReqErrJson(415, "invalid arguments for command")
+
+        self._check_owner(request, params['id'])
+
+        if stream is None:
+            raise HttpReqErrJson(415, "invalid Content-Type, expected application/octet-stream")
+
+        if self.max_upload and stream.length > self.max_upload:
+            raise HttpReqErrJson(413, "upload too large: %d bytes" % stream.length)
+
+        self._get_ept_sync(params['endpoint'])
+
+        uid = self._get_uid(params['endpoint'], params['id'])
+
+        try:
+            (path, size) = self.uploads.store(uid,
+                                              params['name'],
+                                              params.get('filename'),
+                                              stream)
+        except OverflowError as e:
+            raise HttpReqErrJson(413, "%s" % e)
+        except (IOError, OSError) as e:
+            LOG.error("unable to store upload for uid %r: %r", uid, e)
+            raise HttpReqErrJson(400, "unable to store upload: %s" % e)
+
+        LOG.debug("upload stored for uid %r: %r (%d bytes)", uid, path, size)
+
+        return {'code': 200,
+                'uid':  uid,
+                'name': params['name'],
+                'size': size}
+
+    BLOBS_QSCHEMA = xys.load("""
+    id*: !!str
+    """)
+
+    BLOBS_PSCHEMA = xys.load("""
+    digests: !~~seqlen(0,64) [ !~~regex job.digest ]
+    """)
+
+    def job_blobs(self, request):
+        params  = request.query_params()
+        payload = request.payload_params() or {}
+
+        if not isinstance(params, dict) or not isinstance(payload, dict):
+            raise HttpReqErrJson(400, "invalid arguments type")
+
+        if not xys.validate(params, self.BLOBS_QSCHEMA) \
+           or not xys.validate(payload, self.BLOBS_PSCHEMA):
+            raise HttpReqErrJson(415, "invalid arguments for command")
+
+        # the blobs of a job are stored by its owner
+        if params.get('id'):
+            self._check_owner(request, params['id'])
+
+        return {'code':    200,
+                'missing': self._get_blobs_store().missing(payload['digests'])}
+
+    def job_blob_put(self, request):
+        params = request.query_params()
+        stream = request.upload_stream()
+        blobs  = self._get_blobs_store()
+
+        if stream is None:
+            raise HttpReqErrJson(415, "invalid Content-Type, expected application/octet-stream")
+
+        if self.max_upload and stream.length > self.max_upload:
+            raise HttpReqErrJson(413, "upload too large: %d bytes" % stream.length)
+
+        try:
+            size = blobs.put(params['digest'], stream)
+        except AutonBlobMismatch as e:
+            raise HttpReqErrJson(400, "%s" % e)
+        except (IOError, OSError) as e:
+            LOG.error("unable to store blob %r: %r", params['digest'], e)
+            raise HttpReqErrJson(400, "unable to store blob: %s" % e)
+
+        return {'code':   200,
+                'digest': params['digest'],
+                'size':   size}
+
+    def job_health(self, request):
+        ept_sync = self._get_ept_sync(request.query_params()['endpoint'])
+
+        return {'code':    200,
+                'queued':  ept_sync.qsize(),
+                'busy':    ept_sync.busy,
+                'workers': ept_sync.workers,
+                'load':    ept_sync.load()}
+
+    def _get_status_params(self, request):
         params = request.query_params()
 
         if not isinstance(params, dict):
@@ -156,22 +751,142 @@ class JobModule(DWhoModuleBase):
         if not xys.validate(params, self.STATUS_QSCHEMA):
             raise HttpReqErrJson(415, "invalid arguments for command")
 
-        obj = self._get_obj(params['endpoint'], params['id'])
+        self._check_owner(request, params['id'])
 
-        if not self.LOCK.acquire_read(self.lock_timeout):
-            raise HttpReqErrJson(503, "unable to take LOCK for reading after %s seconds" % self.lock_timeout)
+        return (params, self._get_uid(params['endpoint'], params['id']))
+
+    def _wait_changes(self, uid, timeout):
+        shard = self._acquire_read(uid)
+
+        try:
+            obj = self._get_obj(shard, uid)
+        finally:
+            shard.release()
+
+        obj.wait_changes(timeout)
+
+    def _shard_result(self, shard, uid, complete = None):
+        """
+        Completed jobs are removed once their result is built, right away
+        if the shard is locked for writing, otherwise they are appended
+        to complete and removed by _remove_complete().
+        """
+        obj = self._get_obj(shard, uid)
+        r   = self._build_result(obj)
+
+        if r['status'] == STATUS_COMPLETE:
+            if obj.collect():
+                r['phases'] = obj.get_phases()
+                self._report_phases(obj)
+
+            if complete is None:
+                shard.remove(uid)
+            else:
+                complete.append((uid, obj))
+
+        return r
+
+    def _remove_complete(self, complete):
+        # called without any shard lock held
+        for uid, obj in complete:
+            self.registry.remove(uid, obj)
+
+    def _fetch_result(self, uid):
+        complete = []
+        shard    = self._acquire_read(uid)
 
         try:
-            return self._build_result(obj)
+            r    = self._shard_result(shard, uid, complete)
         except HttpReqErrJson:
             raise
         except Exception as e:
             LOG.exception(e)
             raise HttpReqErrJson(503, repr(e))
         finally:
-            if obj.get_status() == STATUS_COMPLETE:
-                self._clear_obj(params['endpoint'], params['id'])
-            self.LOCK.release()
+            shard.release()
+
+        self._remove_complete(complete)
+
+        return r
+
+    def job_status(self, request):
+        start         = time.time()
+        (params, uid) = self._get_status_params(request)
+
+        try:
+            if params.get('wait'):
+                self._wait_changes(uid, min(float(params['wait']), self.max_wait))
+
+            return self._fetch_result(uid)
+        finally:
+            REQUEST_LATENCY.observe(time.time() - start, route = 'status')
+
+    def job_batch_status(self, request):
+        start    = time.time()
+        jobs     = self._get_batch_jobs(request)
+        r        = [self._batch_error(None, 415, "invalid arguments for command")] * len(jobs)
+        complete = []
+
+        self._batch_foreign(jobs, r)
+
+        try:
+            for idxs in self._batch_by_shard(jobs).values():
+                try:
+                    shard = self._acquire_read(jobs[idxs[0]][0])
+                except HttpReqErrJson as e:
+                    for i in idxs:
+                        r[i] = self._batch_error(jobs[i][0], e.code, "%s" % e)
+                    continue
+
+                try:
+                    for i in idxs:
+                        try:
+                            r[i] = self._shard_result(shard, jobs[i][0], complete)
+                        except HttpReqErrJson as e:
+                            r[i] = self._batch_error(jobs[i][0], e.code, "%s" % e)
+                        except Exception as e:
+                            LOG.exception(e)
+                            r[i] = self._batch_error(jobs[i][0], 503, repr(e))
+                finally:
+                    shard.release()
+
+            self._remove_complete(complete)
+        finally:
+            REQUEST_LATENCY.observe(time.time() - start, route = 'batch_status')
+
+        return {'code': 200,
+                'jobs': r}
+
+    def _stream_results(self, uid, charset):
+        """
+        The status line is sent once the headers are, an error
+        ends the stream with a last line like a batch job error.
+        """
+        r = None
+
+        while r is None or r['status'] != STATUS_COMPLETE:
+            try:
+                if r is not None:
+                    self._wait_changes(uid, self.max_wait)
+
+                r = self._fetch_result(uid)
+            except HttpReqErrJson as e:
+                yield HttpReqHandler.response_dumps(self._batch_error(uid, e.code, "%s" % e), charset) + "\n"
+                return
+
+            yield HttpReqHandler.response_dumps(r, charset) + "\n"
+
+    def job_stream(self, request):
+        (params, uid) = self._get_status_params(request) # pylint: disable=unused-variable
+
+        shard = self._acquire_read(uid)
+        try:
+            self._get_obj(shard, uid)
+        finally:
+            shard.release()
+
+        return AutonHttpResponseStream(self._stream_results(uid, self.get_charset()),
+                                       headers = {'Content-type': STREAM_CONTENT_TYPE})
 
 
 if __name__ != "__main__":
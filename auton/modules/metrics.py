@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2018-2022 fjord-technologies
+# SPDX-License-Identifier: GPL-3.0-or-later
+"""auton.modules.metrics"""
+
+import logging
+
+from dwho.classes.modules import DWhoModuleBase, MODULES
+from httpdis.httpdis import HttpResponse
+
+from auton.classes.metrics import CONTENT_TYPE, METRICS
+
+LOG = logging.getLogger('auton.modules.metrics')
+
+
+class MetricsModule(DWhoModuleBase):
+    MODULE_NAME = 'metrics'
+
+    def metrics(self, request): # pylint: disable=unused-argument
+        return HttpResponse(200,
+                            METRICS.render(),
+                            {'Content-type': CONTENT_TYPE})
+
+
+if __name__ != "__main__":
+    def _start():
+        MODULES.register(MetricsModule())
+    _start()
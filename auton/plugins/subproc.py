@@ -8,8 +8,6 @@ import logging
 import os
 import shutil
 import subprocess
-import threading
-import time
 import tempfile
 
 import six
@@ -18,13 +16,14 @@ try:
 except ImportError:
     from six import StringIO
 
-from dotenv.main import dotenv_values
-
 from sonicprobe import helpers
+from auton.classes.envfiles import ENVFILES
 from auton.classes.exceptions import (AutonConfigurationError,
                                       AutonTargetFailed,
                                       AutonTargetTimeout)
-from auton.classes.plugins import AutonPlugBase, PLUGINS
+from auton.classes.launcher import LAUNCHER, RLIMITS
+from auton.classes.plugins import AutonPlugBase, PHASE_PREPARED, PHASE_SPAWNED, PLUGINS
+from auton.classes.supervisor import DEFAULT_MAX_LINE, SUPERVISOR
 
 LOG = logging.getLogger('auton.plugins.subproc')
 
@@ -32,60 +31,142 @@ LOG = logging.getLogger('auton.plugins.subproc')
 class AutonSubProcPlugin(AutonPlugBase):
     PLUGIN_NAME = 'subproc'
 
-    def __init__(self, name):
-        AutonPlugBase.__init__(self, name)
-        self._dirs_to_delete = []
-        self._killed = False
+    def _compile_args(self, cargs):
+        r = []
 
-    def at_stop(self):
-        self._killed = True
+        if not cargs:
+            return r
 
-    def _proc_stdout(self, obj, proc, texit):
-        stopped = False
-        while not self._killed and not stopped:
-            try:
-                for x in iter(proc.stdout.readline, b''):
-                    if x != '':
-                        obj.add_result(x)
-            except Exception as e:
-                obj.add_error(repr(e))
-                LOG.exception(e)
-                break
-            finally:
-                if texit.is_set():
-                    stopped = True
-
-    def _proc_stderr(self, obj, proc, texit):
-        stopped = False
-        while not self._killed and not stopped:
-            try:
-                for x in iter(proc.stderr.readline, b''):
-                    if x != '':
-                        obj.add_error(x)
-            except Exception as e:
-                obj.add_error(repr(e))
-                LOG.exception(e)
-                break
-            finally:
-                if texit.is_set():
-                    stopped = True
+        if not isinstance(cargs, list):
+            raise AutonConfigurationError("invalid configuration args for target: %r" % self.target.name)
 
-    def _mk_args(self, args, cargs, pargs, ovars):
-        r = copy.copy(args)
+        for x in cargs:
+            if not isinstance(x, six.string_types):
+                raise AutonConfigurationError("invalid configuration argument %r for target: %r"
+                                              % (x, self.target.name))
 
-        if cargs:
-            if not isinstance(cargs, list):
-                LOG.error("invalid configuration args for target: %r", self.target.name)
-                return None
+            r.append((x, '{' in x and '}' in x))
 
-            for x in cargs:
-                if not isinstance(x, six.string_types):
-                    LOG.error("invalid configuration argument %r for target: %r", x, self.target.name)
-                    return None
+        return r
 
-                if '{' in x and '}' in x:
-                    x = x.format(**ovars)
-                r.append(x)
+    def _compile_argfiles(self, cargfiles):
+        r = []
+
+        if not cargfiles:
+            return r
+
+        if not isinstance(cargfiles, list):
+            raise AutonConfigurationError("invalid configuration argfiles for target: %r" % self.target.name)
+
+        for cargfile in cargfiles:
+            if not isinstance(cargfile, dict):
+                raise AutonConfigurationError("invalid type in configuration argfiles for target: %r"
+                                              % self.target.name)
+
+            if not cargfile.get('arg'):
+                raise AutonConfigurationError("missing arg in configuration argfiles for target: %r"
+                                              % self.target.name)
+
+            if not cargfile.get('filepath'):
+                raise AutonConfigurationError("missing filepath in configuration argfiles for target: %r"
+                                              % self.target.name)
+
+            if cargfile['arg'].endswith('@'):
+                if len(cargfile['arg']) == 1:
+                    raise AutonConfigurationError("invalid arg %r in configuration argfiles for target: %r"
+                                                  % (cargfile['arg'], self.target.name))
+                r.append((cargfile['filepath'], [cargfile['arg'][:-1], "@%s" % cargfile['filepath']]))
+            else:
+                r.append((cargfile['filepath'], [cargfile['arg'], cargfile['filepath']]))
+
+        return r
+
+    def _compile_env(self, cenv):
+        if not cenv:
+            return []
+
+        if isinstance(cenv, dict):
+            return [{key: val} for key, val in six.iteritems(cenv)]
+
+        if not isinstance(cenv, list):
+            LOG.warning("invalid configuration env for target: %r", self.target.name)
+            return []
+
+        return list(cenv)
+
+    def _compile_rlimits(self, crlimits):
+        r = {}
+
+        if not crlimits:
+            return r
+
+        if not isinstance(crlimits, dict):
+            raise AutonConfigurationError("invalid configuration rlimits for target: %r" % self.target.name)
+
+        for key, val in six.iteritems(crlimits):
+            if key != 'output' and key not in RLIMITS:
+                raise AutonConfigurationError("unsupported rlimit %r for target: %r"
+                                              % (key, self.target.name))
+
+            if isinstance(val, bool) or not isinstance(val, six.integer_types) or val <= 0:
+                raise AutonConfigurationError("invalid rlimit %s %r for target: %r"
+                                              % (key, val, self.target.name))
+
+            r[key] = val
+
+        return r
+
+    def _compile_timeout(self, ctimeout):
+        if ctimeout is None:
+            return None
+
+        if isinstance(ctimeout, bool) \
+           or not isinstance(ctimeout, six.integer_types + (float,)) \
+           or ctimeout <= 0:
+            raise AutonConfigurationError("invalid configuration timeout %r for target: %r"
+                                          % (ctimeout, self.target.name))
+
+        return ctimeout
+
+    def _compile(self, cfg):
+        """
+        Build once the parts of the command line and of the environment
+        which do not depend on the job.
+        """
+        rlimits = self._compile_rlimits(cfg.get('rlimits'))
+        spec    = {'prog':       cfg['prog'],
+                   'timeout':    self._compile_timeout(cfg.get('timeout')),
+                   'workdir':    cfg.get('workdir'),
+                   'args':       self._compile_args(cfg.get('args')),
+                   'argfiles':   self._compile_argfiles(cfg.get('argfiles')),
+                   'envfiles':   [],
+                   'env':        self._compile_env(cfg.get('env')),
+                   'path':       None,
+                   'max_output': rlimits.pop('output', None),
+                   'rlimits':    rlimits,
+                   'become':     self._get_become(cfg.get('become')),
+                   'disallow':   dict((x, bool(cfg.get("disallow-%s" % x)))
+                                      for x in ('args', 'argfiles', 'envfiles', 'env'))}
+
+        if cfg.get('envfiles'):
+            if not isinstance(cfg['envfiles'], list):
+                LOG.warning("invalid configuration envfiles for target: %r", self.target.name)
+            else:
+                spec['envfiles'] = list(cfg['envfiles'])
+
+        if cfg.get('search_paths'):
+            if not isinstance(cfg['search_paths'], list):
+                LOG.warning("invalid search_paths for target: %r", self.target.name)
+            else:
+                spec['path'] = os.path.pathsep.join(cfg['search_paths'])
+
+        return spec
+
+    def _mk_args(self, args, cargs, pargs, ovars):
+        r = copy.copy(args)
+
+        for x, tpl in cargs:
+            r.append(x.format(**ovars) if tpl else x)
 
         if pargs:
             if not isinstance(pargs, list):
@@ -103,40 +184,14 @@ class AutonSubProcPlugin(AutonPlugBase):
 
         return r
 
-    def _mk_argfiles(self, args, cargfiles, pargfiles):
+    def _mk_argfiles(self, obj, args, cargfiles, pargfiles):
         r = copy.copy(args)
 
-        if cargfiles:
-            if not isinstance(cargfiles, list):
-                LOG.error("invalid configuration argfiles for target: %r", self.target.name)
+        for filepath, xargs in cargfiles:
+            if not os.path.isfile(filepath):
+                LOG.error("invalid filepath in configuration argfiles for target: %r", self.target.name)
                 return None
-
-            for cargfile in cargfiles:
-                if not isinstance(cargfile, dict):
-                    LOG.error("invalid type in configuration argfiles for target: %r", self.target.name)
-                    return None
-
-                if not cargfile.get('arg'):
-                    LOG.error("missing arg in configuration argfiles for target: %r", self.target.name)
-                    return None
-
-                if not cargfile.get('filepath'):
-                    LOG.error("missing filepath in configuration argfiles for target: %r", self.target.name)
-                    return None
-
-                if not os.path.isfile(cargfile['filepath']):
-                    LOG.error("invalid filepath in configuration argfiles for target: %r", self.target.name)
-                    return None
-
-                if cargfile['arg'].endswith('@'):
-                    if len(cargfile['arg']) == 1:
-                        LOG.error("invalid arg %r in configuration argfiles for target: %r",
-                                  cargfile['arg'],
-                                  self.target.name)
-                        return None
-                    r.extend([cargfile['arg'][:-1], "@%s" % cargfile['filepath']])
-                else:
-                    r.extend([cargfile['arg'], cargfile['filepath']])
+            r.extend(xargs)
 
         if pargfiles:
             if not isinstance(pargfiles, list):
@@ -144,17 +199,35 @@ class AutonSubProcPlugin(AutonPlugBase):
                 return None
 
             tmpdir = tempfile.mkdtemp(prefix = '.auton.')
-            self._dirs_to_delete.append(tmpdir)
+            obj.add_tmpdir(tmpdir)
 
             for pargfile in pargfiles:
-                if pargfile['filename'] == '':
-                    with tempfile.NamedTemporaryFile(dir = tmpdir, delete = False) as tmpfile:
-                        tmpfile.close()
-                    filepath = tmpfile.name
+                if pargfile.get('upload') is not None:
+                    filepath = obj.get_upload(pargfile['upload'])
+                    if not filepath:
+                        LOG.error("unknown upload %r in payload argfiles for target: %r",
+                                  pargfile['upload'],
+                                  self.target.name)
+                        return None
+                elif pargfile.get('digest') is not None:
+                    filepath = obj.get_blob(pargfile['digest'], pargfile.get('filename'))
+                    if not filepath:
+                        LOG.error("unknown blob %r in payload argfiles for target: %r",
+                                  pargfile['digest'],
+                                  self.target.name)
+                        return None
+                elif pargfile.get('content') is None:
+                    LOG.error("missing content in payload argfiles for target: %r", self.target.name)
+                    return None
                 else:
-                    filepath = os.path.join(tmpdir, pargfile['filename'])
-                helpers.base64_decode_file(StringIO(pargfile['content']),
-                                           filepath)
+                    if not pargfile.get('filename'):
+                        with tempfile.NamedTemporaryFile(dir = tmpdir, delete = False) as tmpfile:
+                            tmpfile.close()
+                        filepath = tmpfile.name
+                    else:
+                        filepath = os.path.join(tmpdir, pargfile['filename'])
+                    helpers.base64_decode_file(StringIO(pargfile['content']),
+                                               filepath)
                 if pargfile['arg'].endswith('@'):
                     if len(pargfile['arg']) == 1:
                         LOG.error("invalid arg %r in payload argfiles for target: %r",
@@ -167,7 +240,7 @@ class AutonSubProcPlugin(AutonPlugBase):
 
         return r
 
-    def _load_envfile(self, envfiles):
+    def _load_envfile(self, envfiles, cache = True):
         r = {}
 
         if not isinstance(envfiles, list):
@@ -176,7 +249,7 @@ class AutonSubProcPlugin(AutonPlugBase):
 
         for envfile in envfiles:
             try:
-                r.update(dotenv_values(envfile))
+                r.update(ENVFILES.load(envfile, cache))
             except Exception as e:
                 LOG.warning("unable to load envfile: %r, error: %r", envfile, e)
 
@@ -191,26 +264,14 @@ class AutonSubProcPlugin(AutonPlugBase):
                 LOG.warning("invalid payload envfiles for target: %r", self.target.name)
                 return r
 
-            for key, val in six.iteritems(self._load_envfile(penvfiles)):
+            for key, val in six.iteritems(self._load_envfile(penvfiles, False)):
                 env.append({key: val})
 
         if cenvfiles:
-            if not isinstance(cenvfiles, list):
-                LOG.warning("invalid configuration envfiles for target: %r", self.target.name)
-                return r
-
             for key, val in six.iteritems(self._load_envfile(cenvfiles)):
                 env.append({key: val})
 
-        if cenv:
-            if isinstance(cenv, dict):
-                for key, val in six.iteritems(cenv):
-                    env.append({key: val})
-            elif not isinstance(cenv, list):
-                LOG.warning("invalid configuration env for target: %r", self.target.name)
-                return r
-            else:
-                env.extend(cenv)
+        env.extend(cenv)
 
         if penv:
             if not isinstance(penv, dict):
@@ -223,98 +284,102 @@ class AutonSubProcPlugin(AutonPlugBase):
 
         return r
 
+    # pylint: disable=attribute-defined-outside-init
     def safe_init(self):
         AutonPlugBase.safe_init(self)
 
-        if not self.target.config.get('prog'):
+        cfg = self.target.config
+
+        if not cfg.get('prog'):
             raise AutonConfigurationError("missing prog keyword for target: %r" % self.target.name)
 
+        self.spec = self._compile(cfg)
+
+        if self.spec['rlimits']:
+            LAUNCHER.use_rlimits()
+
+        max_line  = self.sync.output.get('max_line')
+        if max_line is None:
+            max_line = DEFAULT_MAX_LINE
+        elif not isinstance(max_line, int) or max_line < 4:
+            raise AutonConfigurationError("invalid output max_line %r for endpoint: %r"
+                                          % (max_line, self.name))
+        self.spec['max_line'] = max_line
+
     def do_run(self, obj):
-        cfg       = self.target.config
+        spec      = self.spec
         payload   = obj.get_request().payload_params()
         ovars     = obj.get_vars()
         pargs     = None
         pargfiles = None
-        args      = [cfg['prog']]
+        args      = [spec['prog']]
         penvfiles = []
         penv      = {}
 
         if isinstance(payload, dict) and payload.get('args'):
-            if cfg.get('disallow-args'):
+            if spec['disallow']['args']:
                 LOG.warning("args from payload isn't allowed for target: %r", self.target.name)
             else:
                 pargs = copy.copy(payload['args'])
 
-        args    = self._mk_args(args, cfg.get('args'), pargs, ovars)
+        args    = self._mk_args(args, spec['args'], pargs, ovars)
         if not args:
             raise AutonTargetFailed("invalid args for command on target: %r" % self.target.name)
 
         if isinstance(payload, dict) and payload.get('argfiles'):
-            if cfg.get('disallow-argfiles'):
+            if spec['disallow']['argfiles']:
                 LOG.warning("argfiles from payload isn't allowed for target: %r", self.target.name)
             else:
                 pargfiles = copy.copy(payload['argfiles'])
 
-        args    = self._mk_argfiles(args, cfg.get('argfiles'), pargfiles)
+        args    = self._mk_argfiles(obj, args, spec['argfiles'], pargfiles)
         if not args:
             raise AutonTargetFailed("invalid argfiles for command on target: %r" % self.target.name)
 
         if isinstance(payload, dict) and payload.get('envfiles'):
-            if cfg.get('disallow-envfiles'):
+            if spec['disallow']['envfiles']:
                 LOG.warning("envfile from payload isn't allowed for target: %r", self.target.name)
             else:
                 penvfiles = payload['envfiles']
 
         if isinstance(payload, dict) and payload.get('env'):
-            if cfg.get('disallow-env'):
+            if spec['disallow']['env']:
                 LOG.warning("env from payload isn't allowed for target: %r", self.target.name)
             else:
                 penv.update(copy.copy(payload['env']))
 
-        env     = self._mk_env(cfg.get('envfiles'), penvfiles, cfg.get('env'), penv, ovars)
+        env     = self._mk_env(spec['envfiles'], penvfiles, spec['env'], penv, ovars)
         if not env:
             env = {}
 
-        if cfg.get('search_paths'):
-            if not isinstance(cfg['search_paths'], list):
-                LOG.warning("invalid search_paths for target: %r", self.target.name)
-            else:
-                env['PATH'] = os.path.pathsep.join(cfg['search_paths'])
+        if spec['path']:
+            env['PATH'] = spec['path']
 
         env     = self._set_default_env(env, ovars)
 
-        bargs   = self._get_become(cfg.get('become'))
+        bargs   = spec['become']
 
-        texit   = threading.Event()
         proc    = None
 
         LOG.debug("cmd line: %r", bargs + args)
 
-        try:
-            proc  = subprocess.Popen(bargs + args,
-                                     stdout = subprocess.PIPE,
-                                     stderr = subprocess.PIPE,
-                                     env    = env,
-                                     cwd    = cfg.get('workdir'))
+        obj.mark(PHASE_PREPARED)
 
-            to    = threading.Thread(target=self._proc_stdout,
-                                     args=(obj, proc, texit))
-            to.daemon = True
-            to.start()
+        try:
+            proc  = LAUNCHER.spawn(bargs + args, env, spec['workdir'], spec['rlimits'])
+            obj.mark(PHASE_SPAWNED)
 
-            te    = threading.Thread(target=self._proc_stderr,
-                                     args=(obj, proc, texit))
-            te.daemon = True
-            te.start()
+            watch = SUPERVISOR.watch(proc, obj, spec['timeout'], spec['max_line'], spec['max_output'])
+            watch.wait()
 
-            start = time.time()
+            obj.set_rusage(getattr(proc, 'rusage', None))
 
-            while True:
-                if proc.poll() is not None:
-                    break
+            if watch.timed_out:
+                raise AutonTargetTimeout("timeout on target: %r" % self.target.name)
 
-                if start + cfg['timeout'] <= time.time():
-                    raise AutonTargetTimeout("timeout on target: %r" % self.target.name)
+            if watch.overflowed:
+                raise AutonTargetFailed("output limit of %d bytes exceeded on target: %r"
+                                        % (spec['max_output'], self.target.name))
 
             if proc.returncode:
                 raise subprocess.CalledProcessError(proc.returncode, args[0])
@@ -327,17 +392,14 @@ class AutonSubProcPlugin(AutonPlugBase):
             raise AutonTargetFailed("error on target: %r. exception: %r"
                                     % (self.target.name, e))
         finally:
-            texit.set()
+            try:
+                if proc and proc.returncode is None:
+                    proc.terminate()
+            except OSError:
+                pass
 
-        try:
-            if proc and proc.returncode is None:
-                proc.terminate()
-        except OSError:
-            pass
-
-    def do_terminate(self):
-        while self._dirs_to_delete:
-            tdir = self._dirs_to_delete.pop()
+    def do_terminate(self, obj):
+        for tdir in obj.pop_tmpdirs():
             if os.path.isdir(tdir):
                 shutil.rmtree(tdir, True)
 
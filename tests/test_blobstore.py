@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2018-2022 fjord-technologies
+# SPDX-License-Identifier: GPL-3.0-or-later
+"""tests.test_blobstore"""
+
+import hashlib
+import os
+import shutil
+import stat
+import tempfile
+import unittest
+
+from io import BytesIO
+
+from auton.classes.blobstore import AutonBlobMismatch, AutonBlobStore
+
+
+def _digest(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+class AutonBlobStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path   = os.path.join(self.tmpdir, 'blobs')
+        self.blobs  = AutonBlobStore(self.path, max_size = 10)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir, True)
+
+    def put(self, data):
+        digest = _digest(data)
+        self.assertEqual(self.blobs.put(digest, BytesIO(data)), len(data))
+
+        return digest
+
+    def test_put(self):
+        digest = self.put(b'abcd')
+
+        self.assertEqual(self.blobs.missing([digest, _digest(b'x')]), [_digest(b'x')])
+        self.assertEqual(self.blobs.size, 4)
+        self.assertFalse(os.stat(os.path.join(self.path, digest)).st_mode
+                         & (stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH))
+
+    def test_mismatch(self):
+        self.assertRaises(AutonBlobMismatch, self.blobs.put, _digest(b'x'), BytesIO(b'y'))
+
+        self.assertEqual(self.blobs.missing([_digest(b'x')]), [_digest(b'x')])
+        self.assertEqual(os.listdir(self.path), [])
+        self.assertEqual(self.blobs.size, 0)
+
+    def test_clone(self):
+        digest = self.put(b'abcd')
+        dest   = os.path.join(self.tmpdir, 'dest')
+
+        self.assertTrue(self.blobs.clone(digest, dest))
+        with open(dest, 'rb') as f:
+            self.assertEqual(f.read(), b'abcd')
+
+        self.assertFalse(self.blobs.clone(_digest(b'x'), dest))
+
+    def test_eviction(self):
+        first  = self.put(b'0123')
+        second = self.put(b'4567')
+
+        # used, no longer the least recently used one
+        self.blobs.missing([first])
+        third  = self.put(b'89ab')
+
+        self.assertEqual(self.blobs.missing([first, second, third]), [second])
+        self.assertEqual(self.blobs.size, 8)
+        self.assertFalse(os.path.exists(os.path.join(self.path, second)))
+
+    def test_larger_than_max_size(self):
+        # the last blob is kept whatever its size
+        digest = self.put(b'x' * 20)
+
+        self.assertEqual(self.blobs.missing([digest]), [])
+
+    def test_clone_removed(self):
+        digest = self.put(b'abcd')
+        os.unlink(os.path.join(self.path, digest))
+
+        self.assertFalse(self.blobs.clone(digest, os.path.join(self.tmpdir, 'dest')))
+        self.assertEqual(self.blobs.missing([digest]), [digest])
+        self.assertEqual(self.blobs.size, 0)
+
+    def test_load(self):
+        digest = self.put(b'abcd')
+        with open(os.path.join(self.path, '.auton.partial'), 'wb') as f:
+            f.write(b'ab')
+
+        blobs  = AutonBlobStore(self.path, max_size = 10)
+
+        self.assertEqual(blobs.missing([digest]), [])
+        self.assertEqual(blobs.size, 4)
+        self.assertEqual(os.listdir(self.path), [digest])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2018-2022 fjord-technologies
+# SPDX-License-Identifier: GPL-3.0-or-later
+"""tests.test_buffer"""
+
+import unittest
+
+from auton.classes.buffer import AutonOutputBuffer
+
+
+class AutonOutputBufferTest(unittest.TestCase):
+    def setUp(self):
+        self.buf = AutonOutputBuffer(max_memory = 8)
+
+    def tearDown(self):
+        self.buf.close()
+
+    def test_items(self):
+        self.buf.append(b'ab').append(u'cé').append(b'')
+        self.assertEqual(len(self.buf), 3)
+        self.assertEqual(self.buf.tolist(), [b'ab', u'cé'.encode('utf-8'), b''])
+
+    def test_get_range(self):
+        for x in (b'a', b'bc', b'def', b'g'):
+            self.buf.append(x)
+
+        self.assertEqual(self.buf.get(1, 3), [b'bc', b'def'])
+        self.assertEqual(self.buf.get(2), [b'def', b'g'])
+        self.assertEqual(self.buf.get(3, 10), [b'g'])
+        self.assertEqual(self.buf.get(4), [])
+
+    def test_spill(self):
+        items = [b'0123', b'4567', b'89', b'abcdefghij', b'k']
+        for x in items:
+            self.buf.append(x)
+
+        self.assertEqual(self.buf.size, 21)
+        self.assertLessEqual(self.buf.memory_size, 8)
+        self.assertEqual(self.buf.tolist(), items)
+        # a range across the file and the memory
+        self.assertEqual(self.buf.get(3, 5), items[3:5])
+
+    def test_no_spill(self):
+        buf = AutonOutputBuffer(max_memory = 0)
+        buf.append(b'x' * 100)
+        self.assertEqual(buf.memory_size, 100)
+        buf.close()
+
+    def test_close(self):
+        self.buf.append(b'0123456789')
+        self.buf.close()
+        self.assertEqual(len(self.buf), 0)
+        self.assertEqual(self.buf.size, 0)
+        self.assertEqual(self.buf.tolist(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2018-2022 fjord-technologies
+# SPDX-License-Identifier: GPL-3.0-or-later
+"""tests.test_cache"""
+
+import hashlib
+import os
+import shutil
+import tempfile
+import unittest
+
+from auton.classes.cache import submission_key
+
+
+class SubmissionKeyTest(unittest.TestCase):
+    def setUp(self):
+        self.payload = {'args':     ['-v', 'https://example.com'],
+                        'env':      {'A': '1', 'B': '2'},
+                        'envfiles': ['/etc/auton/env']}
+
+    def test_stable(self):
+        payload = {'envfiles': ['/etc/auton/env'],
+                   'env':      {'B': '2', 'A': '1'},
+                   'args':     ['-v', 'https://example.com']}
+
+        self.assertEqual(submission_key('run', self.payload),
+                         submission_key('run', payload))
+
+    def test_defaults(self):
+        self.assertEqual(submission_key('run', {}),
+                         submission_key('run', {'args': [], 'env': {}, 'envfiles': [], 'argfiles': []}))
+
+    def test_differs(self):
+        key = submission_key('run', self.payload)
+
+        self.assertNotEqual(key, submission_key('status', self.payload))
+        self.assertNotEqual(key, submission_key('run', self.payload, user = 'foo'))
+        self.assertNotEqual(key, submission_key('run', dict(self.payload, args = ['https://example.com', '-v'])))
+        self.assertNotEqual(key, submission_key('run', dict(self.payload, env = {'A': '1'})))
+
+    def test_argfiles_by_content(self):
+        tmpdir = tempfile.mkdtemp()
+
+        try:
+            path = os.path.join(tmpdir, 'cacert.pem')
+            with open(path, 'wb') as f:
+                f.write(b'content')
+
+            digest = hashlib.sha256(b'content').hexdigest()
+            keys   = [submission_key('run',
+                                     dict(self.payload,
+                                          argfiles = [dict({'arg': '--cacert', 'filename': 'cacert.pem'}, **x)]),
+                                     uploads = {'0': path})
+                      for x in ({'digest': digest}, {'upload': '0'})]
+
+            self.assertEqual(keys[0], keys[1])
+            self.assertNotEqual(keys[0],
+                                submission_key('run',
+                                               dict(self.payload,
+                                                    argfiles = [{'arg':      '--cacert',
+                                                                 'filename': 'ca.pem',
+                                                                 'digest':   digest}])))
+        finally:
+            shutil.rmtree(tmpdir, True)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,395 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2018-2022 fjord-technologies
+# SPDX-License-Identifier: GPL-3.0-or-later
+"""tests.test_client"""
+
+import json
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import unittest
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from six.moves import BaseHTTPServer, socketserver
+from six.moves.urllib.parse import urlsplit
+
+BIN_AUTON = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'bin', 'auton')
+
+
+def _load_client():
+    # bin/auton is a script, not a module
+    module = type(os)('auton_client')
+    module.__file__ = BIN_AUTON
+
+    with open(BIN_AUTON, 'r') as f:
+        exec(compile(f.read(), BIN_AUTON, 'exec'), module.__dict__) # pylint: disable=exec-used
+
+    return module
+
+CLIENT = _load_client()
+
+
+class StubHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args): # pylint: disable=arguments-differ
+        return
+
+    def _handle(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        req  = {'method':  self.command,
+                'path':    urlsplit(self.path).path,
+                'query':   urlsplit(self.path).query,
+                'headers': dict(self.headers.items()),
+                'body':    body,
+                'client':  self.client_address}
+        self.server.requests.append(req)
+
+        (code, headers, data) = self.server.route(req)
+        if not isinstance(data, bytes):
+            data = json.dumps(data).encode('utf-8')
+
+        self.send_response(code)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    do_GET  = _handle
+    do_POST = _handle
+    do_PUT  = _handle
+
+
+class StubServer(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """
+    autond stand-in answering with route(request) -> (code, headers, data).
+    """
+    daemon_threads = True
+
+    def __init__(self, route):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0), StubHandler)
+        self.route    = route
+        self.requests = []
+        self.uri      = "http://127.0.0.1:%d" % self.server_address[1]
+        self.thread   = threading.Thread(target = self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def paths(self, method = None):
+        return [x['path'] for x in self.requests if method is None or x['method'] == method]
+
+
+def _result(status, stream = None, return_code = None):
+    return {'code':        200,
+            'uid':         'curl:job',
+            'status':      status,
+            'return_code': return_code,
+            'stream':      stream or []}
+
+
+def _dead_uri():
+    # nothing listens on a port just released
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+
+    return "http://127.0.0.1:%d" % port
+
+
+def _health_route(load):
+    def route(req):
+        if req['path'] == '/health/curl':
+            return (200, None, {'load': load})
+        return (200, None, _result('new'))
+
+    return route
+
+
+class ClientTestCase(unittest.TestCase):
+    def setUp(self):
+        self.servers = []
+
+    def tearDown(self):
+        for server in self.servers:
+            server.stop()
+
+    def server(self, route):
+        server = StubServer(route)
+        self.servers.append(server)
+
+        return server
+
+    @staticmethod
+    def client(uris, *args):
+        argv = ['auton', '--endpoint', 'curl', '--uid', 'job', '--logfile', os.devnull]
+        for uri in uris:
+            argv += ['--uri', uri]
+
+        with mock.patch('sys.argv', argv + list(args)):
+            return CLIENT.AutonClient(CLIENT.argv_parse_check())
+
+
+class ClientPollTest(ClientTestCase):
+    def test_backoff(self):
+        statuses = [_result('processing')] * 4 \
+                   + [_result('processing', ['out\n'])] \
+                   + [_result('processing')] \
+                   + [_result('complete', return_code = 0)]
+
+        def route(req):
+            if req['path'] == '/run/curl/job':
+                return (200, None, _result('new'))
+            return (200, None, statuses.pop(0))
+
+        server = self.server(route)
+        client = self.client([server.uri], '--delay', '0.5', '--max-delay', '3')
+
+        with mock.patch('time.sleep') as sleep, mock.patch('sys.stdout'):
+            self.assertEqual(client.do_autorun(), 0)
+
+        client.close()
+
+        # doubled while quiet up to max_delay, reset on new output
+        self.assertEqual([x[0][0] for x in sleep.call_args_list],
+                         [0.5, 1.0, 2.0, 3.0, 3.0, 0.5, 1.0])
+
+    def test_long_poll(self):
+        statuses = [_result('processing'), _result('complete', return_code = 0)]
+
+        def route(req):
+            if req['path'] == '/run/curl/job':
+                return (200, None, _result('new'))
+            return (200, None, statuses.pop(0))
+
+        server = self.server(route)
+        client = self.client([server.uri], '--wait', '20')
+
+        with mock.patch('time.sleep') as sleep:
+            self.assertEqual(client.do_autorun(), 0)
+
+        client.close()
+
+        self.assertFalse(sleep.called)
+        self.assertEqual([x['query'] for x in server.requests if x['method'] == 'GET'],
+                         ['wait=20.0', 'wait=20.0'])
+
+    def test_session_reused(self):
+        def route(req):
+            if req['path'] == '/run/curl/job':
+                return (200, None, _result('processing'))
+            return (200, None, _result('complete', return_code = 0))
+
+        server = self.server(route)
+        client = self.client([server.uri])
+
+        with mock.patch('time.sleep'):
+            client.do_autorun()
+
+        client.close()
+
+        self.assertEqual(len(server.requests), 2)
+        self.assertEqual(len(set(x['client'] for x in server.requests)), 1)
+
+
+class ClientRetryTest(ClientTestCase):
+    def test_retry_after(self):
+        codes = [429, 429, 200]
+
+        def route(req):
+            code = codes.pop(0)
+            if code == 429:
+                return (429, {'Retry-After': '2'}, {'code': 429, 'message': 'queue full'})
+            return (200, None, _result('new'))
+
+        server = self.server(route)
+        client = self.client([server.uri])
+
+        with mock.patch('time.sleep') as sleep:
+            self.assertEqual(client.do_run()['status'], 'new')
+
+        client.close()
+
+        self.assertEqual([x[0][0] for x in sleep.call_args_list], [2.0, 2.0])
+        self.assertEqual(server.paths('POST'), ['/run/curl/job'] * 3)
+
+    def test_queues_full(self):
+        def route(req): # pylint: disable=unused-argument
+            return (429, {'Retry-After': '1'}, {'code': 429, 'message': 'queue full'})
+
+        server = self.server(route)
+        client = self.client([server.uri], '--max-retries', '3')
+
+        with mock.patch('time.sleep'):
+            self.assertRaises(LookupError, client.do_run)
+
+        client.close()
+
+        self.assertEqual(len(server.requests), 3)
+
+
+class ClientBalanceTest(ClientTestCase):
+    def test_least_loaded(self):
+        busy   = self.server(_health_route(5))
+        idle   = self.server(_health_route(0.5))
+        client = self.client([busy.uri, idle.uri])
+
+        self.assertEqual(client.do_run()['status'], 'new')
+        client.close()
+
+        self.assertEqual(client.uri, idle.uri)
+        self.assertEqual(busy.paths('POST'), [])
+        self.assertEqual(idle.paths('POST'), ['/run/curl/job'])
+
+    def test_unreachable_last(self):
+        dead   = _dead_uri()
+        server = self.server(_health_route(10))
+        client = self.client([dead, server.uri])
+
+        self.assertEqual(client._rank_uris('curl'), [server.uri, dead]) # pylint: disable=protected-access
+        client.close()
+
+    def test_failover(self):
+        dead   = _dead_uri()
+        server = self.server(_health_route(0))
+        client = self.client([dead, server.uri])
+
+        # unreachable once ranked
+        with mock.patch.object(client, '_rank_uris', return_value = [dead, server.uri]):
+            self.assertEqual(client.do_run()['status'], 'new')
+
+        client.close()
+
+        self.assertEqual(client.uri, server.uri)
+
+    def test_all_unreachable(self):
+        client = self.client([_dead_uri(), _dead_uri()], '--balance', 'hash')
+
+        self.assertRaises(CLIENT.exceptions.ConnectionError, client.do_run)
+        client.close()
+
+    def test_hash(self):
+        uris   = ["http://autond%d:8666" % i for i in range(5)]
+        ranked = self.client(uris, '--balance', 'hash')._rank_uris('curl') # pylint: disable=protected-access
+
+        # whatever the order of the uris
+        self.assertEqual(self.client(list(reversed(uris)), '--balance', 'hash')._rank_uris('curl'), # pylint: disable=protected-access
+                         ranked)
+
+        # only the jobs of a removed autond move
+        uris.remove(ranked[0])
+        self.assertEqual(self.client(uris, '--balance', 'hash')._rank_uris('curl'), # pylint: disable=protected-access
+                         ranked[1:])
+
+
+class ClientClusterTest(ClientTestCase):
+    def setUp(self):
+        ClientTestCase.setUp(self)
+        self.tmpdir  = tempfile.mkdtemp()
+        self.argfile = os.path.join(self.tmpdir, 'data.txt')
+
+        with open(self.argfile, 'wb') as f:
+            f.write(b'data')
+
+    def tearDown(self):
+        ClientTestCase.tearDown(self)
+        shutil.rmtree(self.tmpdir, True)
+
+    def cluster(self, owner_route):
+        owner = self.server(owner_route)
+
+        def route(req):
+            # every request of the job is redirected by a non-owner node
+            if req['path'] in ('/blobs', '/run/curl/job', '/upload/curl/job') and 'id=job' in req['query'] + req['path']:
+                return (307, {'Location': owner.uri + req['path'] + (req['query'] and '?' + req['query'])}, {'code': 307})
+            return (404, None, {'code': 404})
+
+        return (self.server(route), owner)
+
+    def test_blobs(self):
+        def route(req):
+            if req['path'] == '/blobs':
+                return (200, None, {'code': 200, 'missing': json.loads(req['body'])['digests']})
+            if req['path'].startswith('/blob/'):
+                return (200, None, {'code': 200})
+            return (200, None, _result('new'))
+
+        (node, owner) = self.cluster(route)
+        client        = self.client([node.uri], '-A', "--data=%s" % self.argfile)
+
+        self.assertEqual(client.do_run()['status'], 'new')
+        client.close()
+
+        # the redirection is followed once, the upload goes to the owner
+        self.assertEqual(node.paths(), ['/blobs'])
+        self.assertEqual(owner.paths(), ['/blobs', '/blob/%s' % client.uploads[0]['digest'], '/run/curl/job'])
+        self.assertEqual(client.uri, owner.uri)
+        self.assertEqual(client.owners, {node.uri: owner.uri})
+
+    def test_uploads(self):
+        def route(req):
+            if req['path'] == '/blobs':
+                return (404, None, {'code': 404})
+            if req['path'] == '/upload/curl/job':
+                return (200, None, {'code': 200, 'size': len(req['body'])})
+            return (200, None, _result('new'))
+
+        (node, owner) = self.cluster(route)
+        client        = self.client([node.uri],
+                                    '-A', "--data=%s" % self.argfile,
+                                    '-A', "--data2=%s" % self.argfile)
+
+        self.assertEqual(client.do_run()['status'], 'new')
+        client.close()
+
+        self.assertEqual(node.paths(), ['/blobs'])
+        self.assertEqual(owner.paths(), ['/blobs', '/upload/curl/job', '/upload/curl/job', '/run/curl/job'])
+        self.assertEqual([x['body'] for x in owner.requests if x['method'] == 'PUT'], [b'data', b'data'])
+
+
+class ClientCompressionTest(ClientTestCase):
+    def test_refused(self):
+        # older autond, whatever its Accept-Encoding
+        def route(req):
+            if 'Content-Encoding' in req['headers']:
+                return (415, None, {'code': 415, 'message': 'Unsupported Content-Type'})
+            return (200, None, _result('new'))
+
+        server = self.server(route)
+        client = self.client([server.uri], '-a', 'x' * 2048)
+
+        self.assertEqual(client.do_run()['status'], 'new')
+        client.close()
+
+        self.assertEqual([x['headers'].get('Content-Encoding') for x in server.requests], ['gzip', None])
+        self.assertEqual(json.loads(server.requests[1]['body'])['args'], ['x' * 2048])
+        self.assertFalse(client.compress)
+
+    def test_invalid_request(self):
+        def route(req): # pylint: disable=unused-argument
+            return (415, None, {'code': 415, 'message': 'invalid arguments for command'})
+
+        server = self.server(route)
+        client = self.client([server.uri], '-a', 'x' * 2048)
+
+        self.assertRaises(LookupError, client.do_run)
+        client.close()
+
+        self.assertEqual(len(server.requests), 2)
+        self.assertTrue(client.compress)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2018-2022 fjord-technologies
+# SPDX-License-Identifier: GPL-3.0-or-later
+"""tests.test_cluster"""
+
+import unittest
+
+from collections import Counter
+
+from httpdis.httpdis import HttpReqError
+
+from auton.classes.cluster import AutonCluster
+from auton.classes.exceptions import AutonConfigurationError
+from auton.modules.job import JobModule
+
+NODES = ['http://node1:8666', 'http://node2:8666', 'http://node3:8666']
+IDS   = ["job-%04d" % x for x in range(3000)]
+
+
+class AutonClusterTest(unittest.TestCase):
+    def test_missing_node(self):
+        self.assertRaises(AutonConfigurationError, AutonCluster, None, NODES)
+
+    def test_peers(self):
+        cluster = AutonCluster('http://node4:8666/', NODES + ['http://node1:8666/'])
+
+        self.assertEqual(cluster.node, 'http://node4:8666')
+        self.assertEqual(cluster.peers, NODES + ['http://node4:8666'])
+
+    def test_same_owner_on_every_node(self):
+        clusters = [AutonCluster(node, reversed(NODES)) for node in NODES]
+
+        for xid in IDS[:100]:
+            owners = set(cluster.owner(xid) for cluster in clusters)
+            self.assertEqual(len(owners), 1)
+            self.assertEqual(sum(1 for cluster in clusters if cluster.is_local(xid)), 1)
+
+    def test_balanced(self):
+        cluster = AutonCluster(NODES[0], NODES)
+        counts  = Counter(cluster.owner(xid) for xid in IDS)
+
+        for node in NODES:
+            self.assertGreater(counts[node], len(IDS) / len(NODES) * 0.8)
+
+    def test_minimal_disruption(self):
+        # only the jobs of a removed node change of owner
+        before = AutonCluster(NODES[0], NODES)
+        after  = AutonCluster(NODES[0], NODES[:2])
+
+        for xid in IDS:
+            if before.owner(xid) != NODES[2]:
+                self.assertEqual(before.owner(xid), after.owner(xid))
+
+
+class FakeRequest(object): # pylint: disable=useless-object-inheritance
+    def __init__(self, path, params, payload = None):
+        self.path     = path
+        self.params   = params
+        self.payload  = payload
+
+    def query_params(self):
+        return self.params
+
+    def payload_params(self):
+        return self.payload
+
+
+class JobClusterTest(unittest.TestCase):
+    def setUp(self):
+        self.module         = JobModule()
+        self.module.config  = {'general': {'lock_timeout': 1}}
+        self.module.modconf = {'cluster': {'node': NODES[0], 'peers': NODES}}
+        self.module.safe_init(None)
+
+        self.remote         = next(xid for xid in IDS if not self.module.cluster.is_local(xid))
+        self.owner          = self.module.cluster.owner(self.remote)
+
+    def assertRedirect(self, func, request): # pylint: disable=invalid-name
+        with self.assertRaises(HttpReqError) as cm:
+            func(request)
+
+        self.assertEqual(cm.exception.code, 307)
+        self.assertEqual(cm.exception.headers['Location'], self.owner + request.path)
+
+    def test_status(self):
+        path = "/status/test/%s?wait=5" % self.remote
+        self.assertRedirect(self.module.job_status,
+                            FakeRequest(path, {'endpoint': 'test', 'id': self.remote, 'wait': '5'}))
+
+    def test_blobs(self):
+        # the blobs of a job go to its owner
+        path = "/blobs?id=%s" % self.remote
+        self.assertRedirect(self.module.job_blobs,
+                            FakeRequest(path, {'id': self.remote}, {'digests': []}))
+
+    def test_local(self):
+        local = next(xid for xid in IDS if self.module.cluster.is_local(xid))
+
+        with self.assertRaises(HttpReqError) as cm:
+            self.module.job_status(FakeRequest("/status/test/%s" % local,
+                                               {'endpoint': 'test', 'id': local}))
+
+        # answered here, the endpoint is unknown
+        self.assertEqual(cm.exception.code, 404)
+
+
+if __name__ == '__main__':
+    unittest.main()
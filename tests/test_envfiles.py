@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2018-2022 fjord-technologies
+# SPDX-License-Identifier: GPL-3.0-or-later
+"""tests.test_envfiles"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from auton.classes.envfiles import AutonEnvFiles
+
+
+class AutonEnvFilesTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir   = tempfile.mkdtemp()
+        self.path     = os.path.join(self.tmpdir, 'envfile')
+        self.envfiles = AutonEnvFiles()
+        self.write('FOO=bar\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir, True)
+
+    def write(self, data):
+        with open(self.path, 'w') as f:
+            f.write(data)
+
+    def test_cached(self):
+        self.assertEqual(self.envfiles.load(self.path), {'FOO': 'bar'})
+        self.assertIn(self.path, self.envfiles._files) # pylint: disable=protected-access
+
+        # reloaded once changed
+        self.write('FOO=bar2\n')
+        self.assertEqual(self.envfiles.load(self.path), {'FOO': 'bar2'})
+
+    def test_not_cached(self):
+        self.assertEqual(self.envfiles.load(self.path, False), {'FOO': 'bar'})
+        self.assertEqual(self.envfiles._files, {}) # pylint: disable=protected-access
+
+
+if __name__ == '__main__':
+    unittest.main()
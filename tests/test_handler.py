@@ -0,0 +1,285 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2018-2022 fjord-technologies
+# SPDX-License-Identifier: GPL-3.0-or-later
+"""tests.test_handler"""
+
+import json
+import unittest
+import zlib
+
+from email.message import Message
+from io import BytesIO
+
+from six.moves import http_client
+
+from httpdis.httpdis import HttpReqError, HttpResponse, HttpServerContext
+
+from auton.classes.handler import (AutonHttpReqHandler,
+                                   AutonHttpResponseStream,
+                                   AutonUploadStream,
+                                   ENCODINGS,
+                                   compress)
+
+
+def _request(context, method, body = b'', headers = None):
+    # the request is parsed by BaseHTTPRequestHandler, only its result is needed
+    handler                  = AutonHttpReqHandler.__new__(AutonHttpReqHandler)
+    handler._httpdis_context = context # pylint: disable=protected-access
+    handler.command          = method
+    handler.request_version  = 'HTTP/1.1'
+    handler.requestline      = "%s / HTTP/1.1" % method
+    handler.rfile            = BytesIO(body + b'NEXT')
+    handler.wfile            = BytesIO()
+    handler.headers          = Message()
+    handler.headers['Content-Length'] = str(len(body))
+
+    for name, value in (headers or {}).items():
+        handler.headers[name] = value
+
+    return handler
+
+
+class FakeSocket(object): # pylint: disable=useless-object-inheritance
+    def __init__(self, data):
+        self.data = data
+
+    def makefile(self, *args, **kwargs): # pylint: disable=unused-argument
+        return BytesIO(self.data)
+
+
+def _response(handler):
+    response = http_client.HTTPResponse(FakeSocket(handler.wfile.getvalue()))
+    response.begin()
+
+    return (response, response.read())
+
+
+def _gzip(data):
+    return compress(data, 'gzip', 6)
+
+
+class HandlerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.context = HttpServerContext()
+        self.calls   = []
+
+    def route(self, name, op, handler):
+        def func(request):
+            self.calls.append(request)
+            return handler(request)
+
+        func.__name__ = name
+        self.context.register(func, op, name = name)
+
+
+class AutonUploadStreamTest(unittest.TestCase):
+    def test_read(self):
+        rfile  = BytesIO(b'0123456789NEXT')
+        stream = AutonUploadStream(rfile, 10)
+
+        self.assertEqual(stream.read(4), b'0123')
+        self.assertEqual(stream.read(), b'456789')
+        self.assertEqual(stream.read(), b'')
+        self.assertEqual(rfile.read(), b'NEXT')
+
+    def test_drain(self):
+        rfile  = BytesIO(b'0123456789NEXT')
+        stream = AutonUploadStream(rfile, 10)
+
+        stream.read(2)
+        stream.drain(3)
+        self.assertEqual(stream.remaining, 0)
+        self.assertEqual(rfile.read(), b'NEXT')
+
+    def test_incomplete(self):
+        stream = AutonUploadStream(BytesIO(b'0123'), 10)
+
+        self.assertEqual(stream.read(4), b'0123')
+        self.assertRaises(IOError, stream.read)
+
+
+class HandlerUploadTest(HandlerTestCase):
+    def request(self, body, headers = None):
+        return _request(self.context,
+                        'PUT',
+                        body,
+                        dict({'Content-Type': 'application/octet-stream'}, **(headers or {})))
+
+    def test_streamed(self):
+        # the handler reads a part of the body, the rest is drained
+        self.route('upload', 'PUT', lambda request: {'data': request.upload_stream().read(3).decode()})
+
+        handler = self.request(b'x' * 100000)
+        res     = handler.data_from_payload('upload')
+
+        self.assertEqual(json.loads(res), {'data': 'xxx'})
+        self.assertEqual(handler.rfile.read(), b'NEXT')
+        self.assertIsNone(handler.upload_stream())
+        self.assertFalse(handler._body_unread) # pylint: disable=protected-access
+        self.assertIsNone(self.calls[0].payload_params())
+
+    def test_handler_error(self):
+        def upload(request):
+            raise request.req_error(400, "invalid upload")
+
+        self.route('upload', 'PUT', upload)
+
+        handler = self.request(b'x' * 100)
+        with self.assertRaises(HttpReqError) as cm:
+            handler.data_from_payload('upload')
+
+        self.assertEqual(cm.exception.code, 400)
+        self.assertTrue(handler._body_unread) # pylint: disable=protected-access
+        self.assertTrue(handler.close_connection)
+
+    def test_missing_route(self):
+        self.route('upload', 'PUT', lambda request: None)
+
+        with self.assertRaises(HttpReqError) as cm:
+            self.request(b'x').data_from_payload('nope')
+
+        self.assertEqual(cm.exception.code, 404)
+        self.assertEqual(self.calls, [])
+
+    def test_compressed(self):
+        self.route('upload', 'PUT', lambda request: None)
+
+        handler = self.request(b'x', {'Content-Encoding': 'gzip'})
+        with self.assertRaises(HttpReqError) as cm:
+            handler.data_from_payload('upload')
+
+        self.assertEqual(cm.exception.code, 415)
+        self.assertTrue(handler._body_unread) # pylint: disable=protected-access
+        self.assertEqual(self.calls, [])
+
+    def test_json(self):
+        # other bodies are still read and decoded by httpdis
+        self.route('run', 'POST', lambda request: request.payload_params())
+
+        handler = _request(self.context, 'POST', b'{"args": ["a"]}', {'Content-Type': 'application/json'})
+        res     = handler.data_from_payload('run')
+
+        self.assertEqual(json.loads(res), {'args': ['a']})
+        self.assertEqual(handler.rfile.read(), b'NEXT')
+
+
+class HandlerCompressionTest(HandlerTestCase):
+    def setUp(self):
+        HandlerTestCase.setUp(self)
+        self.route('run', 'POST', lambda request: request.payload_params())
+
+    def request(self, body, encoding, ctype = 'application/json'):
+        return _request(self.context,
+                        'POST',
+                        body,
+                        {'Content-Type':     ctype,
+                         'Content-Encoding': encoding})
+
+    def assertError(self, handler, code): # pylint: disable=invalid-name
+        with self.assertRaises(HttpReqError) as cm:
+            handler.data_from_payload('run')
+
+        self.assertEqual(cm.exception.code, code)
+
+        return cm.exception
+
+    def test_gzip(self):
+        payload = {'args': ['a' * 4096]}
+        handler = self.request(_gzip(json.dumps(payload).encode()), 'gzip')
+
+        self.assertEqual(json.loads(handler.data_from_payload('run')), payload)
+        self.assertEqual(handler.rfile.read(), b'NEXT')
+
+    @unittest.skipUnless('zstd' in ENCODINGS, "zstandard unavailable")
+    def test_zstd(self):
+        payload = {'args': ['a' * 4096]}
+        handler = self.request(compress(json.dumps(payload).encode(), 'zstd', 3), 'zstd')
+
+        self.assertEqual(json.loads(handler.data_from_payload('run')), payload)
+
+    def test_max_body_size(self):
+        # limited once decoded
+        self.context.options['max_body_size'] = 1024
+        body    = _gzip(json.dumps({'args': ['a' * 4096]}).encode())
+        self.assertLess(len(body), 1024)
+
+        self.assertError(self.request(body, 'gzip'), 413)
+        self.assertEqual(self.calls, [])
+
+    def test_invalid(self):
+        self.assertError(self.request(b'{"args": []}', 'gzip'), 400)
+        self.assertError(self.request(_gzip(b'{"args": []}')[:-4], 'gzip'), 400)
+        self.assertEqual(self.calls, [])
+
+    def test_unsupported(self):
+        handler = self.request(b'xxxx', 'br')
+        error   = self.assertError(handler, 415)
+
+        self.assertEqual(error.headers['Accept-Encoding'], ', '.join(ENCODINGS))
+        self.assertTrue(handler._body_unread) # pylint: disable=protected-access
+
+    def test_not_json(self):
+        self.assertError(self.request(_gzip(b'a=b'), 'gzip', 'application/x-www-form-urlencoded'), 415)
+
+    def test_disabled(self):
+        handler             = self.request(_gzip(b'{"args": []}'), 'gzip')
+        handler.compression = False
+
+        self.assertEqual(self.assertError(handler, 415).headers['Accept-Encoding'], 'identity')
+
+
+class HandlerResponseTest(HandlerTestCase):
+    def request(self, accept = 'gzip'):
+        return _request(self.context, 'GET', headers = {'Accept-Encoding': accept})
+
+    def test_compressed(self):
+        data             = json.dumps({'stream': ['a' * 4096]})
+        handler          = self.request('zstd;q=0, gzip;q=0.5')
+        handler.end_response(HttpResponse(200, data))
+
+        (response, body) = _response(handler)
+        self.assertEqual(response.getheader('Content-Encoding'), 'gzip')
+        self.assertEqual(response.getheader('Vary'), 'Accept-Encoding')
+        self.assertEqual(int(response.getheader('Content-Length')), len(body))
+        self.assertEqual(zlib.decompress(body, 16 + zlib.MAX_WBITS).decode(), data)
+
+    def test_not_compressed(self):
+        for (accept, data) in (('gzip', '{"code": 200}'),
+                               ('identity', 'a' * 4096),
+                               ('gzip;q=0', 'a' * 4096)):
+            handler          = self.request(accept)
+            handler.end_response(HttpResponse(200, data))
+
+            (response, body) = _response(handler)
+            self.assertIsNone(response.getheader('Content-Encoding'))
+            self.assertEqual(body.decode(), data)
+
+    def test_stream(self):
+        handler                  = self.request()
+        handler.protocol_version = 'HTTP/1.1'
+        handler.end_response(AutonHttpResponseStream(iter(['{"a": 1}\n', '', '{"a": 2}\n'])))
+
+        (response, body)         = _response(handler)
+        self.assertEqual(response.getheader('Transfer-Encoding'), 'chunked')
+        self.assertEqual(response.getheader('Content-Encoding'), 'gzip')
+        self.assertEqual(zlib.decompress(body, 16 + zlib.MAX_WBITS), b'{"a": 1}\n{"a": 2}\n')
+
+    def test_stream_flushed(self):
+        # each line can be decoded as soon as it is received
+        lines                    = iter(['{"a": 1}\n', '{"a": 2}\n'])
+        handler                  = self.request()
+        handler.protocol_version = 'HTTP/1.1'
+
+        def iterator():
+            yield next(lines)
+            (size, chunk) = handler.wfile.getvalue().split(b'\r\n\r\n', 1)[1].split(b'\r\n', 1)
+            chunk         = chunk[:int(size, 16)]
+            obj           = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            self.assertEqual(obj.decompress(chunk), b'{"a": 1}\n')
+            yield next(lines)
+
+        handler.end_response(AutonHttpResponseStream(iterator()))
+
+
+if __name__ == '__main__':
+    unittest.main()
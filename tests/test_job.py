@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2018-2022 fjord-technologies
+# SPDX-License-Identifier: GPL-3.0-or-later
+"""tests.test_job"""
+
+import json
+import unittest
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from auton.classes.exceptions import AutonConfigurationError
+from auton.classes.plugins import (AutonEPTObject,
+                                   AutonJobRequest,
+                                   PHASE_COLLECTED,
+                                   STATUS_COMPLETE,
+                                   STATUS_PROCESSING)
+from auton.modules.job import JobModule
+
+
+def _module(modconf = None):
+    module         = JobModule()
+    module.config  = {'general': {'lock_timeout': 1}}
+    module.modconf = dict({'max_wait': 0.1}, **(modconf or {}))
+    module.safe_init(None)
+
+    return module
+
+
+def _add_job(module, uid):
+    obj = AutonEPTObject('test', uid, 'test', 'run', AutonJobRequest({}))
+    module.registry.get_shard(uid).add(uid, obj)
+
+    return obj
+
+
+class JobStreamTest(unittest.TestCase):
+    def setUp(self):
+        self.module = _module()
+
+    def stream(self, uid):
+        return (json.loads(x) for x in self.module._stream_results(uid, 'utf-8')) # pylint: disable=protected-access
+
+    def test_complete(self):
+        obj    = _add_job(self.module, 'test:job1')
+        stream = self.stream('test:job1')
+
+        obj.set_status(STATUS_PROCESSING)
+        line = next(stream)
+        self.assertEqual(line['status'], STATUS_PROCESSING)
+        self.assertNotIn(PHASE_COLLECTED, line['phases'])
+
+        obj.add_result(b'done\n')
+        obj.set_status(STATUS_COMPLETE)
+        line = next(stream)
+        self.assertEqual(line['status'], STATUS_COMPLETE)
+        self.assertEqual(line['stream'], ['done\n'])
+        self.assertIn(PHASE_COLLECTED, line['phases'])
+
+        self.assertEqual(list(stream), [])
+        self.assertEqual(len(self.module.registry), 0)
+
+    def test_job_lost(self):
+        obj    = _add_job(self.module, 'test:job1')
+        stream = self.stream('test:job1')
+
+        obj.set_status(STATUS_PROCESSING)
+        self.assertEqual(next(stream)['status'], STATUS_PROCESSING)
+
+        # removed by the reaper while streamed
+        self.module.registry.remove('test:job1')
+        line = next(stream)
+        self.assertEqual(line['code'], 404)
+        self.assertEqual(line['uid'], 'test:job1')
+        self.assertIn('message', line)
+
+        self.assertEqual(list(stream), [])
+
+
+class JobCollectTest(unittest.TestCase):
+    def setUp(self):
+        self.module = _module()
+        self.sync   = mock.Mock()
+        patcher     = mock.patch.dict('auton.modules.job.EPTS_SYNC', {'test': self.sync})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_status(self):
+        # collected the first time its complete result is returned, not when it ends
+        obj         = _add_job(self.module, 'test:job1')
+        obj.outcome = 'success'
+        obj.set_status(STATUS_COMPLETE)
+        self.assertNotIn(PHASE_COLLECTED, obj.get_phases())
+
+        r           = self.module._fetch_result('test:job1') # pylint: disable=protected-access
+        self.assertIn(PHASE_COLLECTED, r['phases'])
+        self.assertEqual(len(self.module.registry), 0)
+        self.sync.report_phases.assert_called_once_with(obj)
+
+        self.assertFalse(obj.collect())
+
+    def test_not_run(self):
+        # e.g. found in the result cache
+        _add_job(self.module, 'test:job1').set_status(STATUS_COMPLETE)
+
+        self.assertIn(PHASE_COLLECTED, self.module._fetch_result('test:job1')['phases']) # pylint: disable=protected-access
+        self.assertFalse(self.sync.report_phases.called)
+
+    def test_expired(self):
+        # reported by the reaper if never collected
+        obj         = _add_job(self.module, 'test:job1')
+        obj.outcome = 'failure'
+        obj.set_ended_at()
+        obj.set_status(STATUS_COMPLETE)
+        self.module.retention = 0
+
+        with mock.patch('time.sleep', side_effect = [None, SystemExit]):
+            self.assertRaises(SystemExit, self.module._reaper) # pylint: disable=protected-access
+
+        self.assertEqual(len(self.module.registry), 0)
+        self.assertNotIn(PHASE_COLLECTED, obj.get_phases())
+        self.sync.report_phases.assert_called_once_with(obj)
+
+
+class JobStartTest(unittest.TestCase):
+    @mock.patch('auton.modules.job.DWHO_THREADS', [])
+    @mock.patch('threading.Thread')
+    def test_start_once(self, thread):
+        module         = _module()
+        module.journal = mock.Mock()
+        module.journal.replay.return_value = []
+
+        # by autond, then by a route flagged at_start
+        module.start()
+        module.at_start(None)
+
+        self.assertEqual(module.journal.open.call_count, 1)
+        self.assertEqual(module.journal.start.call_count, 1)
+        self.assertEqual(thread.return_value.start.call_count, 1)
+
+    def test_start_not_initialized(self):
+        self.assertRaises(AutonConfigurationError, JobModule().start)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2018-2022 fjord-technologies
+# SPDX-License-Identifier: GPL-3.0-or-later
+"""tests.test_journal"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from auton.classes.journal import AutonJournal
+from auton.classes.plugins import (AutonEPTObject,
+                                   AutonJobRequest,
+                                   STATUS_COMPLETE,
+                                   STATUS_NEW,
+                                   STATUS_PROCESSING)
+
+
+class AutonJournalTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir  = tempfile.mkdtemp()
+        self.path    = os.path.join(self.tmpdir, 'journal', 'auton.db')
+        self.journal = self._open()
+
+    def tearDown(self):
+        self.journal.stop()
+        shutil.rmtree(self.tmpdir, True)
+
+    def _open(self):
+        journal = AutonJournal(self.path)
+        journal.open()
+
+        return journal
+
+    def _reopen(self):
+        self.journal.stop()
+        self.journal = self._open()
+
+        return self.journal.replay()
+
+    def _submit(self, uid, payload, **kwargs):
+        obj = AutonEPTObject('curl',
+                             uid,
+                             'curl',
+                             'run',
+                             AutonJobRequest(payload, {'HTTP_AUTH_USER': 'foo'}),
+                             **kwargs)
+
+        self.assertTrue(self.journal.submit(obj).wait(5))
+        obj.set_journal(self.journal)
+
+        return obj
+
+    def test_empty(self):
+        self.assertEqual(self.journal.replay(), [])
+
+    def test_replay(self):
+        self.journal.start()
+
+        obj = self._submit('curl:job1', {'args': ['-sS']}, priority = 2, deadline = 1234.5)
+        obj.set_status(STATUS_PROCESSING)
+        obj.add_result(b'line 1\n')
+        obj.add_error(u'warning\n')
+        obj.add_result(b'line 2\n')
+        obj.set_return_code(0)
+        obj.set_ended_at()
+        obj.set_status(STATUS_COMPLETE)
+
+        self._submit('curl:job2', {'args': []})
+
+        jobs = self._reopen()
+
+        self.assertEqual([x['uid'] for x in jobs], ['curl:job1', 'curl:job2'])
+        self.assertEqual(jobs[0]['endpoint'], 'curl')
+        self.assertEqual(jobs[0]['method'], 'run')
+        self.assertEqual(jobs[0]['status'], STATUS_COMPLETE)
+        self.assertEqual(jobs[0]['return_code'], 0)
+        self.assertEqual(jobs[0]['ended_at'], obj.get_ended_at())
+        self.assertEqual(jobs[0]['results'], [b'line 1\n', b'line 2\n'])
+        self.assertEqual(jobs[0]['errors'], [b'warning\n'])
+        self.assertEqual(jobs[0]['request']['payload'], {'args': ['-sS']})
+        self.assertEqual(jobs[0]['request']['user'], 'foo')
+        self.assertEqual(jobs[0]['request']['priority'], 2)
+        self.assertEqual(jobs[0]['request']['deadline'], 1234.5)
+        self.assertEqual(jobs[1]['status'], STATUS_NEW)
+        self.assertEqual(jobs[1]['results'], [])
+
+    def test_remove(self):
+        self.journal.start()
+
+        obj = self._submit('curl:job1', {})
+        obj.add_result(b'output\n')
+        self._submit('curl:job2', {})
+        obj.close()
+
+        self.assertEqual([x['uid'] for x in self._reopen()], ['curl:job2'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2018-2022 fjord-technologies
+# SPDX-License-Identifier: GPL-3.0-or-later
+"""tests.test_launcher"""
+
+import errno
+import os
+import sys
+import tempfile
+import time
+import unittest
+
+from auton.classes.launcher import (AutonLauncher,
+                                    AutonPopen,
+                                    AutonProcess,
+                                    AutonRemoteProcess,
+                                    LAUNCHER_FORKSERVER,
+                                    LAUNCHER_POPEN,
+                                    LAUNCHER_POSIX_SPAWN)
+
+NOFILE = "import resource; print(resource.getrlimit(resource.RLIMIT_NOFILE))"
+
+
+def _launcher(mode, rlimits = False):
+    launcher = AutonLauncher()
+    launcher.configure(mode)
+
+    if rlimits:
+        launcher.use_rlimits()
+
+    launcher.start()
+
+    return launcher
+
+
+def _wait(proc):
+    output = proc.stdout.read()
+    errors = proc.stderr.read()
+    proc.stdout.close()
+    proc.stderr.close()
+
+    # the exit of a child of the fork server is reported asynchronously
+    for x in range(500): # pylint: disable=unused-variable
+        if proc.poll() is not None:
+            break
+        time.sleep(0.01)
+
+    return (proc.returncode, output, errors)
+
+
+class AutonLauncherTest(unittest.TestCase):
+    def spawn(self, launcher, script, cwd = None, rlimits = None):
+        return launcher.spawn([sys.executable, '-c', script], dict(os.environ), cwd, rlimits)
+
+    def assertRun(self, launcher, cls, cwd = None, rlimits = None): # pylint: disable=invalid-name
+        proc                     = self.spawn(launcher,
+                                              "import os, sys; print(os.getcwd()); sys.exit(3)",
+                                              cwd,
+                                              rlimits)
+        self.assertIsInstance(proc, cls)
+
+        (code, output, errors)   = _wait(proc)
+        self.assertEqual(code, 3)
+        self.assertEqual(output.decode().strip(), os.path.realpath(cwd or os.getcwd()))
+        self.assertEqual(errors, b'')
+        self.assertGreaterEqual(proc.rusage['maxrss'], 0)
+
+    def assertNofile(self, launcher, cls): # pylint: disable=invalid-name
+        proc                     = self.spawn(launcher, NOFILE, rlimits = {'nofile': 64})
+        self.assertIsInstance(proc, cls)
+
+        (code, output, errors)   = _wait(proc) # pylint: disable=unused-variable
+        self.assertEqual(code, 0)
+        self.assertEqual(output.decode().strip(), '(64, 64)')
+
+    def test_popen(self):
+        launcher = _launcher(LAUNCHER_POPEN)
+
+        self.assertIsNone(launcher.forkserver)
+        self.assertRun(launcher, AutonPopen)
+        self.assertRun(launcher, AutonPopen, tempfile.gettempdir())
+
+    @unittest.skipUnless(hasattr(os, 'posix_spawn'), "posix_spawn unavailable")
+    def test_posix_spawn(self):
+        # without fork server, the jobs with a workdir use subprocess
+        launcher = AutonLauncher()
+        launcher.configure(LAUNCHER_POSIX_SPAWN)
+
+        self.assertRun(launcher, AutonProcess)
+        self.assertRun(launcher, AutonPopen, tempfile.gettempdir())
+
+        with self.assertRaises(OSError) as cm:
+            launcher.spawn(['auton-nonexistent'], {'PATH': os.defpath})
+        self.assertEqual(cm.exception.errno, errno.ENOENT)
+
+    def test_forkserver(self):
+        launcher = _launcher(LAUNCHER_FORKSERVER)
+
+        self.assertIsNotNone(launcher.forkserver)
+        self.assertRun(launcher, AutonRemoteProcess)
+        self.assertRun(launcher, AutonRemoteProcess, tempfile.gettempdir())
+
+        with self.assertRaises(OSError) as cm:
+            launcher.spawn(['auton-nonexistent'], {'PATH': os.defpath})
+        self.assertEqual(cm.exception.errno, errno.ENOENT)
+
+    def test_rlimits_forkserver(self):
+        # started for the resource limits only
+        launcher = _launcher(LAUNCHER_POPEN, rlimits = True)
+
+        self.assertIsNotNone(launcher.forkserver)
+        self.assertRun(launcher, AutonPopen)
+        self.assertNofile(launcher, AutonRemoteProcess)
+
+    def test_rlimits_popen(self):
+        # endpoint with resource limits added after the start
+        launcher = _launcher(LAUNCHER_POPEN)
+        launcher.use_rlimits()
+
+        self.assertIsNone(launcher.forkserver)
+        self.assertNofile(launcher, AutonPopen)
+
+
+if __name__ == '__main__':
+    unittest.main()
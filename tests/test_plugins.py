@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2018-2022 fjord-technologies
+# SPDX-License-Identifier: GPL-3.0-or-later
+"""tests.test_plugins"""
+
+import unittest
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from six.moves import queue as _queue
+
+from auton.classes.exceptions import AutonEndpointClosed
+from auton.classes.plugins import AutonEPTObject, AutonEPTSync
+
+
+def _job(uid, priority = 0):
+    return AutonEPTObject('test', uid, 'test', 'run', None, priority = priority)
+
+
+class AutonEPTSyncTest(unittest.TestCase):
+    def setUp(self):
+        self.sync = AutonEPTSync('test', aging = 60)
+
+    def qput(self, item, now):
+        with mock.patch('time.time', return_value = now):
+            return self.sync.qput(item)
+
+    def drain(self):
+        r = []
+        while self.sync.qsize():
+            r.append(self.sync.qget(False).get_uid())
+
+        return r
+
+    def test_fifo(self):
+        for i, uid in enumerate(('a', 'b', 'c')):
+            self.qput(_job(uid), 1000 + i)
+
+        self.assertEqual(self.drain(), ['a', 'b', 'c'])
+
+    def test_priority(self):
+        self.qput(_job('low'), 1000)
+        self.qput(_job('high', 1), 1001)
+
+        self.assertEqual(self.drain(), ['high', 'low'])
+
+    def test_aging(self):
+        # queued more than priority * aging seconds earlier
+        self.qput(_job('old'), 1000)
+        self.qput(_job('high', 1), 1061)
+
+        self.assertEqual(self.drain(), ['old', 'high'])
+
+    def test_position(self):
+        jobs = [_job('a'), _job('b', 1)]
+        self.qput(jobs[0], 1000)
+        self.qput(jobs[1], 1001)
+
+        self.assertEqual(self.sync.position(jobs[1]), 1)
+        self.assertEqual(self.sync.position(jobs[0]), 2)
+        self.assertIsNone(self.sync.position(_job('c')))
+
+    def test_max_queue(self):
+        self.sync.max_queue = 2
+        self.qput(_job('a'), 1000)
+        self.qput(_job('b'), 1001)
+
+        self.assertRaises(_queue.Full, self.qput, _job('c'), 1002)
+
+        self.sync.qget(False)
+        self.assertTrue(self.qput(_job('c'), 1003))
+
+    def test_closed(self):
+        self.sync.close()
+
+        self.assertRaises(AutonEndpointClosed, self.qput, _job('a'), 1000)
+        self.assertRaises(AutonEndpointClosed, self.sync.qget, False)
+
+    def test_empty(self):
+        self.assertRaises(_queue.Empty, self.sync.qget, False)
+        self.assertRaises(_queue.Empty, self.sync.qget, True, 0.01)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2018-2022 fjord-technologies
+# SPDX-License-Identifier: GPL-3.0-or-later
+"""tests.test_registry"""
+
+import unittest
+
+from auton.classes.registry import AutonJobRegistry
+
+
+class FakeJob(object): # pylint: disable=useless-object-inheritance
+    def __init__(self, complete = False, ended_at = None):
+        self.complete = complete
+        self.ended_at = ended_at
+        self.closed   = False
+
+    def is_complete(self):
+        return self.complete
+
+    def get_ended_at(self):
+        return self.ended_at
+
+    def close(self):
+        self.closed = True
+
+
+class AutonJobRegistryTest(unittest.TestCase):
+    def setUp(self):
+        self.registry = AutonJobRegistry(shards = 4, max_jobs = 8)
+
+    def add(self, uid, job):
+        return self.registry.get_shard(uid).add(uid, job)
+
+    def test_shard_share(self):
+        self.assertEqual([x.max_jobs for x in self.registry.shards], [2, 2, 2, 2])
+        self.assertEqual([x.max_jobs for x in AutonJobRegistry(4, 0).shards], [0, 0, 0, 0])
+
+    def test_evicts_least_recently_used(self):
+        shard = self.registry.shards[0]
+        jobs  = [FakeJob(True), FakeJob(True)]
+        shard.add('a', jobs[0])
+        shard.add('b', jobs[1])
+        shard.get('a')
+
+        self.assertTrue(shard.add('c', FakeJob()))
+        self.assertEqual(list(shard.objs), ['a', 'c'])
+        self.assertTrue(jobs[1].closed)
+        self.assertEqual(self.registry.counters['evictions'], 1)
+
+    def test_shard_over_share(self):
+        # a full shard still accepts jobs while the registry is not full
+        shard = self.registry.shards[0]
+        for i in range(8):
+            self.assertTrue(shard.add("job-%d" % i, FakeJob()))
+
+        self.assertEqual(len(self.registry), 8)
+        self.assertFalse(shard.add('job-8', FakeJob()))
+
+    def test_evicts_from_other_shards(self):
+        shard = self.registry.shards[0]
+        other = FakeJob(True)
+        self.registry.shards[1].add('done', other)
+        for i in range(7):
+            shard.add("job-%d" % i, FakeJob())
+
+        self.assertTrue(shard.add('job-7', FakeJob()))
+        self.assertTrue(other.closed)
+        self.assertEqual(len(self.registry), 8)
+
+    def test_remove(self):
+        job = FakeJob(True)
+        self.add('a', job)
+
+        self.assertIsNone(self.registry.remove('a', FakeJob(True)))
+        self.assertIs(self.registry.remove('a', job), job)
+        self.assertEqual(len(self.registry), 0)
+
+    def test_expire(self):
+        jobs = {'old':     FakeJob(True, 100),
+                'recent':  FakeJob(True, 200),
+                'running': FakeJob()}
+        for uid, job in jobs.items():
+            self.add(uid, job)
+
+        self.registry.expire(150)
+
+        self.assertTrue(jobs['old'].closed)
+        self.assertEqual(len(self.registry), 2)
+        self.assertEqual(self.registry.counters['expirations'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
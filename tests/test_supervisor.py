@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2018-2022 fjord-technologies
+# SPDX-License-Identifier: GPL-3.0-or-later
+"""tests.test_supervisor"""
+
+import subprocess
+import sys
+import time
+import unittest
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from auton.classes.plugins import PHASE_DRAINED, PHASE_EXITED, PHASE_FIRST_BYTE
+from auton.classes.supervisor import AutonSupervisor, AutonWatch, STREAM_RESULT, _utf8_cut
+
+
+class FakeProc(object): # pylint: disable=useless-object-inheritance
+    stdout = None
+    stderr = None
+
+
+class FakeObj(object): # pylint: disable=useless-object-inheritance
+    def __init__(self):
+        self.results = []
+        self.errors  = []
+        self.phases  = []
+
+    def add_result(self, data):
+        self.results.append(data)
+
+    def add_error(self, data):
+        self.errors.append(data)
+
+    def mark(self, phase):
+        self.phases.append(phase)
+
+
+def _spawn(script):
+    return subprocess.Popen([sys.executable, '-c', script],
+                            stdout = subprocess.PIPE,
+                            stderr = subprocess.PIPE)
+
+
+class AutonSupervisorTest(unittest.TestCase):
+    def setUp(self):
+        self.supervisor = AutonSupervisor()
+
+    def watch(self, script, timeout = None):
+        proc  = _spawn(script)
+        watch = self.supervisor.watch(proc, FakeObj(), timeout)
+        self.assertTrue(watch.wait(10))
+
+        return watch
+
+    def assertFinished(self, watch): # pylint: disable=invalid-name
+        self.assertTrue(watch.closed)
+        self.assertEqual(watch.streams, {})
+        self.assertIsNone(watch.pidfd)
+        self.assertNotIn(watch, self.supervisor._watches) # pylint: disable=protected-access
+        self.assertEqual(watch.obj.phases[-1], PHASE_DRAINED)
+
+    def test_output(self):
+        watch = self.watch("import sys; sys.stdout.write('a\\nb\\n'); sys.stderr.write('err\\n')")
+
+        self.assertEqual(b''.join(watch.obj.results), b'a\nb\n')
+        self.assertEqual(watch.obj.errors, [b'err\n'])
+        self.assertEqual(watch.proc.returncode, 0)
+        self.assertFalse(watch.timed_out)
+        self.assertIn(PHASE_FIRST_BYTE, watch.obj.phases)
+        self.assertIn(PHASE_EXITED, watch.obj.phases)
+        self.assertFinished(watch)
+
+    def test_return_code(self):
+        watch = self.watch("import sys; sys.exit(3)")
+
+        self.assertEqual(watch.proc.returncode, 3)
+        self.assertFinished(watch)
+
+    def test_timeout(self):
+        start = time.time()
+        watch = self.watch("import time; time.sleep(30)", timeout = 0.2)
+
+        self.assertTrue(watch.timed_out)
+        self.assertIsNotNone(watch.proc.returncode)
+        self.assertLess(time.time() - start, 5)
+        self.assertFinished(watch)
+
+    @mock.patch('auton.classes.supervisor.DEFAULT_DRAIN_TIMEOUT', 0.2)
+    def test_timeout_sigterm_ignored(self):
+        watch = self.watch("import signal, time\n"
+                           "signal.signal(signal.SIGTERM, signal.SIG_IGN)\n"
+                           "print('ready')\n"
+                           "import sys; sys.stdout.flush()\n"
+                           "time.sleep(30)",
+                           timeout = 0.5)
+
+        self.assertTrue(watch.timed_out)
+        self.assertEqual(watch.proc.returncode, -9)
+        self.assertFinished(watch)
+
+    def test_wall_clock_step(self):
+        # a step of the wall clock must not fire the timeout
+        real   = time.time
+        offset = [0]
+
+        with mock.patch('time.time', lambda: real() + offset[0]):
+            proc  = _spawn("import time; time.sleep(0.5)")
+            watch = self.supervisor.watch(proc, FakeObj(), 5)
+            time.sleep(0.1)
+            offset[0] = 3600
+            self.assertTrue(watch.wait(10))
+
+        self.assertFalse(watch.timed_out)
+        self.assertEqual(watch.proc.returncode, 0)
+
+
+class Utf8CutTest(unittest.TestCase):
+    def test_ascii(self):
+        self.assertEqual(_utf8_cut(bytearray(b'abcd')), 4)
+
+    def test_empty(self):
+        self.assertEqual(_utf8_cut(bytearray(b'')), 0)
+
+    def test_complete_sequences(self):
+        for char in (u'é', u'€', u'\U0001f600'):
+            data = bytearray(u"ab{}".format(char).encode('utf-8'))
+            self.assertEqual(_utf8_cut(data), len(data))
+
+    def test_truncated_sequences(self):
+        for char in (u'é', u'€', u'\U0001f600'):
+            encoded = char.encode('utf-8')
+            for i in range(1, len(encoded)):
+                data = bytearray(b'ab' + encoded[:i])
+                self.assertEqual(_utf8_cut(data), 2)
+
+    def test_invalid_bytes(self):
+        # continuation bytes without lead byte are left untouched
+        self.assertEqual(_utf8_cut(bytearray(b'\x80\x80')), 2)
+
+
+class AutonWatchFeedTest(unittest.TestCase):
+    def setUp(self):
+        self.watch = AutonWatch(FakeProc(), FakeObj(), max_line = 8)
+        self.watch.streams[3] = [None, STREAM_RESULT, bytearray()]
+
+    def feed(self, *chunks):
+        for chunk in chunks:
+            self.watch.feed(3, bytearray(chunk))
+
+        return self.watch.obj.results
+
+    def pending(self):
+        return bytes(self.watch.streams[3][2])
+
+    def test_complete_lines(self):
+        self.assertEqual(self.feed(b'ab\ncd\n'), [b'ab\ncd\n'])
+        self.assertEqual(self.pending(), b'')
+
+    def test_partial_line(self):
+        self.assertEqual(self.feed(b'ab\ncd', b'ef\n'), [b'ab\n', b'cdef\n'])
+
+    def test_long_complete_line(self):
+        self.assertEqual(self.feed(b'a\n0123456789ABCDEF\nxy\n12'),
+                         [b'a\n', b'01234567', b'89ABCDEF', b'\nxy\n'])
+        self.assertEqual(self.pending(), b'12')
+
+    def test_long_pending_line(self):
+        self.assertEqual(self.feed(b'0123456789'), [b'01234567'])
+        self.assertEqual(self.pending(), b'89')
+
+    def test_split_keeps_utf8_sequences(self):
+        r = self.feed(u'aaaaaaéé\n'.encode('utf-8'))
+        self.assertEqual(r, [u'aaaaaaé'.encode('utf-8'), u'é\n'.encode('utf-8')])
+
+    def test_size(self):
+        self.watch.feed(3, bytearray(b'ab\ncd\nef'), 5)
+        self.assertEqual(self.watch.obj.results, [b'ab\n'])
+        self.assertEqual(self.pending(), b'cd')
+
+
+if __name__ == '__main__':
+    unittest.main()
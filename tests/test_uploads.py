@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2018-2022 fjord-technologies
+# SPDX-License-Identifier: GPL-3.0-or-later
+"""tests.test_uploads"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from io import BytesIO
+
+from auton.classes.uploads import AutonUploads, READ_SIZE
+
+
+class AutonUploadsTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir  = tempfile.mkdtemp()
+        self.uploads = AutonUploads(self.tmpdir, max_files = 2)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir, True)
+
+    def test_store(self):
+        data         = os.urandom(READ_SIZE * 2 + 1)
+        (path, size) = self.uploads.store('test:job1', 'file', 'data.bin', BytesIO(data))
+
+        self.assertEqual(size, len(data))
+        self.assertEqual(os.path.basename(path), 'data.bin')
+        self.assertTrue(path.startswith(self.tmpdir))
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), data)
+
+        self.assertEqual(self.uploads.get('test:job1').get_files(), {'file': path})
+
+    def test_filename(self):
+        # neither a path nor an empty name leaves the upload directory
+        (path1, _) = self.uploads.store('test:job1', 'a', '../../etc/passwd', BytesIO(b'a'))
+        (path2, _) = self.uploads.store('test:job1', 'b', '', BytesIO(b'b'))
+
+        updir      = self.uploads.get('test:job1').tmpdir
+        self.assertEqual(path1, os.path.join(updir, 'a', 'passwd'))
+        self.assertEqual(path2, os.path.join(updir, 'b', 'b'))
+
+    def test_max_files(self):
+        self.uploads.store('test:job1', 'a', 'a', BytesIO(b'a'))
+        self.uploads.store('test:job1', 'b', 'b', BytesIO(b'b'))
+
+        self.assertRaises(OverflowError,
+                          self.uploads.store, 'test:job1', 'c', 'c', BytesIO(b'c'))
+
+        # replacing an upload is not a new file
+        self.uploads.store('test:job1', 'a', 'a', BytesIO(b'A'))
+        self.uploads.store('test:job2', 'c', 'c', BytesIO(b'c'))
+
+    def test_release(self):
+        (path, _) = self.uploads.store('test:job1', 'a', 'a', BytesIO(b'a'))
+        updir     = self.uploads.release('test:job1')
+
+        self.assertEqual(updir.get_files(), {'a': path})
+        self.assertIsNone(self.uploads.get('test:job1'))
+        self.assertTrue(os.path.isfile(path))
+
+        self.uploads.expire(updir.created_at + 1)
+        self.assertTrue(os.path.isfile(path))
+
+    def test_expire(self):
+        (path, _) = self.uploads.store('test:job1', 'a', 'a', BytesIO(b'a'))
+        updir     = self.uploads.get('test:job1')
+
+        self.uploads.expire(updir.created_at - 1)
+        self.assertTrue(os.path.isfile(path))
+
+        self.uploads.expire(updir.created_at)
+        self.assertIsNone(self.uploads.get('test:job1'))
+        self.assertFalse(os.path.exists(updir.tmpdir))
+
+
+if __name__ == '__main__':
+    unittest.main()